@@ -0,0 +1,259 @@
+"""
+生成熱點的效能基準測試
+固定種子、不經過 input() 的測試語言，量測：
+- PhonologySystem.generate_word（不同音素庫存大小、叢集設定、音節數）
+- MorphologySystem.apply_rules / apply_morphology
+- LanguageCreatorGame.apply_def_article
+- SyntaxSystem.generate_sentence（六種語序）
+- GrammarEngine.generate（依權重或均勻抽樣）
+每個項目回報 ops/sec、延遲百分位數與記憶體峰值，結果存成 JSON 方便比較
+
+用法：
+    python benchmark.py --sizes 1000 10000 100000 --output bench.json
+    python benchmark.py --sizes 1000 --filter generate_word --compare bench.json
+"""
+import argparse
+import gc
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+from french import WORD_ORDER_FORMATS, GrammarEngine, LanguageCreatorGame, PhonologySystem
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+
+# 音素庫存大小（子音, 母音）
+INVENTORIES = {
+    'small': ({'b', 'd', 'k', 'm', 's', 't'}, {'a', 'i', 'u', 'é'}),
+    'default': (None, None),
+    'large': ({'b', 'c', 'd', 'f', 'g', 'h', 'j', 'k', 'l', 'm', 'n', 'p', 'q', 'r', 's', 't', 'v', 'w', 'x', 'z',
+               'ch', 'gn', 'ph', 'th'},
+              {'a', 'e', 'i', 'o', 'u', 'y', 'à', 'è', 'ù', 'é', 'ê', 'ou', 'eau', 'oi'}),
+}
+
+CLUSTER_SETS = {
+    'none': {},
+    'clusters': {'onset_clusters': {'tr', 'pl', 'st'}, 'vowel_clusters': {'ou', 'ai', 'éa'}},
+}
+
+SPEC = {
+    'phonology': {'coda_restrictions': ['r', 's', 'l', 'n']},
+    'morphology': {'plural': 's', 'definite_articles': ['le', 'la', 'les'], 'negative': ['ne', 'pas']},
+    'syntax': {'word_order': 'SVO', 'question_marker': '?'},
+    'vocabulary': {'noun': 500, 'verb': 200, 'adjective': 100},
+}
+
+
+def make_phonology(inventory: str, clusters: str) -> PhonologySystem:
+    consonants, vowels = INVENTORIES[inventory]
+    phonology = PhonologySystem()
+    if consonants is not None:
+        phonology.consonants = set(consonants)
+        phonology.vowels = set(vowels)
+    for name, value in CLUSTER_SETS[clusters].items():
+        # 只保留在這個庫存中合法的叢集
+        inventory_set = phonology.consonants if name == 'onset_clusters' else phonology.vowels
+        setattr(phonology, name, {c for c in value if all(ch in inventory_set for ch in c)})
+    return phonology
+
+
+def make_game(seed: int) -> LanguageCreatorGame:
+    return LanguageCreatorGame.from_spec(SPEC, random.Random(seed))
+
+
+def build_cases(seed: int) -> Dict[str, Callable[[], Callable[[], object]]]:
+    """{名稱: 建立測試函式的工廠}，工廠每次都用同一個種子重建，讓每個大小的結果可以重現"""
+    cases = {}
+
+    for inventory in INVENTORIES:
+        for clusters in CLUSTER_SETS:
+            for syllables in (1, 2, 3):
+                def factory(inventory=inventory, clusters=clusters, syllables=syllables):
+                    phonology = make_phonology(inventory, clusters)
+                    rng = random.Random(seed)
+                    return lambda: phonology.generate_word(syllables, rng)
+                cases[f"generate_word[{inventory},{clusters},{syllables}syl]"] = factory
+
+    def words_of(word_class):
+        def pick(game):
+            rng = random.Random(seed)
+            words = list(game.vocabulary[word_class])
+            return lambda: rng.choice(words)
+        return pick
+
+    for word_class in ('noun', 'verb'):
+        def factory(word_class=word_class):
+            game = make_game(seed)
+            pick = words_of(word_class)(game)
+            apply_rules = game.morphology.apply_rules
+            return lambda: apply_rules(pick(), word_class)
+        cases[f"apply_rules[{word_class}]"] = factory
+
+    def apply_morphology_factory():
+        game = make_game(seed)
+        pick = words_of('noun')(game)
+        apply_morphology = game.morphology.apply_morphology
+        return lambda: apply_morphology(pick(), "plural")
+    cases["apply_morphology[plural]"] = apply_morphology_factory
+
+    def apply_def_article_factory():
+        game = make_game(seed)
+        pick = words_of('noun')(game)
+        rng = random.Random(seed)
+        return lambda: game.apply_def_article(pick(), rng)
+    cases["apply_def_article"] = apply_def_article_factory
+
+    for order in WORD_ORDER_FORMATS:
+        def factory(order=order):
+            game = make_game(seed)
+            game.syntax.word_order = order
+            nouns = words_of('noun')(game)
+            verbs = words_of('verb')(game)
+            generate_sentence = game.syntax.generate_sentence
+            return lambda: generate_sentence(nouns(), verbs(), nouns())
+        cases[f"generate_sentence[{order}]"] = factory
+
+    for mode in ('weighted', 'uniform'):
+        def factory(mode=mode):
+            engine = GrammarEngine.from_game(make_game(seed), mode)
+            rng = random.Random(seed)
+            return lambda: engine.generate(1, rng)
+        cases[f"grammar[{mode}]"] = factory
+
+    return cases
+
+
+def percentile(sorted_values: List[int], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(q / 100 * (len(sorted_values) - 1))))
+    return float(sorted_values[index])
+
+
+def measure(factory: Callable, n: int, latency_samples: int, memory_samples: int) -> Dict[str, float]:
+    """
+    三次獨立的量測（互不干擾）：
+    1. 連續呼叫 n 次的總時間 → ops/sec
+    2. 逐次計時前 latency_samples 次 → 延遲百分位數（奈秒）
+    3. 在 tracemalloc 下呼叫 memory_samples 次並保留結果 → 記憶體峰值
+    """
+    fn = factory()
+    gc.collect()
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+    elapsed = time.perf_counter() - start
+
+    fn = factory()
+    clock = time.perf_counter_ns
+    latencies = []
+    for _ in range(min(n, latency_samples)):
+        t0 = clock()
+        fn()
+        latencies.append(clock() - t0)
+    latencies.sort()
+
+    fn = factory()
+    memory_n = min(n, memory_samples)
+    gc.collect()
+    tracemalloc.start()
+    results = [fn() for _ in range(memory_n)]
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del results
+
+    return {
+        'n': n,
+        'seconds': elapsed,
+        'ops_per_sec': n / elapsed if elapsed else float('inf'),
+        'p50_ns': percentile(latencies, 50),
+        'p90_ns': percentile(latencies, 90),
+        'p99_ns': percentile(latencies, 99),
+        'max_ns': float(latencies[-1]) if latencies else 0.0,
+        'memory_items': memory_n,
+        'peak_bytes': peak,
+        'bytes_per_item': peak / memory_n if memory_n else 0.0,
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def run(sizes: List[int], seed: int = 0, name_filter: str = None, latency_samples: int = 100_000,
+        memory_samples: int = 100_000) -> dict:
+    """執行所有（或名稱包含 name_filter 的）項目，回傳可以存成 JSON 的結果"""
+    results = []
+    for name, factory in build_cases(seed).items():
+        if name_filter and name_filter not in name:
+            continue
+        for n in sizes:
+            record = measure(factory, n, latency_samples, memory_samples)
+            record['name'] = name
+            results.append(record)
+            print(f"{name:<45} n={n:<10} {record['ops_per_sec']:>14,.0f} ops/s  "
+                  f"p50={record['p50_ns']:>8,.0f}ns  p99={record['p99_ns']:>8,.0f}ns  "
+                  f"peak={record['peak_bytes'] / 1024:>10,.1f}KiB", file=sys.stderr)
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'revision': git_revision(),
+            'seed': seed,
+            'sizes': sizes,
+            'latency_samples': latency_samples,
+            'memory_samples': memory_samples,
+        },
+        'results': results,
+    }
+
+
+def compare(baseline: dict, current: dict) -> List[str]:
+    """列出兩次結果中相同項目、相同大小的 ops/sec 比值（> 1 表示變快）"""
+    before = {(r['name'], r['n']): r for r in baseline['results']}
+    lines = []
+    for record in current['results']:
+        old = before.get((record['name'], record['n']))
+        if old is None:
+            continue
+        ratio = record['ops_per_sec'] / old['ops_per_sec'] if old['ops_per_sec'] else float('inf')
+        lines.append(f"{record['name']:<45} n={record['n']:<10} {ratio:6.2f}x  "
+                     f"({old['ops_per_sec']:,.0f} → {record['ops_per_sec']:,.0f} ops/s)")
+    return lines
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="語言創造者的效能基準測試")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help="每個項目的呼叫次數（可到 10000000）")
+    parser.add_argument('--seed', type=int, default=0, help="亂數種子")
+    parser.add_argument('--filter', dest='name_filter', help="只跑名稱包含此字串的項目")
+    parser.add_argument('--latency-samples', type=int, default=100_000, help="逐次計時的呼叫次數上限")
+    parser.add_argument('--memory-samples', type=int, default=100_000, help="量測記憶體時的呼叫次數上限")
+    parser.add_argument('--output', help="把結果存成 JSON")
+    parser.add_argument('--compare', help="與之前存下的 JSON 結果比較")
+    args = parser.parse_args(argv)
+
+    report = run(args.sizes, args.seed, args.name_filter, args.latency_samples, args.memory_samples)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        for line in compare(baseline, report):
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,38 @@
 import random
 import re
-from typing import List, Dict, Set, Tuple
+import copy
+import csv
+import gzip
+import hashlib
+import io
+import itertools
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from bisect import bisect_right
+from collections import Counter
+from functools import lru_cache
+import argparse
+import asyncio
+import base64
+import secrets
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, List, Dict, Set, Tuple, Iterable, Iterator, Optional
 from dataclasses import dataclass, field
-from collections import defaultdict
+
+try:
+    import numpy as np
+except ImportError:  # 只有向量化生成需要 numpy
+    np = None
+
+try:
+    import tomllib
+except ImportError:  # Python 3.11 以前沒有 tomllib，只能讀 JSON 設定檔
+    tomllib = None
 #一個字裡只有一個變音母音
 #有特定的onset, vowel clusters (如果選到該syllable structure優先選這些cluster)
 #設定只有特定子音出現在coda position
@@ -11,234 +41,3471 @@ from collections import defaultdict
 #le/la 碰到下個字的開頭是母音要變l'
 #否定的話前面+ne 後面+pas
 
+ACCENTED_VOWELS = frozenset({'à','è','ù','é','ê'})
+
+
+def _dump_json(data, path: str = None):
+    """把統計之類的資料存成縮排的 JSON（沒有給路徑時印到標準錯誤）"""
+    text = json.dumps(data, ensure_ascii=False, indent=2)
+    if path is None:
+        print(text, file=sys.stderr)
+    else:
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+
+
+def _batch_sizes(n: int, batch_size: int) -> Iterator[int]:
+    """把 n 切成每批最多 batch_size 的大小（各引擎的 iter_batches 共用）"""
+    done = 0
+    while done < n:
+        size = min(batch_size, n - done)
+        yield size
+        done += size
+
+
+class GenerationStats:
+    """
+    生成過程的統計（預設關閉）
+    開啟後各個生成函式會累加計數器與計時器，批次執行完可以用 snapshot() / dump() 取出，
+    用來找出是哪個分支讓設定變慢或產生奇怪的結果；關閉時每次呼叫只多一次屬性檢查
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.counters: Dict[str, int] = {}
+        self.timers: Dict[str, List[int]] = {}  # {名稱: [總奈秒數, 次數]}
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        self.counters.clear()
+        self.timers.clear()
+
+    def incr(self, name: str, amount: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def add_time(self, name: str, nanoseconds: int):
+        timer = self.timers.get(name)
+        if timer is None:
+            timer = self.timers[name] = [0, 0]
+        timer[0] += nanoseconds
+        timer[1] += 1
+
+    def snapshot(self) -> Dict[str, dict]:
+        """目前的統計（計數器，以及每個計時器的次數、總時間與平均時間）"""
+        return {
+            'counters': dict(sorted(self.counters.items())),
+            'timers': {name: {'count': count, 'total_ns': total, 'mean_ns': total / count if count else 0.0}
+                       for name, (total, count) in sorted(self.timers.items())},
+        }
+
+    def dump(self, path: str = None):
+        """把統計存成 JSON（沒有給路徑時印到標準錯誤）"""
+        _dump_json(self.snapshot(), path)
+
+
+# 全域的統計物件，用 STATS.enable() 開啟
+STATS = GenerationStats()
+
+
+def run_dialog(dialog, ask=input):
+    """
+    用同步的 input() 驅動一段對話產生器（yield 提示、send 回答），回傳對話的結果
+    遊戲流程本身不碰 I/O，同一段對話也可以由 GameSession 非同步驅動
+    """
+    try:
+        prompt = next(dialog)
+        while True:
+            prompt = dialog.send(ask(prompt))
+    except StopIteration as stop:
+        return stop.value
+
+
+class _TrackedSet(set):
+    """內容變動時會通知擁有者的 set（用來讓取樣表失效）"""
+
+    def __init__(self, iterable=(), on_change=None):
+        super().__init__(iterable)
+        self._on_change = on_change
+
+    def _changed(self):
+        if self._on_change is not None:
+            self._on_change()
+
+    def __reduce__(self):
+        # 序列化時存成一般 set，載入後由擁有者重新包裝
+        return (set, (list(self),))
+
+
+class _TrackedList(list):
+    """內容變動時會通知擁有者的 list（用來讓編譯好的構詞規則失效）"""
+
+    def __init__(self, iterable=(), on_change=None):
+        super().__init__(iterable)
+        self._on_change = on_change
+
+    _changed = _TrackedSet._changed
+
+    def __reduce__(self):
+        # 序列化時存成一般 list，載入後由擁有者重新包裝
+        return (list, (list(self),))
+
+
+def _tracked_method(base_type, name):
+    base = getattr(base_type, name)
+
+    def method(self, *args):
+        result = base(self, *args)
+        self._changed()
+        return result
+    method.__name__ = name
+    return method
+
+
+for _name in ('add', 'remove', 'discard', 'pop', 'clear', 'update',
+              'difference_update', 'intersection_update', 'symmetric_difference_update',
+              '__ior__', '__iand__', '__isub__', '__ixor__'):
+    setattr(_TrackedSet, _name, _tracked_method(set, _name))
+for _name in ('append', 'extend', 'insert', 'remove', 'pop', 'clear', 'sort', 'reverse',
+              '__setitem__', '__delitem__', '__iadd__', '__imul__'):
+    setattr(_TrackedList, _name, _tracked_method(list, _name))
+del _name
+
+
+class SamplingPlan:
+    """
+    某組音節結構的約束取樣表
+    每個位置只從「選了之後整個詞還能完成」的選項中抽，取代原本 while 迴圈的拒絕取樣：
+    - 母音：排除同音節上一個母音；已用過變音母音就只剩普通母音
+    - 母音叢集：已用過變音就只抽不含變音的叢集（沒有的話抽兩個不重複的普通母音）
+    - 音節結構與音節頭叢集：只抽後面還接得下去的
+    選項表依 (模板, 槽, 上一個母音, 是否已用變音, 剩餘音節數) 快取，
+    再串成節點（見 node）：每個節點直接連到下一個槽的節點，抽樣時每個槽只剩一次 choice，不必再組鍵查表
+    """
+
+    def __init__(self, sampler: 'WordSampler', patterns: Iterable[str]):
+        self.sampler = sampler
+        self.syllable_patterns = tuple(patterns)
+        self.templates: List[tuple] = []
+        template_ids: Dict[tuple, int] = {}
+        self.patterns = []  # 每個音節結構可選的 (音節頭叢集, 模板編號)
+        for pattern in self.syllable_patterns:
+            entries = []
+            for onset, template in self._expand(pattern):
+                if template not in template_ids:
+                    template_ids[template] = len(self.templates)
+                    self.templates.append(template)
+                entries.append((onset, template_ids[template]))
+            self.patterns.append(tuple(entries))
+        plain = sampler.plain_vowels
+        self._fallback_pairs = tuple(a + b for i, a in enumerate(plain) for j, b in enumerate(plain) if i != j)
+        # 子音槽直接從整個子音表抽；母音槽為 None，要查 slot_options
+        consonant_pools = {'C': sampler.consonants, 'CODA': sampler.codas}
+        self.pools = tuple(tuple(consonant_pools.get(kind) for kind in t) for t in self.templates)
+        self.options: Dict[tuple, tuple] = {}
+        self.start_table: Dict[tuple, tuple] = {}
+        self.nodes: Dict[tuple, tuple] = {}
+        self.start_nodes: List[tuple] = [((), ())]  # [剩餘音節數][是否已用變音] → 每個音節結構一組 (音節頭叢集, 節點)
+        self.feasible: Set[int] = set()  # 已確認可以生成的音節數
+        self.random_counts: Optional[tuple] = None  # 沒指定音節數時可以抽的音節數（見 WordSampler.random_counts）
+
+    def _expand(self, pattern: str) -> List[Tuple[str, tuple]]:
+        """把音節結構展開成 (音節頭叢集, 槽的種類)；叢集有幾個字元就佔掉幾個位置（同原本的 generate_word）"""
+        sampler = self.sampler
+
+        def slots(start):
+            result = []
+            n = len(pattern)
+            i = start
+            while i < n:
+                char = pattern[i]
+                if char == 'C':
+                    result.append('CODA' if i == n - 1 else 'C')
+                elif char == 'V':
+                    if i < n - 1 and pattern[i + 1] == 'V' and sampler.vowel_clusters:
+                        result.append('VV')
+                        i += 2
+                        continue
+                    result.append('V')
+                i += 1
+            return tuple(result)
+
+        if len(pattern) > 1 and pattern[0] == 'C' and pattern[1] == 'C' and sampler.onset_clusters:
+            return [(cluster, slots(len(cluster))) for cluster in sampler.onset_clusters]
+        return [("", slots(0))]
+
+    def _can_finish(self, template: int, slot: int, last, accented: bool, remaining: int) -> bool:
+        if slot == len(self.templates[template]):
+            return self.can_generate(remaining - 1, accented)
+        return bool(self.slot_options(template, slot, last, accented, remaining))
+
+    def slot_options(self, template: int, slot: int, last, accented: bool, remaining: int) -> tuple:
+        """某個槽可以放的 (音素, 上一個母音, 是否已用變音)，只留下之後還能完成整個詞的選項"""
+        key = (template, slot, last, accented, remaining)
+        options = self.options.get(key)
+        if options is not None:
+            return options
+
+        kind = self.templates[template][slot]
+        if kind == 'C' or kind == 'CODA':
+            # 子音不改變狀態，只要確認一次之後接得下去
+            ok = self._can_finish(template, slot + 1, last, accented, remaining)
+            options = tuple(self.choices(kind, last, accented)) if ok else ()
+        else:
+            options = tuple(c for c in self.choices(kind, last, accented)
+                            if self._can_finish(template, slot + 1, c[1], c[2], remaining))
+
+        self.options[key] = options
+        return options
+
+    def choices(self, kind: str, last, accented: bool) -> List[tuple]:
+        """
+        某種槽在這個狀態下合乎規則的 (音素, 上一個母音, 是否已用變音)，不管之後能不能完成整個詞
+        取樣（slot_options）、音韻自動機與詞語空間的計數都從這裡取選項，三者的規則不會分歧
+        """
+        sampler = self.sampler
+        if kind == 'C':
+            return [(p, last, accented) for p in sampler.consonants]
+        if kind == 'CODA':
+            return [(p, last, accented) for p in sampler.codas]
+        if kind == 'V':
+            return [(p, p, accented or p in ACCENTED_VOWELS) for p in sampler.vowels
+                    if p != last and not (accented and p in ACCENTED_VOWELS)]
+        # VV
+        if accented:
+            return [(p, last, True) for p in sampler.plain_vowel_clusters or self._fallback_pairs]
+        return [(p, last, any(c in ACCENTED_VOWELS for c in p)) for p in sampler.vowel_clusters]
+
+    def starts(self, remaining: int, accented: bool) -> tuple:
+        """還剩 remaining 個音節時可以選的音節結構（每個是一組 (音節頭叢集, 模板編號)）"""
+        starts = self.start_table.get((remaining, accented))
+        if starts is None:
+            starts = []
+            for entries in self.patterns:
+                usable = tuple(e for e in entries if self._can_finish(e[1], 0, None, accented, remaining))
+                if usable:
+                    starts.append(usable)
+            starts = self.start_table[remaining, accented] = tuple(starts)
+        return starts
+
+    def node(self, template: int, slot: int, last, accented: bool, remaining: int) -> Optional[tuple]:
+        """
+        某個槽的抽樣節點 (子音表, 下一個節點, 槽的種類)；子音表為 None 的母音槽改成
+        (None, ((音素, 是否已用變音, 下一個節點), ...), 槽的種類)；音節結束時為 None
+        """
+        key = (template, slot, last, accented, remaining)
+        node = self.nodes.get(key)
+        if node is None and slot < len(self.templates[template]):
+            kind = self.templates[template][slot]
+            pool = self.pools[template][slot]
+            if pool is not None:
+                node = (pool, self.node(template, slot + 1, last, accented, remaining), kind)
+            else:
+                node = (None, tuple((p, a, self.node(template, slot + 1, l, a, remaining))
+                                    for p, l, a in self.slot_options(*key)), kind)
+            self.nodes[key] = node
+        return node
+
+    def start_nodes_for(self, syllable_count: int) -> List[tuple]:
+        """取得（必要時補建）到 syllable_count 個音節為止的起點節點表 start_nodes"""
+        table = self.start_nodes
+        for remaining in range(len(table), syllable_count + 1):
+            table.append(tuple(tuple(tuple((onset, self.node(template, 0, None, accented, remaining))
+                                           for onset, template in entries)
+                                     for entries in self.starts(remaining, accented))
+                               for accented in (False, True)))
+        return table
+
+    def can_generate(self, remaining: int, accented: bool = False) -> bool:
+        """是否能再接 remaining 個音節（由少到多填表，避免遞迴太深）"""
+        if remaining <= 0:
+            return True
+        for k in range(1, remaining):
+            self.starts(k, True)
+            self.starts(k, False)
+        return bool(self.starts(remaining, accented))
+
+
+class WordSampler:
+    """
+    預先編譯好的取樣表
+    將音韻系統中的各個 set 轉成排序過的 tuple，只在音素庫存變動時重建，
+    避免 generate_word 在每個字元都重新 list() 一次
+    """
+    __slots__ = ('consonants', 'codas', 'vowels', 'vowel_set', 'plain_vowels',
+                 'onset_clusters', 'vowel_clusters', 'plain_vowel_clusters', '_plans')
+
+    def __init__(self, phonology: 'PhonologySystem'):
+        self.consonants = tuple(sorted(phonology.consonants))
+        # 有設定音節尾限制就只用限制內的子音，否則全部子音都可
+        self.codas = tuple(sorted(phonology.coda_restrictions)) or self.consonants
+        self.vowels = tuple(sorted(phonology.vowels))
+        self.vowel_set = frozenset(phonology.vowels)
+        self.plain_vowels = tuple(v for v in self.vowels if v not in ACCENTED_VOWELS)
+        self.onset_clusters = tuple(sorted(phonology.onset_clusters))
+        self.vowel_clusters = tuple(sorted(phonology.vowel_clusters))
+        self.plain_vowel_clusters = tuple(vc for vc in self.vowel_clusters
+                                          if not any(c in ACCENTED_VOWELS for c in vc))
+        self._plans: Dict[tuple, SamplingPlan] = {}
+
+    def plan(self, patterns: List[str]) -> SamplingPlan:
+        """取得某組音節結構的約束取樣表"""
+        key = tuple(patterns)
+        plan = self._plans.get(key)
+        if plan is None:
+            plan = self._plans[key] = SamplingPlan(self, key)
+        return plan
+
+    def check(self, patterns: List[str], syllable_count: int):
+        """生成前先確認設定能產生合法詞，否則丟出 ValueError（不會卡在無窮迴圈）"""
+        if not patterns:
+            raise ValueError("沒有任何音節結構可用")
+        if not self.plan(patterns).can_generate(syllable_count):
+            raise ValueError(f"目前的音韻設定無法生成 {syllable_count} 個音節的詞"
+                             "（母音、子音或叢集太少，無法滿足音節結構與變音母音的限制）")
+        if syllable_count > 1 and not self.codas:
+            raise ValueError("沒有任何子音，無法在母音連續時插入子音")
+
+    def random_counts(self, patterns: List[str]) -> tuple:
+        """
+        沒有指定音節數時可以抽的音節數：1 到 3 中目前設定能生成的（例如沒有子音時只剩 1）
+        一個都不能生成時丟出 ValueError
+        """
+        plan = self.plan(patterns)
+        if plan.random_counts is None:
+            counts = []
+            for count in (1, 2, 3):
+                try:
+                    self.check(patterns, count)
+                except ValueError:
+                    continue
+                counts.append(count)
+                plan.feasible.add(count)
+            if not counts:
+                self.check(patterns, 1)
+            plan.random_counts = tuple(counts)
+        return plan.random_counts
+
+    def generate(self, patterns: List[str], syllable_count: int = None, rng=random) -> str:
+        """用預先編譯的表生成一個詞（規則與 generate_word 相同）"""
+        plan = self._plans.get(tuple(patterns)) or self.plan(patterns)
+        # 用 random() 換算索引，比每次都呼叫 choice 省下大約一半的抽樣成本
+        rand = rng.random
+        if syllable_count is None:
+            counts = plan.random_counts or self.random_counts(patterns)
+            syllable_count = counts[int(rand() * len(counts))]
+        if syllable_count not in plan.feasible:
+            self.check(patterns, syllable_count)
+            plan.feasible.add(syllable_count)
+
+        codas = self.codas
+        vowel_set = self.vowel_set
+        start_nodes = plan.start_nodes
+        if len(start_nodes) <= syllable_count:
+            start_nodes = plan.start_nodes_for(syllable_count)
+        used_accented = False  # 整個詞中是否已出現變音母音
+        stats = STATS if STATS.enabled else None
+
+        word = ""
+        for remaining in range(syllable_count, 0, -1):
+            if stats:
+                started = time.perf_counter_ns()
+            starts = start_nodes[remaining][used_accented]
+            entries = starts[int(rand() * len(starts))]
+            onset, node = entries[int(rand() * len(entries))]
+            syllable = onset
+
+            while node is not None:
+                pool, follow, kind = node
+                if pool is not None:
+                    # 子音不改變狀態，能走到這裡就表示之後一定接得下去
+                    syllable += pool[int(rand() * len(pool))]
+                    node = follow
+                    continue
+                if stats:
+                    self._trace_slot(stats, kind, used_accented, follow)
+                phoneme, used_accented, node = follow[int(rand() * len(follow))]
+                syllable += phoneme
+
+            # 處理母音連續時插入子音
+            hiatus = word and syllable and word[-1] in vowel_set and syllable[0] in vowel_set
+            if hiatus:
+                if not codas:
+                    self.check(patterns, syllable_count)
+                syllable = codas[int(rand() * len(codas))] + syllable
+
+            word += syllable
+            if stats:
+                stats.add_time('phonology.syllable', time.perf_counter_ns() - started)
+                stats.incr('phonology.syllables')
+                if onset:
+                    stats.incr('phonology.onset_clusters')
+                if hiatus:
+                    stats.incr('phonology.hiatus_insertions')
+
+        if stats:
+            stats.incr('phonology.words')
+        return word
+
+    def _trace_slot(self, stats: 'GenerationStats', kind: str, accented: bool, slot_choices: tuple):
+        """記錄一次母音或母音叢集的抽樣"""
+        if kind == 'V':
+            stats.incr('phonology.vowel_draws')
+            # 原本拒絕取樣會重抽的選項數（同音節重複母音、第二個變音母音）
+            stats.incr('phonology.vowel_options_pruned', len(self.vowels) - len(slot_choices))
+        else:
+            stats.incr('phonology.vowel_cluster_draws')
+            if accented:
+                # 已用過變音母音，只能從不含變音的叢集（或兩個普通母音）中抽
+                stats.incr('phonology.accented_cluster_fallbacks')
+
+
+@dataclass(frozen=True)
+class SandhiRule:
+    """
+    跨詞界的音變規則（左詞與右詞之間，右詞以母音開頭時才套用）
+    - elision：左詞換成 replacement 並直接黏到右詞上，例如 le/la → l'（left 為空時：去掉左詞結尾的母音加上 '）
+    - liaison：在右詞前面加上連音子音 replacement，例如 les ami → les zami
+    - hiatus：左詞以母音結尾時在右詞前面插入子音 replacement（同 generate_word 在詞內的處理）
+    left 為觸發的左詞；空的 tuple 表示任何詞都可以
+    左詞只比對用 SandhiEngine.mark 標記過的功能詞（冠詞等），生成的名詞、動詞剛好是 le/la 時不會被省略；
+    只有 left 為空的 liaison、hiatus 會套用到任何詞
+    """
+    name: str
+    kind: str  # elision, liaison, hiatus
+    left: Tuple[str, ...] = ()
+    replacement: str = ""
+
+
+SANDHI_KINDS = ('elision', 'liaison', 'hiatus')
+
+# 預設規則：le/la 碰到母音開頭的詞變成 l'
+DEFAULT_SANDHI_RULES = (SandhiRule("article_elision", "elision", ("le", "la"), "l'"),)
+
+
+class SandhiEngine:
+    """
+    編譯好的跨詞音變
+    所有規則合成一個 regex（依規則順序排優先權），右詞的母音開頭用音素庫存的最長匹配判斷（支援 eau、ou 等多字元母音），
+    整批句子接成一個字串只掃一次，不必每個名詞各呼叫一次
+    功能詞（冠詞、文法中的引號字）在接成句子前用 mark 標記，規則的左詞只比對標記過的詞，套用完再把標記拿掉
+    """
+    MARK = '\ue000'  # 私用區字元，不會出現在詞裡，也不算空白
+
+    @classmethod
+    def mark(cls, word: str) -> str:
+        """標記一個功能詞，讓它可以當音變的左詞"""
+        return cls.MARK + word if word else word
+
+    def __init__(self, rules: Iterable[SandhiRule], vowels: Iterable[str]):
+        self.rules = tuple(rules)
+        vowels = sorted(set(vowels), key=lambda v: (-len(v), v))
+        vowel = '(?:' + '|'.join(map(re.escape, vowels)) + ')' if vowels else '(?!)'
+        alternatives = []
+        self._actions = {}
+        for i, rule in enumerate(self.rules):
+            if rule.kind not in SANDHI_KINDS:
+                raise ValueError(f"不支援的音變種類：{rule.kind}")
+            group = f"r{i}"
+            left = '|'.join(map(re.escape, sorted(rule.left, key=len, reverse=True)))
+            mark = re.escape(self.MARK)
+            if rule.kind == 'elision' and not rule.left:
+                pattern = rf"(?<!\S){mark}(?P<p{i}>\S*?){vowel} "
+            elif rule.kind == 'hiatus' and not rule.left:
+                pattern = rf"{vowel} "
+            elif not rule.left:
+                pattern = " "
+            else:
+                pattern = rf"(?<!\S){mark}(?:{left}) "
+            alternatives.append(rf"(?P<{group}>{pattern})(?={vowel})")
+            self._actions[group] = (i, rule)
+        self._regex = re.compile('|'.join(alternatives)) if alternatives else None
+        self._vowel_end = re.compile(rf"{vowel}$") if vowels else None
+
+    def _replace(self, match) -> str:
+        i, rule = self._actions[match.lastgroup]
+        text = match.group(match.lastgroup)
+        if STATS.enabled:
+            STATS.incr(f'sandhi.{rule.kind}')
+            if rule.kind == 'elision':
+                STATS.incr('syntax.elisions')
+        if rule.kind == 'elision':
+            if rule.left:
+                return rule.replacement
+            return match.group(f"p{i}") + "'"
+        if rule.kind == 'hiatus' and rule.left and not self._vowel_end.search(text[:-1]):
+            return text  # 指定的左詞不是母音結尾，沒有母音連續
+        return text + rule.replacement
+
+    def apply(self, text: str) -> str:
+        """套用到一個句子（詞以空白分隔，功能詞已用 mark 標記），回傳拿掉標記的句子"""
+        if self._regex is not None:
+            text = self._regex.sub(self._replace, text)
+        return text.replace(self.MARK, "")
+
+    def apply_many(self, sentences: List[str]) -> List[str]:
+        """一次套用到整批句子：接成一個字串跑一次 regex 再切開"""
+        if not sentences:
+            return []
+        text = '\n'.join(sentences)
+        if self._regex is not None:
+            text = self._regex.sub(self._replace, text)
+        return text.replace(self.MARK, "").split('\n')
+
+
+# 變動時需要讓取樣表失效的音素庫存欄位
+_TRACKED_INVENTORIES = ('consonants', 'vowels', 'coda_restrictions', 'onset_clusters', 'vowel_clusters')
+
+
+@dataclass
+class PhonologySystem:
+    """音韻系統"""
+    consonants: Set[str] = field(default_factory=lambda: {'b','c','d','f','g','h','l','m','n','p','q','r','s','t','v','x','z'})
+    vowels: Set[str] = field(default_factory=lambda: {'a', 'e', 'i', 'o', 'u', 'à','é','ê'})
+    syllable_patterns: List[str] = field(default_factory=lambda: ['CV','CV','VC','CVC','CVC','CCV','CVV','V'])
+    phonotactic_rules: List[str] = field(default_factory=list)
+    coda_restrictions: Set[str] = field(default_factory=set)  # 存放允許在音節尾的子音（空集合表示全部都可）
+    onset_cluster_restrictions:  List[str] = field(default_factory=list)
+    vowel_clusters: Set[str] = field(default_factory=set)
+    onset_clusters: Set[str] = field(default_factory=set)
+    sandhi_rules: List[SandhiRule] = field(default_factory=lambda: list(DEFAULT_SANDHI_RULES))
+    _sampler: WordSampler = field(default=None, init=False, repr=False, compare=False)
+    _sandhi: tuple = field(default=None, init=False, repr=False, compare=False)
+
+    def __setattr__(self, name, value):
+        # 重新指定音素庫存時包裝成會通知的 set，並讓取樣表失效
+        if name in _TRACKED_INVENTORIES:
+            on_change = self._inventory_changed if name in ('consonants', 'vowels') else self._invalidate_sampler
+            value = _TrackedSet(value, on_change)
+            object.__setattr__(self, '_sampler', None)
+        object.__setattr__(self, name, value)
+        if name in ('consonants', 'vowels'):
+            self.prune_inventory()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_sampler'] = None
+        state['_sandhi'] = None
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def _invalidate_sampler(self):
+        object.__setattr__(self, '_sampler', None)
+
+    def _inventory_changed(self):
+        self._invalidate_sampler()
+        self.prune_inventory()
+
+    def prune_inventory(self):
+        """
+        移除用到已不在庫存中的音素的音節尾子音與叢集（子音或母音變動時自動呼叫），
+        讓生成與驗證都不會再接受被移除的音素；音節尾限制被刪光時回到「全部子音都可」
+        """
+        consonants = self.__dict__.get('consonants')
+        vowels = self.__dict__.get('vowels')
+        codas = self.__dict__.get('coda_restrictions')
+        onset_clusters = self.__dict__.get('onset_clusters')
+        vowel_clusters = self.__dict__.get('vowel_clusters')
+        if consonants is not None and codas:
+            stale = codas - consonants
+            if stale:
+                codas.difference_update(stale)
+        if consonants is not None and onset_clusters:
+            stale = {c for c in onset_clusters if not all(ch in consonants for ch in c)}
+            if stale:
+                onset_clusters.difference_update(stale)
+        if vowels is not None and vowel_clusters:
+            stale = {c for c in vowel_clusters if not all(ch in vowels for ch in c)}
+            if stale:
+                vowel_clusters.difference_update(stale)
+
+    def restore_inventory(self, before: Dict[str, frozenset]):
+        """把音素庫存（含音節尾限制與叢集）還原成 inventory_snapshot() 的內容"""
+        for name in _TRACKED_INVENTORIES:
+            setattr(self, name, set(before[name]))
+
+    @property
+    def sampler(self) -> WordSampler:
+        """取得（必要時重建）預先編譯的取樣表"""
+        if self._sampler is None:
+            object.__setattr__(self, '_sampler', WordSampler(self))
+        return self._sampler
+
+    @property
+    def sandhi(self) -> SandhiEngine:
+        """取得（規則或母音變動時重建）編譯好的跨詞音變"""
+        key = (tuple(self.sandhi_rules), self.sampler.vowel_set)
+        if self._sandhi is None or self._sandhi[0] != key:
+            object.__setattr__(self, '_sandhi', (key, SandhiEngine(self.sandhi_rules, self.vowels)))
+        return self._sandhi[1]
+
+    def generate_word(self, syllable_count: int = None, rng=None) -> str:
+        """
+        生成一個詞（rng 為 random.Random，預設使用全域 random）
+        設定無法產生合法詞時（例如只有一個母音又要求 CVV）直接丟出 ValueError
+        """
+        return self.sampler.generate(self.syllable_patterns, syllable_count, rng or random)
+
+    def generate_words(self, n: int, syllable_count: int = None, rng=None) -> List[str]:
+        """一次生成 n 個詞，共用同一份取樣表"""
+        sampler = self.sampler
+        patterns = self.syllable_patterns
+        rng = rng or random
+        return [sampler.generate(patterns, syllable_count, rng) for _ in range(n)]
+
+    def inventory_snapshot(self) -> Dict[str, frozenset]:
+        """記下目前的音素庫存，之後可用 invalidated_by 找出變動"""
+        return {name: frozenset(getattr(self, name)) for name in _TRACKED_INVENTORIES}
+
+    def invalidated_by(self, before: Dict[str, frozenset]) -> Optional[Set[str]]:
+        """
+        和 inventory_snapshot() 的結果比較，回傳可能讓既有詞變得不合法的音素/叢集
+        （移除的子音、母音、叢集與不再允許的音節尾子音；移除子音或母音時 prune_inventory 已經把
+        用到它們的音節尾限制與叢集一起刪掉，所以也會列入）；新增的音素只會放寬規則，不列入
+        第一次設定音節頭叢集或母音叢集會讓 CC、VV 只能用叢集，此時回傳 None 表示每個詞都要重新檢查
+        """
+        if (self.onset_clusters and not before['onset_clusters']) or \
+                (self.vowel_clusters and not before['vowel_clusters']):
+            return None
+        changed = set()
+        for name in ('consonants', 'vowels', 'onset_clusters', 'vowel_clusters'):
+            changed |= before[name] - getattr(self, name)
+        codas_before = before['coda_restrictions'] or before['consonants']
+        codas_after = self.coda_restrictions or self.consonants
+        changed |= codas_before - codas_after
+        return changed
+
+    def build_validator(self) -> 'PhonotacticValidator':
+        """依目前的音韻規則編譯一個驗證用的有限狀態自動機"""
+        return PhonotacticValidator(self)
+
+    def build_ngram_model(self, corpus, order: int = 3, max_length: int = 12) -> 'NgramWordModel':
+        """
+        用語料訓練音素 n-gram 造詞模型
+        corpus 可以是文字檔路徑，或是一串詞語
+        """
+        model = NgramWordModel(self, order, max_length)
+        if isinstance(corpus, str):
+            return model.train_file(corpus)
+        return model.train(corpus)
+
+    def generate_words_vectorized(self, n: int, rng=None, syllable_count: int = None) -> List[str]:
+        """用 NumPy 向量化引擎一次生成 n 個詞（rng 為 numpy.random.Generator）"""
+        return VectorizedWordGenerator(self, rng).generate(n, syllable_count)
+
+    def set_onset_clusters(self):
+        """設定常見音節開頭叢集（互動模式，見 onset_clusters_dialog）"""
+        run_dialog(self.onset_clusters_dialog())
+
+    def set_coda_restrictions(self):
+        """設定允許出現在音節尾的子音（互動模式，見 coda_restrictions_dialog）"""
+        run_dialog(self.coda_restrictions_dialog())
+
+    def set_vowel_clusters(self):
+        """設定常見母音叢集（互動模式，見 vowel_clusters_dialog）"""
+        run_dialog(self.vowel_clusters_dialog())
+
+    def onset_clusters_dialog(self, say=print):
+        """
+        設定常見音節開頭叢集
+        使用者可以輸入多個子音叢集，例如 "tr", "pl", "st"
+        直接按 Enter 結束輸入
+        """
+        self.onset_clusters = set()  # 初始化
+        say("請輸入出現在音節頭的子音們（直接按 Enter 結束）")
+        
+        while True:
+            cluster = (yield "子音叢集: ").strip()
+            if cluster == '':
+                break
+            # 驗證輸入是否都在子音系統中
+            if all(c in self.consonants for c in cluster) and len(cluster) >= 2:
+                self.onset_clusters.add(cluster)
+                say(f"已添加叢集：{cluster}")
+            else:
+                say(f"{cluster} 不合法（需至少兩個合法子音）")
+
+    
+    def coda_restrictions_dialog(self, say=print):
+        """設定允許出現在音節尾的子音（直接按 Enter 結束）"""
+        self.coda_restrictions.clear()  # 先清空原本的限制
+        say("請輸入出現在音節尾的子音（直接按 Enter 結束）")
+        while True:
+            c = (yield "子音: ").strip()
+            if c == '':  # 空白鍵結束
+                break
+            if c in self.consonants:
+                self.coda_restrictions.add(c)
+                say(f"已添加可出現在音節尾的子音：{c}")
+            else:
+                say(f"{c} 不在子音系統中")
+
+        if not self.coda_restrictions:
+            # 如果沒有輸入任何音節尾子音，預設全部子音都可
+            self.coda_restrictions = self.consonants.copy()
+            say("未設定任何音節尾子音，預設所有子音都可出現在音節尾。")
+
+    def vowel_clusters_dialog(self, say=print):
+        """
+        設定常見母音叢集（例如 ai, ou, eau）
+        使用者可以輸入多個母音叢集，例如 "ai", "ou", "ie"
+        直接按 Enter 結束輸入
+        """
+        self.vowel_clusters = set()  # 初始化
+        say("請輸入出現在詞中常見的母音叢集（直接按 Enter 結束）")
+        
+        while True:
+            cluster = (yield "母音叢集: ").strip()
+            if cluster == '':
+                break
+            # 驗證輸入是否都是合法母音，且長度 >= 2
+            if all(c in self.vowels for c in cluster) and len(cluster) >= 2:
+                self.vowel_clusters.add(cluster)
+                say(f"✅ 已添加母音叢集：{cluster}")
+            else:
+                say(f"❌ {cluster} 不合法（需至少兩個合法母音）")
+
+
+
+class VectorizedWordGenerator:
+    """
+    以 NumPy 向量化的大量造詞引擎
+    一次替整批詞抽出音節模式、音節頭、母音、音節尾的整數索引陣列，最後才組成字串
+    規則與 generate_word 相同：
+    - 一個詞最多一個變音母音
+    - 同一音節內相鄰母音不重複
+    - 音節尾只用 coda_restrictions 裡的子音
+    - 母音結尾接母音開頭的音節時插入子音
+    音節結構怎麼展開成槽（包括音節頭叢集佔掉幾個位置）直接用取樣器的 SamplingPlan
+    傳入相同種子的 numpy.random.Generator（且 batch_size 相同）即可重現結果
+    """
+    _NONE, _CONS, _CODA, _ONSET, _VOWEL, _VCLUSTER = range(6)
+
+    def __init__(self, phonology: PhonologySystem, rng=None):
+        if np is None:
+            raise ImportError("VectorizedWordGenerator 需要安裝 numpy")
+        if not phonology.syllable_patterns:
+            raise ValueError("沒有任何音節結構可用")
+        self.rng = rng if rng is not None else np.random.default_rng()
+        sampler = phonology.sampler
+
+        # 所有片段放在同一張字串表，索引 0 為空字串
+        fragments = ['']
+
+        def add(items):
+            start = len(fragments)
+            fragments.extend(items)
+            return np.arange(start, start + len(items), dtype=np.int32)
+
+        self._cons = add(sampler.consonants)
+        self._codas = add(sampler.codas)
+        self._onsets = add(sampler.onset_clusters)
+        self._vowels = add(sampler.vowels)
+        self._clusters = add(sampler.vowel_clusters)
+        self._plain_clusters = add(sampler.plain_vowel_clusters)
+        # 沒有不含變音的 cluster 時，改選兩個不重複的普通母音
+        plain = sampler.plain_vowels
+        self._pairs = add([a + b for i, a in enumerate(plain) for j, b in enumerate(plain) if i != j])
+
+        self._table = np.array(fragments)
+        self._first_vowel = np.array([bool(f) and f[0] in sampler.vowel_set for f in fragments])
+        self._last_vowel = np.array([bool(f) and f[-1] in sampler.vowel_set for f in fragments])
+
+        accented = np.array([v in ACCENTED_VOWELS for v in sampler.vowels], dtype=bool)
+        self._vowel_accented = accented
+        self._plain_vowel_idx = np.flatnonzero(~accented)
+        self._plain_pos = np.full(len(sampler.vowels), -1, dtype=np.int64)
+        self._plain_pos[self._plain_vowel_idx] = np.arange(len(self._plain_vowel_idx))
+        self._cluster_accented = np.array(
+            [any(c in ACCENTED_VOWELS for c in vc) for vc in sampler.vowel_clusters], dtype=bool)
+
+        # 每個音節結構展開成一組 (音節頭叢集, 模板)，先均勻抽音節結構、再均勻抽其中一組（同 WordSampler）；
+        # 只留下能完成的音節結構（例如沒有子音時只剩 V），沒指定音節數時也只抽能生成的音節數
+        self._sampler = sampler
+        self._syllable_patterns = list(phonology.syllable_patterns)
+        plan = sampler.plan(self._syllable_patterns)
+        self.patterns = plan.starts(1, False)
+        if not self.patterns:
+            sampler.check(self._syllable_patterns, 1)
+        codes = {'C': self._CONS, 'CODA': self._CODA, 'V': self._VOWEL, 'VV': self._VCLUSTER}
+        onset_index = {cluster: int(i) for cluster, i in zip(sampler.onset_clusters, self._onsets)}
+        entries = [entry for pattern_entries in self.patterns for entry in pattern_entries]
+        self._entry_count = np.array([len(e) for e in self.patterns], dtype=np.int64)
+        self._entry_start = np.concatenate(([0], np.cumsum(self._entry_count)[:-1]))
+        self._entry_onset = np.array([onset_index.get(onset, 0) for onset, _ in entries], dtype=np.int32)
+        width = max(1, max(bool(onset) + len(plan.templates[t]) for onset, t in entries))
+        self._tokens = np.zeros((len(entries), width), dtype=np.int8)
+        for row, (onset, template) in enumerate(entries):
+            tokens = ([self._ONSET] if onset else []) + [codes[kind] for kind in plan.templates[template]]
+            self._tokens[row, :len(tokens)] = tokens
+
+    def _pick(self, pool, size: int, what: str):
+        if not len(pool):
+            raise ValueError(f"沒有可用的{what}")
+        return pool[self.rng.integers(0, len(pool), size=size)]
+
+    def _draw_vowels(self, last, used):
+        """替每一列抽一個母音：排除同音節上一個母音，已用過變音就只抽普通母音"""
+        n_plain = len(self._plain_vowel_idx)
+        size = np.where(used, n_plain, len(self._vowels))
+        safe_last = np.maximum(last, 0)
+        pos = np.where(last < 0, -1, np.where(used, self._plain_pos[safe_last], last))
+        excluded = pos >= 0
+        high = size - excluded
+        if (high <= 0).any():
+            raise ValueError("沒有可用的母音（母音太少，無法避免重複或第二個變音母音）")
+        r = self.rng.integers(0, high)
+        r = r + (excluded & (r >= pos))
+        if n_plain:
+            vowel = np.where(used, self._plain_vowel_idx[np.minimum(r, n_plain - 1)], r)
+        else:
+            vowel = r
+        return vowel, used | self._vowel_accented[vowel]
+
+    def generate_indices(self, n: int, syllable_count: int = None):
+        """
+        抽出 n 個詞的片段索引矩陣（形狀為 n x 欄數）
+        每個音節佔 1 + 最長模式長度 欄，第一欄保留給母音連續時插入的子音
+        """
+        rng = self.rng
+        if syllable_count is None:
+            feasible = np.array(self._sampler.random_counts(self._syllable_patterns))
+            counts = feasible[rng.integers(0, len(feasible), size=n)]
+        else:
+            counts = np.full(n, syllable_count)
+        max_syllables = int(counts.max()) if n else 0
+        width = self._tokens.shape[1]
+
+        out = np.zeros((n, max_syllables * (width + 1)), dtype=np.int32)
+        used = np.zeros(n, dtype=bool)        # 整個詞中是否已出現變音母音
+        ends_vowel = np.zeros(n, dtype=bool)  # 目前的詞是否以母音結尾
+
+        col = 0
+        for s in range(max_syllables):
+            pattern = rng.integers(0, len(self.patterns), size=n)
+            entry = self._entry_start[pattern] + rng.integers(0, self._entry_count[pattern])
+            kinds = self._tokens[entry]
+            kinds[counts <= s] = self._NONE
+            hiatus_col = col
+            col += 1
+            prev_ends = ends_vowel.copy()
+            last = np.full(n, -1, dtype=np.int64)
+            first = None
+
+            for t in range(width):
+                kind = kinds[:, t]
+                frag = np.zeros(n, dtype=np.int32)
+
+                for code, pool, what in ((self._CONS, self._cons, "子音"),
+                                         (self._CODA, self._codas, "音節尾子音")):
+                    rows = np.flatnonzero(kind == code)
+                    if rows.size:
+                        frag[rows] = self._pick(pool, rows.size, what)
+                rows = np.flatnonzero(kind == self._ONSET)
+                if rows.size:
+                    frag[rows] = self._entry_onset[entry[rows]]
+
+                rows = np.flatnonzero(kind == self._VOWEL)
+                if rows.size:
+                    vowel, used[rows] = self._draw_vowels(last[rows], used[rows])
+                    last[rows] = vowel
+                    frag[rows] = self._vowels[vowel]
+
+                rows = np.flatnonzero(kind == self._VCLUSTER)
+                if rows.size:
+                    c = rng.integers(0, len(self._clusters), size=rows.size)
+                    accented = self._cluster_accented[c]
+                    chosen = self._clusters[c]
+                    # 避免含有多個變音母音
+                    clash = np.flatnonzero(accented & used[rows])
+                    if clash.size:
+                        if len(self._plain_clusters):
+                            chosen[clash] = self._pick(self._plain_clusters, clash.size, "母音叢集")
+                        else:
+                            chosen[clash] = self._pick(self._pairs, clash.size, "普通母音組合")
+                    used[rows] |= accented
+                    frag[rows] = chosen
+
+                out[:, col] = frag
+                col += 1
+                if first is None:
+                    first = frag
+                ends_vowel = np.where(frag != 0, self._last_vowel[frag], ends_vowel)
+
+            # 處理母音連續時插入子音
+            rows = np.flatnonzero(prev_ends & self._first_vowel[first])
+            if rows.size:
+                out[rows, hiatus_col] = self._pick(self._codas, rows.size, "子音")
+
+        return out
+
+    def assemble(self, indices) -> List[str]:
+        """把片段索引矩陣組成字串"""
+        if indices.shape[1] == 0:
+            return [''] * len(indices)
+        words = self._table[indices[:, 0]]
+        for c in range(1, indices.shape[1]):
+            words = np.char.add(words, self._table[indices[:, c]])
+        return words.tolist()
+
+    def iter_batches(self, n: int, syllable_count: int = None, batch_size: int = 100_000):
+        """分批生成，每次產出一個詞語列表，避免一次佔用太多記憶體"""
+        for size in _batch_sizes(n, batch_size):
+            yield self.assemble(self.generate_indices(size, syllable_count))
+
+    def generate(self, n: int, syllable_count: int = None, batch_size: int = 100_000) -> List[str]:
+        """生成 n 個詞"""
+        words = []
+        for batch in self.iter_batches(n, syllable_count, batch_size):
+            words.extend(batch)
+        return words
+
+
+class AliasTable:
+    """
+    Walker/Vose alias method 的加權取樣表
+    建表 O(n)，之後每次抽樣只要一次 rng.random() 和一次查表，與選項數量無關
+    """
+    __slots__ = ('outcomes', 'probability', 'alias')
+
+    def __init__(self, weights: Dict[str, float]):
+        if not weights:
+            raise ValueError("沒有任何選項可以抽")
+        self.outcomes = tuple(weights)
+        n = len(self.outcomes)
+        total = sum(weights.values())
+        scaled = [weights[o] * n / total for o in self.outcomes]
+        self.probability = [1.0] * n
+        self.alias = list(range(n))
+
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            self.probability[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] += scaled[s] - 1.0
+            (small if scaled[l] < 1.0 else large).append(l)
+
+    def sample(self, rng=random) -> str:
+        """抽一個選項：整數部分選欄位，小數部分決定要不要換成別名"""
+        u = rng.random() * len(self.outcomes)
+        i = int(u)
+        return self.outcomes[i] if u - i < self.probability[i] else self.outcomes[self.alias[i]]
+
+
+class NgramWordModel:
+    """
+    從語料（例如 Les Champs Élysées 歌詞）訓練的音素 n-gram 造詞模型
+    - 詞依音素庫存最長匹配切成音素（多字元母音如 eau 算一個音素），含庫存外字元的詞不列入訓練
+    - 每個上下文（前 order-1 個音素）的下一個音素分佈編成 AliasTable，每次抽樣 O(1)
+    - 生成的詞仍要符合原本的限制：最多一個變音母音、詞尾子音必須在 coda_restrictions 中
+    """
+    _END = ''  # 詞首補位與詞尾的符號
+
+    def __init__(self, phonology: PhonologySystem, order: int = 3, max_length: int = 12):
+        if order < 1:
+            raise ValueError("order 至少為 1")
+        self.order = order
+        self.max_length = max_length
+        sampler = phonology.sampler
+        self._consonants = frozenset(sampler.consonants)
+        self._codas = frozenset(sampler.codas)
+        # 較長的音素放前面，讓 regex 做最長匹配
+        phonemes = sorted(set(sampler.consonants) | set(sampler.vowels), key=lambda p: (-len(p), p))
+        if not phonemes:
+            raise ValueError("音素庫存是空的")
+        alternation = '|'.join(map(re.escape, phonemes))
+        self._phoneme_re = re.compile(alternation)
+        self._word_re = re.compile(f"(?:{alternation})+")
+        self._counts: Dict[tuple, Dict[str, int]] = {}
+        self._tables: Dict[tuple, AliasTable] = None
+        self.trained_words = 0
+
+    def split(self, word: str) -> Optional[List[str]]:
+        """把詞切成音素，有庫存外的字元時回傳 None"""
+        if not self._word_re.fullmatch(word):
+            return None
+        return self._phoneme_re.findall(word)
+
+    def train(self, words: Iterable[str]) -> 'NgramWordModel':
+        """累加一批詞的 n-gram 次數（可以多次呼叫）"""
+        counts = self._counts
+        start = (self._END,) * (self.order - 1)
+        for word in words:
+            phonemes = self.split(word.lower())
+            if not phonemes:
+                continue
+            context = start
+            for phoneme in phonemes + [self._END]:
+                following = counts.setdefault(context, {})
+                following[phoneme] = following.get(phoneme, 0) + 1
+                context = (context + (phoneme,))[1:] if self.order > 1 else ()
+            self.trained_words += 1
+        self._tables = None
+        return self
+
+    def train_file(self, path: str) -> 'NgramWordModel':
+        """逐行讀取文字檔（與 coverage_of_file 相同的斷詞方式）來訓練"""
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                self.train(re.findall(r"[^\W\d_]+", line.lower()))
+        return self
+
+    @property
+    def tables(self) -> Dict[tuple, AliasTable]:
+        """取得（訓練資料變動時重建）每個上下文的取樣表"""
+        if self._tables is None:
+            if not self._counts:
+                raise ValueError("語料中沒有任何可用的詞（詞中的字元都必須在音素庫存中）")
+            self._tables = {context: AliasTable(following) for context, following in self._counts.items()}
+        return self._tables
+
+    def is_allowed(self, phonemes: List[str]) -> bool:
+        """檢查 generate_word 的限制：不能是空詞、最多一個變音母音、詞尾子音在音節尾限制中"""
+        if not phonemes:
+            return False  # order=1 時詞尾符號可能第一個就被抽到
+        accented = sum(1 for p in phonemes if any(c in ACCENTED_VOWELS for c in p))
+        if accented > 1:
+            return False
+        last = phonemes[-1]
+        return last not in self._consonants or last in self._codas
+
+    def sample_phonemes(self, rng=random) -> Optional[List[str]]:
+        """沿著 n-gram 走一次，超過 max_length 或不符合限制時回傳 None"""
+        tables = self.tables
+        context = (self._END,) * (self.order - 1)
+        phonemes = []
+        while len(phonemes) <= self.max_length:
+            phoneme = tables[context].sample(rng)
+            if phoneme == self._END:
+                return phonemes if self.is_allowed(phonemes) else None
+            phonemes.append(phoneme)
+            context = (context + (phoneme,))[1:] if self.order > 1 else ()
+        return None
+
+    def generate_word(self, rng=None, max_attempts: int = 1000) -> str:
+        """生成一個詞（不合限制的會重抽，最多 max_attempts 次）"""
+        rng = rng or random
+        for _ in range(max_attempts):
+            phonemes = self.sample_phonemes(rng)
+            if phonemes is not None:
+                return ''.join(phonemes)
+            if STATS.enabled:
+                STATS.incr('ngram.rejected')
+        raise ValueError(f"抽了 {max_attempts} 次都沒有符合音韻限制的詞，請檢查語料或 coda_restrictions")
+
+    def generate_words(self, n: int, rng=None, max_attempts: int = 1000) -> List[str]:
+        """一次生成 n 個詞"""
+        rng = rng or random
+        return [self.generate_word(rng, max_attempts) for _ in range(n)]
+
+
+def derive_seed(master_seed: int, index) -> int:
+    """由主種子與分片編號（或任何可以轉成字串的 key，例如詞語）推導出獨立的子種子"""
+    digest = hashlib.blake2b(f"{master_seed}:{index}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+
+_worker_phonology = None
+
+
+def _init_lexicon_worker(phonology: PhonologySystem):
+    global _worker_phonology
+    _worker_phonology = phonology
+
+
+def _generate_shard(task) -> List[str]:
+    shard_seed, size, syllable_count = task
+    return _worker_phonology.generate_words(size, syllable_count, random.Random(shard_seed))
+
+
+def build_lexicon_parallel(phonology: PhonologySystem, n: int, seed: int = 0, workers: int = None,
+                           shard_size: int = 10_000, syllable_count: int = None,
+                           similarity: 'SimilarityIndex' = None, word_class: str = 'unknown',
+                           max_rounds: int = 100) -> List[str]:
+    """
+    用多個行程平行生成 n 個詞
+    工作切成固定大小的分片，每個分片用 derive_seed(seed, 分片編號) 建立自己的 random.Random，
+    分片結果依序合併，所以同一個種子不論幾個 worker 都會得到完全相同的詞彙表
+    有給 similarity 時，合併時依序用近似詞索引過濾（視為 word_class 的詞），
+    不足 n 個就再生成後面編號的分片補上，結果同樣只取決於種子
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    def shard_tasks(first_index: int, count: int):
+        return [(derive_seed(seed, first_index + k), min(shard_size, count - start), syllable_count)
+                for k, start in enumerate(range(0, count, shard_size))]
+
+    def run(tasks, executor):
+        if executor is None:
+            _init_lexicon_worker(phonology)
+            return map(_generate_shard, tasks)
+        return executor.map(_generate_shard, tasks)
+
+    tasks = shard_tasks(0, n)
+    executor = None
+    if workers > 1 and len(tasks) > 1:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_lexicon_worker,
+                                       initargs=(phonology,))
+    try:
+        words = []
+        if similarity is None:
+            for shard in run(tasks, executor):
+                words.extend(shard)
+            return words
+
+        next_index = len(tasks)
+        for _ in range(max_rounds):
+            for shard in run(tasks, executor):
+                for word in shard:
+                    if len(words) < n and similarity.admit(word, word_class):
+                        words.append(word)
+            if len(words) >= n:
+                return words
+            tasks = shard_tasks(next_index, n - len(words))
+            next_index += len(tasks)
+        raise ValueError(f"生成 {max_rounds} 輪後只有 {len(words)} 個不相近的詞，詞語空間可能快用完了")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+
+def subset_construction(start, step, alphabet: Iterable[str]):
+    """
+    子集構造法：把 NFA 編成 DFA
+    step(state, char) 產生 (下一個狀態, 附加資訊)；回傳 (轉移表, 每個 DFA 狀態對應的 NFA 狀態集合)
+    DFA 狀態 0 為起始狀態，轉移表中沒有的字元表示無法接受
+    """
+    first = frozenset([start])
+    ids = {first: 0}
+    subsets = [first]
+    transitions: List[Dict[str, int]] = []
+    i = 0
+    while i < len(subsets):
+        subset = subsets[i]
+        row = {}
+        for char in alphabet:
+            target = frozenset(nxt for state in subset for nxt, _ in step(state, char))
+            if not target:
+                continue
+            if target not in ids:
+                ids[target] = len(subsets)
+                subsets.append(target)
+            row[char] = ids[target]
+        transitions.append(row)
+        i += 1
+    return transitions, subsets
+
+
+class PhonotacticValidator:
+    """
+    音韻規則的有限狀態自動機
+    把 generate_word 隱含的規則（音節結構、音節頭叢集、音節尾限制、母音叢集、
+    同音節相鄰母音不重複、一個詞最多一個變音母音、母音連續時插入子音）
+    先寫成以字元為單位的 NFA，再用子集構造法編成 DFA，驗證一個詞只需 O(詞長)
+    """
+    _START = ('S',)
+
+    def __init__(self, phonology: PhonologySystem):
+        sampler = phonology.sampler
+        self._vowel_chars = sampler.vowel_set
+        self._consonants = sampler.consonants
+        self._codas = sampler.codas
+        self._vowels = sampler.vowels
+        self._vowel_clusters = sampler.vowel_clusters
+        self._onset_clusters = sampler.onset_clusters
+
+        # 槽的展開與選項都來自取樣用的 SamplingPlan，自動機接受的詞與 generate_word 生成的詞規則一致
+        self.plan = plan = sampler.plan(phonology.syllable_patterns)
+        self._fallback_pairs = plan._fallback_pairs
+        onsets: Dict[int, Set[str]] = {}
+        for entries in plan.patterns:
+            for onset, template in entries:
+                onsets.setdefault(template, set()).add(onset)
+        templates = set()
+        for template, clusters in onsets.items():
+            slots = plan.templates[template]
+            if "" in clusters:
+                templates.add(slots)
+            clusters.discard("")
+            if clusters:
+                templates.add((('ONSET', tuple(sorted(clusters))),) + slots)
+        self.templates = tuple(sorted((t for t in templates if t), key=repr))
+
+        self._emission_cache: Dict[tuple, tuple] = {}
+        self._compile()
+
+    # ---- NFA ----
+
+    def _slot_emissions(self, template: int, slot: int, last, accented: bool):
+        """某個槽可以放的音素，以及放完之後的狀態"""
+        kind = self.templates[template][slot]
+        if isinstance(kind, tuple):  # ('ONSET', 叢集)
+            options = [(p, last, accented) for p in kind[1]]
+        else:
+            options = self.plan.choices(kind, last, accented)
+
+        last_slot = slot == len(self.templates[template]) - 1
+        for phoneme, new_last, new_accented in options:
+            if last_slot:
+                target = ('B', phoneme[-1] in self._vowel_chars, new_accented)
+            else:
+                target = ('T', template, slot + 1, new_last, new_accented)
+            yield phoneme, target
+
+    def _emissions(self, state) -> tuple:
+        """
+        從音素層級的狀態可以放的 (音素, 下一個狀態, 是否開始新音節)
+        狀態：('S',) 詞首、('B', 前一音節是否以母音結尾, 是否已用變音) 音節邊界、
+        ('H', 是否已用變音) 已插入子音等待母音開頭的音節、('T', 模板, 槽, 上一個母音, 是否已用變音)
+        """
+        cached = self._emission_cache.get(state)
+        if cached is not None:
+            return cached
+
+        result = []
+        tag = state[0]
+        if tag in ('S', 'B'):
+            ends_vowel, accented = (False, False) if tag == 'S' else state[1:]
+            for t in range(len(self.templates)):
+                for phoneme, target in self._slot_emissions(t, 0, None, accented):
+                    # 母音接母音開頭的音節時必須先插入子音
+                    if not (ends_vowel and phoneme[0] in self._vowel_chars):
+                        result.append((phoneme, target, True))
+            if ends_vowel:
+                for coda in self._codas:
+                    result.append((coda, ('H', accented), True))
+        elif tag == 'H':
+            for t in range(len(self.templates)):
+                for phoneme, target in self._slot_emissions(t, 0, None, state[1]):
+                    if phoneme[0] in self._vowel_chars:
+                        result.append((phoneme, target, False))
+        else:
+            _, template, slot, last, accented = state
+            result = [(p, target, False) for p, target in self._slot_emissions(template, slot, last, accented)]
+
+        cached = self._emission_cache[state] = tuple(result)
+        return cached
+
+    def _step(self, state, char: str):
+        """NFA 讀一個字元後可能的狀態：(下一個狀態, 是否開始新音節)"""
+        if state[0] == 'M':  # ('M', 目標狀態, 剩下的字元)
+            _, target, rest = state
+            if rest[0] == char:
+                yield (target if len(rest) == 1 else ('M', target, rest[1:])), False
+            return
+        for phoneme, target, boundary in self._emissions(state):
+            if phoneme[0] == char:
+                yield (target if len(phoneme) == 1 else ('M', target, phoneme[1:])), boundary
+
+    # ---- DFA ----
+
+    @property
+    def alphabet(self) -> Tuple[str, ...]:
+        """所有音素用到的字元（排序過）"""
+        chars = set()
+        groups = [self._consonants, self._codas, self._vowels, self._vowel_clusters, self._fallback_pairs,
+                  self._onset_clusters]
+        for group in groups:
+            for phoneme in group:
+                chars.update(phoneme)
+        return tuple(sorted(chars))
+
+    def _compile(self):
+        transitions, subsets = subset_construction(self._START, self._step, self.alphabet)
+        self.transitions = transitions
+        self.accepting = tuple(any(state[0] == 'B' for state in subset) for subset in subsets)
+
+    @property
+    def state_count(self) -> int:
+        return len(self.transitions)
+
+    def is_valid(self, word: str) -> bool:
+        """檢查一個詞是否合乎音韻規則"""
+        transitions = self.transitions
+        state = 0
+        for char in word:
+            state = transitions[state].get(char)
+            if state is None:
+                return False
+        return self.accepting[state]
+
+    def syllabify(self, word: str) -> Optional[List[str]]:
+        """把合法的詞切成音節（不合法則回傳 None）；母音連續時插入的子音算在後一個音節"""
+        # 逐字元模擬 NFA，記下每個狀態是從哪裡來的
+        layers = [{self._START: None}]
+        for char in word:
+            layer = {}
+            for state in layers[-1]:
+                for nxt, boundary in self._step(state, char):
+                    if nxt not in layer:
+                        layer[nxt] = (state, boundary)
+            if not layer:
+                return None
+            layers.append(layer)
+
+        state = next((s for s in layers[-1] if s[0] == 'B'), None)
+        if state is None:
+            return None
+
+        cuts = []
+        for position in range(len(word), 0, -1):
+            state, boundary = layers[position][state]
+            if boundary:
+                cuts.append(position - 1)
+        cuts.reverse()
+        return [word[start:end] for start, end in zip(cuts, cuts[1:] + [len(word)])]
+
+    def validate_many(self, words: Iterable[str]) -> List[bool]:
+        """一次檢查一批詞"""
+        is_valid = self.is_valid
+        return [is_valid(word) for word in words]
+
+    def coverage(self, words: Iterable[str], max_examples: int = 20) -> Dict[str, object]:
+        """統計一批詞中合法詞的比例，並列出部分不合法的例子"""
+        total = valid = 0
+        invalid_examples = []
+        for word in words:
+            total += 1
+            if self.is_valid(word):
+                valid += 1
+            elif len(invalid_examples) < max_examples:
+                invalid_examples.append(word)
+        return {
+            'total': total,
+            'valid': valid,
+            'coverage': valid / total if total else 0.0,
+            'invalid_examples': invalid_examples,
+        }
+
+    def coverage_of_file(self, path: str, max_examples: int = 20) -> Dict[str, object]:
+        """逐行讀取文字檔（例如歌詞語料），斷詞後統計合法詞比例"""
+        def tokens():
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    yield from re.findall(r"[^\W\d_]+", line.lower())
+        return self.coverage(tokens(), max_examples)
+
+
+class WordSpaceIndex:
+    """
+    所有合法詞（最多 max_syllables 個音節）的排名索引
+    在音韻自動機上加上音節數，依「長度、再依字母順序」為每個不重複的詞編號：
+    - size 為合法詞的總數
+    - rank(詞) / unrank(編號) 互相轉換
+    - sample_unique(n) 抽不重複的編號再轉回詞，保證沒有重複
+    - 直接迭代可以依序走過整個詞語空間
+    """
+
+    def __init__(self, phonology: PhonologySystem, max_syllables: int = 3):
+        self.max_syllables = max_syllables
+        self.phonology = phonology
+        self.validator = validator = PhonotacticValidator(phonology)
+        self.alphabet = validator.alphabet
+
+        def step(state, char):
+            inner, syllables = state
+            for nxt, boundary in validator._step(inner, char):
+                count = syllables + 1 if boundary else syllables
+                if count <= max_syllables:
+                    yield (nxt, count), boundary
+
+        self.transitions, self._subsets = subset_construction((validator._START, 0), step, self.alphabet)
+        accepting = [any(state[0][0] == 'B' for state in subset) for subset in self._subsets]
+        self._counts = self._count_paths(accepting)
+        self.max_length = max((r for r, c in enumerate(self._counts[0]) if c), default=0)
+        self.length_counts = tuple(self._counts[0][:self.max_length + 1])
+        self.size = sum(self.length_counts)
+
+    def _count_paths(self, accepting: List[bool]) -> List[List[int]]:
+        """counts[q][r] = 從狀態 q 出發、剛好再讀 r 個字元就被接受的字串數"""
+        transitions = self.transitions
+        n_states = len(transitions)
+        # 音節數有上限，自動機沒有迴圈，詞長不會超過狀態數
+        limit = n_states
+        counts = [[int(a)] + [0] * limit for a in accepting]
+        for r in range(1, limit + 1):
+            for q in range(n_states):
+                counts[q][r] = sum(counts[t][r - 1] for t in transitions[q].values())
+        return counts
+
+    def count_by_syllables(self) -> Dict[int, int]:
+        """
+        各音節數的合法詞數
+        同一個字串可能有不同的切分方式，因此可能同時算在多個音節數中
+        """
+        result = {}
+        for k in range(1, self.max_syllables + 1):
+            accepting = [any(state[0][0] == 'B' and state[1] == k for state in subset) for subset in self._subsets]
+            result[k] = sum(self._count_paths(accepting)[0])
+        return result
+
+    def count_by_pattern(self) -> Dict[str, int]:
+        """各音節結構在詞首能組出的音節數（以生成方式計算，不同方式組出相同字串會重複計算）"""
+        plan = self.validator.plan
+
+        def count(template, slot, last, accented):
+            if slot == len(plan.templates[template]):
+                return 1
+            return sum(count(template, slot + 1, new_last, new_accented)
+                       for _, new_last, new_accented in plan.choices(plan.templates[template][slot], last, accented))
+
+        return {pattern: sum(count(template, 0, None, False) for _, template in entries if plan.templates[template])
+                for pattern, entries in zip(plan.syllable_patterns, plan.patterns)}
+
+    def rank(self, word: str) -> int:
+        """詞語 → 編號（不在詞語空間中則 ValueError）"""
+        length = len(word)
+        if length > self.max_length:
+            raise ValueError(f"{word} 不是合法詞")
+        index = sum(self.length_counts[:length])
+        state = 0
+        for position, char in enumerate(word):
+            remaining = length - position - 1
+            row = self.transitions[state]
+            for smaller in self.alphabet:
+                if smaller == char:
+                    break
+                target = row.get(smaller)
+                if target is not None:
+                    index += self._counts[target][remaining]
+            state = row.get(char)
+            if state is None:
+                raise ValueError(f"{word} 不是合法詞")
+        if not self._counts[state][0]:
+            raise ValueError(f"{word} 不是合法詞")
+        return index
+
+    def unrank(self, index: int) -> str:
+        """編號 → 詞語"""
+        if not 0 <= index < self.size:
+            raise IndexError(f"編號超出範圍（共 {self.size} 個詞）")
+        length = 0
+        while index >= self.length_counts[length]:
+            index -= self.length_counts[length]
+            length += 1
+
+        word = []
+        state = 0
+        for remaining in range(length - 1, -1, -1):
+            row = self.transitions[state]
+            for char in self.alphabet:
+                target = row.get(char)
+                if target is None:
+                    continue
+                count = self._counts[target][remaining]
+                if index < count:
+                    word.append(char)
+                    state = target
+                    break
+                index -= count
+        return ''.join(word)
+
+    def sample_unique(self, n: int, rng=None) -> List[str]:
+        """抽 n 個保證不重複的合法詞"""
+        rng = rng or random
+        if n > self.size:
+            raise ValueError(f"詞語空間只有 {self.size} 個詞，無法抽 {n} 個不重複的詞")
+        if self.size < 2 ** 62:
+            indices = rng.sample(range(self.size), n)
+        else:
+            chosen = set()
+            while len(chosen) < n:
+                chosen.add(rng.randrange(self.size))
+            indices = list(chosen)
+        return [self.unrank(i) for i in indices]
+
+    def __iter__(self) -> Iterator[str]:
+        """依編號順序走過整個詞語空間"""
+        transitions = self.transitions
+        counts = self._counts
+        for length in range(self.max_length + 1):
+            if not self.length_counts[length]:
+                continue
+            stack = [(0, "")]
+            while stack:
+                state, prefix = stack.pop()
+                remaining = length - len(prefix)
+                if remaining == 0:
+                    yield prefix
+                    continue
+                row = transitions[state]
+                for char in reversed(self.alphabet):
+                    target = row.get(char)
+                    if target is not None and counts[target][remaining - 1]:
+                        stack.append((target, prefix + char))
+
+
+@dataclass
+class MorphologyRule:
+    """構詞規則"""
+    name: str
+    rule_type: str  # prefix, suffix, infix, reduplication
+    marker: str
+    meaning: str
+    position: str = ""
+
+class CompiledMorphology:
+    """
+    編譯好的構詞規則
+    - 依規則名稱建立索引，不必每次掃過整個 rules
+    - 每個詞類的 apply_rules 規則鏈合併成一組 (前綴, 後綴)
+    - 以 LRU 快取 (詞語, 詞類, 規則鏈) 的變化結果
+    """
+
+    def __init__(self, rules: List[MorphologyRule], cache_size: int = 65536):
+        self.source = rules
+        by_name: Dict[str, List[MorphologyRule]] = {}
+        for rule in rules:
+            by_name.setdefault(rule.name, []).append(rule)
+        self.by_name = {name: tuple(group) for name, group in by_name.items()}
+        self._class_affixes: Dict[str, Tuple[str, str]] = {}
+        self._rule_ops: Dict[str, tuple] = {}
+        self.inflect = lru_cache(maxsize=cache_size)(self._inflect)
+
+    def rules_named(self, name: str) -> Tuple[MorphologyRule, ...]:
+        return self.by_name.get(name, ())
+
+    def class_affixes(self, word_class: str) -> Tuple[str, str]:
+        """apply_rules 對某詞類的整條規則鏈，合併成 (前綴, 後綴)"""
+        affixes = self._class_affixes.get(word_class)
+        if affixes is None:
+            prefix, suffix = "", ""
+            for rule in self.source:
+                # 複數（只套用在名詞）
+                if rule.name == "plural" and word_class == "noun":
+                    suffix = suffix + rule.marker
+                # 否定（只套用在動詞）
+                elif rule.name == "negative" and word_class == "verb":
+                    neg_prefix, neg_suffix = rule.marker  # 例如 ("ne ", " pas")
+                    prefix, suffix = neg_prefix + prefix, suffix + neg_suffix
+            affixes = self._class_affixes[word_class] = (prefix, suffix)
+        return affixes
+
+    def rule_op(self, rule_name: str) -> tuple:
+        """apply_morphology 用的操作：('affix', 前綴, 後綴)、('reduplication',) 或 ()"""
+        op = self._rule_ops.get(rule_name)
+        if op is None:
+            op = ()
+            for rule in self.rules_named(rule_name):
+                if rule.rule_type == 'prefix':
+                    op = ('affix', rule.marker, "")
+                elif rule.rule_type == 'suffix':
+                    op = ('affix', "", rule.marker)
+                elif rule.rule_type == 'reduplication':
+                    op = ('reduplication',)
+                else:
+                    continue
+                break
+            self._rule_ops[rule_name] = op
+        return op
+
+    def apply_rule(self, word: str, rule_name: str) -> str:
+        op = self.rule_op(rule_name)
+        if not op:
+            return word
+        if op[0] == 'reduplication':
+            return word + word
+        return op[1] + word + op[2]
+
+    def _inflect(self, word: str, word_class: str, chain: Tuple[str, ...] = None) -> str:
+        if chain is None:
+            prefix, suffix = self.class_affixes(word_class)
+            return prefix + word + suffix
+        for rule_name in chain:
+            word = self.apply_rule(word, rule_name)
+        return word
+
+    def inflect_many(self, words: Iterable[str], word_class: str, chain: Tuple[str, ...] = None) -> List[str]:
+        """一次變化一整批詞（不經過快取）"""
+        if chain is None:
+            prefix, suffix = self.class_affixes(word_class)
+            return [prefix + word + suffix for word in words]
+        op = self.rule_op(chain[0]) if len(chain) == 1 else ()
+        if op and op[0] == 'affix':
+            _, prefix, suffix = op
+            return [prefix + word + suffix for word in words]
+        return [self._inflect(word, word_class, chain) for word in words]
+
+
+@dataclass
+class MorphologySystem:
+    """構詞系統"""
+    rules: List[MorphologyRule] = field(default_factory=list)
+    word_classes: Dict[str, List[str]] = field(default_factory=lambda: {
+        'noun': [], 'verb': [], 'adjective': []#, 'adverb': []
+    })
+    _compiled: CompiledMorphology = field(default=None, init=False, repr=False, compare=False)
+
+    def __setattr__(self, name, value):
+        # 重新指定規則時包裝成會通知的 list：新增、刪除、原地替換或重排規則都會讓編譯好的規則失效
+        if name == 'rules':
+            value = _TrackedList(value, self._invalidate_compiled)
+            object.__setattr__(self, '_compiled', None)
+        object.__setattr__(self, name, value)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_compiled'] = None
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def _invalidate_compiled(self):
+        object.__setattr__(self, '_compiled', None)
+
+    def add_rule(self, name: str, rule_type: str, marker: str, meaning: str):
+        """添加構詞規則"""
+        rule = MorphologyRule(name, rule_type, marker, meaning)
+        self.rules.append(rule)
+
+    @property
+    def compiled(self) -> CompiledMorphology:
+        """取得（規則變動時重建）編譯好的規則"""
+        if self._compiled is None:
+            self._compiled = CompiledMorphology(self.rules)
+        return self._compiled
+
+    def apply_rules(self, word: str, word_class: str) -> str:
+        """依據詞類套用規則"""
+        prefix, suffix = self.compiled.class_affixes(word_class)
+        if STATS.enabled:
+            STATS.incr(f'morphology.apply_rules.{word_class}')
+        return prefix + word + suffix
+
+    def apply_morphology(self, base_word: str, rule_name: str) -> str:
+        """應用構詞規則"""
+        if STATS.enabled:
+            STATS.incr(f'morphology.rule.{rule_name}')
+        return self.compiled.apply_rule(base_word, rule_name)
+
+    def inflect(self, word: str, word_class: str, chain: Tuple[str, ...] = None) -> str:
+        """
+        帶快取的詞形變化
+        chain 為 None 時等同 apply_rules，否則依序套用 chain 中的規則（同 apply_morphology）
+        """
+        return self.compiled.inflect(word, word_class, chain)
+
+    def inflect_many(self, words: Iterable[str], word_class: str, chain: Tuple[str, ...] = None) -> List[str]:
+        """一次變化一整批詞，例如製作詞形變化表"""
+        return self.compiled.inflect_many(words, word_class, chain)
+
+@dataclass
+class SyntaxRule:
+    """句法規則"""
+    name: str
+    pattern: str  # SVO, SOV, VSO etc.，或文法規則（例如 NP -> DET adjective noun）
+    description: str
+
+# 各語序的句型，參數順序為 (主語, 動詞, 賓語)
+WORD_ORDER_FORMATS = {
+    "SVO": "{0} {1} {2}",
+    "SOV": "{0} {2} {1}",
+    "VSO": "{1} {0} {2}",
+    "OVS": "{2} {1} {0}",
+    "OSV": "{2} {0} {1}",
+    "VOS": "{1} {2} {0}",
+}
+
+# 文法符號：('lit', 字)、('lex', 詞類, 是否套用 apply_rules)、('nt', 非終端符號)
+_GRAMMAR_TOKEN_RE = re.compile(r"'([^']*)'|\"([^\"]*)\"|\[([0-9]*\.?[0-9]+)\]|(\|)|([^\s|'\"\[]+)")
+
+
+def parse_grammar_rule(text: str) -> Tuple[str, List[Tuple[tuple, float]]]:
+    """
+    解析一條文法規則，例如 "NP -> DET noun [3] | DET adjective noun"，回傳 (左邊的符號, [(符號串, 權重)])
+    大寫開頭的是非終端符號、小寫的是詞類（後面加 + 表示套用 apply_rules：名詞變複數、動詞加否定），
+    引號內是照原樣輸出的字，[權重] 放在選項最後（預設 1），空的選項表示什麼都不輸出
+    """
+    head, arrow, body = text.partition('->')
+    head = head.strip()
+    if not arrow or not head or not head[0].isupper() or not head.isidentifier():
+        raise ValueError(f"文法規則格式錯誤：{text}")
+    alternatives = []
+    symbols: List[tuple] = []
+    weight = 1.0
+    for literal, quoted, number, bar, name in _GRAMMAR_TOKEN_RE.findall(body) + [('', '', '', '|', '')]:
+        if bar:
+            alternatives.append((tuple(symbols), weight))
+            symbols, weight = [], 1.0
+        elif number:
+            weight = float(number)
+        elif name:
+            inflect = name.endswith('+')
+            name = name.rstrip('+')
+            if not name.isidentifier():
+                raise ValueError(f"文法規則中有不合法的符號 {name}：{text}")
+            if name[0].isupper():
+                if inflect:
+                    raise ValueError(f"只有詞類可以加 +：{text}")
+                symbols.append(('nt', name))
+            else:
+                symbols.append(('lex', name, inflect))
+        else:
+            symbols.append(('lit', literal or quoted))
+    return head, alternatives
+
+
+@dataclass
+class Grammar:
+    """上下文無關文法 {非終端符號: [(符號串, 權重)]}，從 start 開始展開（不可遞迴）"""
+    productions: Dict[str, List[Tuple[tuple, float]]] = field(default_factory=dict)
+    start: str = "S"
+
+    def add_production(self, head: str, symbols: Iterable[tuple], weight: float = 1.0):
+        self.productions.setdefault(head, []).append((tuple(symbols), weight))
+
+    def add(self, text: str):
+        """加入一條文法規則字串（見 parse_grammar_rule），同一個符號的選項會累加"""
+        head, alternatives = parse_grammar_rule(text)
+        self.productions.setdefault(head, []).extend(alternatives)
+
+
+@dataclass
+class SyntaxSystem:
+    """句法系統"""
+    word_order: str = "SVO"
+    rules: List[SyntaxRule] = field(default_factory=list)
+
+    def add_rule(self, name: str, pattern: str, description: str):
+        """添加句法規則"""
+        rule = SyntaxRule(name, pattern, description)
+        self.rules.append(rule)
+
+    @property
+    def sentence_format(self) -> str:
+        """目前語序的句型（參數順序為 主語, 動詞, 賓語），不支援的語序視為 SVO"""
+        return WORD_ORDER_FORMATS.get(self.word_order, WORD_ORDER_FORMATS["SVO"])
+
+    @property
+    def question_marker(self) -> str:
+        """疑問標記（從 question 規則中抓，沒有設定時為 ?）"""
+        question_rule = next((r for r in self.rules if r.name == "question"), None)
+        return question_rule.pattern.split("+")[-1] if question_rule else "?"
+
+    def build_grammar(self, morphology: 'MorphologySystem') -> Grammar:
+        """
+        依語序、構詞規則與 rules 中的文法規則（pattern 含 -> 的，見 parse_grammar_rule）建立句子文法
+        預設的文法：陳述句與疑問句、及物與不及物子句、否定動詞，名詞片語可以帶形容詞或變成複數
+        """
+        order = self.word_order if self.word_order in WORD_ORDER_FORMATS else "SVO"
+        compiled = morphology.compiled
+        roles = {'S': ('nt', 'NP'), 'V': ('nt', 'VP'), 'O': ('nt', 'NP')}
+        grammar = Grammar()
+
+        grammar.add_production("S", [('nt', 'CLAUSE')], 3)
+        grammar.add_production("S", [('nt', 'CLAUSE'), ('lit', self.question_marker)], 1)
+        grammar.add_production("CLAUSE", [roles[c] for c in order], 3)
+        grammar.add_production("CLAUSE", [roles[c] for c in order if c != 'O'], 1)
+
+        grammar.add_production("VP", [('lex', 'verb', False)], 3)
+        if compiled.rules_named("negative"):
+            grammar.add_production("VP", [('lex', 'verb', True)], 1)
+
+        articles = [rule.marker.strip() for rule in compiled.rules_named("definite_article")]
+        determiner = [('nt', 'DET')] if articles else []
+        for article in articles:
+            grammar.add_production("DET", [('lit', article)])
+        noun, adjective = ('lex', 'noun', False), ('lex', 'adjective', False)
+        grammar.add_production("NP", determiner + [noun], 4)
+        grammar.add_production("NP", determiner + [noun, adjective], 2)
+        grammar.add_production("NP", determiner + [noun, adjective, adjective], 0.5)
+        if compiled.rules_named("plural"):
+            plural = [('lit', 'les')] if 'les' in articles else determiner
+            grammar.add_production("NP", plural + [('lex', 'noun', True)], 1)
+
+        for rule in self.rules:
+            if '->' in rule.pattern:
+                grammar.add(rule.pattern)
+        return grammar
+
+    def generate_sentence(self, subject: str, verb: str, obj: str = "") -> str:
+        """根據語序生成句子（空的成分直接略過，例如沒有賓語時不會留下兩個空白）"""
+        if STATS.enabled:
+            STATS.incr(f'syntax.sentences.{self.word_order}')
+        order = self.word_order if self.word_order in WORD_ORDER_FORMATS else "SVO"
+        parts = {'S': subject, 'V': verb, 'O': obj}
+        return " ".join(parts[role] for role in order if parts[role])
+
+def edit_distance(a: str, b: str, limit: int = None) -> int:
+    """Levenshtein 編輯距離；有給 limit 時，一確定超過 limit 就提早回傳 limit + 1"""
+    if a == b:
+        return 0
+    if len(a) < len(b):
+        a, b = b, a
+    if limit is not None and len(a) - len(b) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if limit is not None and min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def _deletion_keys(word: str, depth: int) -> Set[str]:
+    """刪掉至多 depth 個字元後可能得到的所有字串（含原字串）"""
+    keys = {word}
+    frontier = {word}
+    for _ in range(depth):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+        keys |= frontier
+    return keys
+
+
+class NearWordIndex:
+    """
+    刪除鄰域（symmetric delete）簽章索引
+    每個詞以「刪掉至多 d 個字元」的所有變形當簽章；兩個詞編輯距離 ≤ d 時一定有共同的簽章，
+    所以查詢只要產生查詢詞的簽章、取出候選再算一次編輯距離，成本只和詞長有關，與詞彙量無關
+    刪除只做標記（查詢時略過）
+    """
+    __slots__ = ('max_distance', '_buckets', '_words', '_removed')
+
+    def __init__(self, max_distance: int = 1, words: Iterable[str] = ()):
+        self.max_distance = max_distance
+        self._buckets: Dict[str, List[str]] = {}
+        self._words: Set[str] = set()
+        self._removed: Set[str] = set()
+        for word in words:
+            self.add(word)
+
+    def __len__(self):
+        return len(self._words) - len(self._removed)
+
+    def __contains__(self, word):
+        return word in self._words and word not in self._removed
+
+    def add(self, word: str) -> bool:
+        """加入詞語，回傳是否為新詞"""
+        if word in self._words:
+            if word in self._removed:
+                self._removed.discard(word)
+                return True
+            return False
+        self._words.add(word)
+        buckets = self._buckets
+        for key in _deletion_keys(word, self.max_distance):
+            bucket = buckets.get(key)
+            if bucket is None:
+                buckets[key] = [word]
+            else:
+                bucket.append(word)
+        return True
+
+    def discard(self, word: str):
+        if word in self._words:
+            self._removed.add(word)
+
+    def _candidates(self, word: str, max_distance: int) -> Iterator[Tuple[int, str]]:
+        if max_distance > self.max_distance:
+            raise ValueError(f"索引只支援距離 {self.max_distance} 以內的查詢")
+        seen = set()
+        removed = self._removed
+        for key in _deletion_keys(word, max_distance):
+            for candidate in self._buckets.get(key, ()):
+                if candidate in seen or candidate in removed:
+                    continue
+                seen.add(candidate)
+                distance = edit_distance(word, candidate, max_distance)
+                if distance <= max_distance:
+                    yield distance, candidate
+
+    def search(self, word: str, max_distance: int = None) -> List[Tuple[int, str]]:
+        """距離 max_distance（預設為索引的距離）以內的所有詞（依距離排序）"""
+        return sorted(self._candidates(word, self.max_distance if max_distance is None else max_distance))
+
+    def find_within(self, word: str, max_distance: int = None, exclude: str = None) -> Optional[str]:
+        """找到任何一個距離 max_distance 以內的詞就回傳（找不到回傳 None）"""
+        for _, found in self._candidates(word, self.max_distance if max_distance is None else max_distance):
+            if found != exclude:
+                return found
+        return None
+
+
+class SimilarityIndex:
+    """
+    近似詞索引：每個詞類一個 NearWordIndex
+    新詞與同詞類中某個已有的詞編輯距離在 max_distance 以內時，
+    mode='reject' 直接拒絕，mode='flag' 照樣加入但記在 flagged 中
+    """
+
+    def __init__(self, max_distance: int = 1, mode: str = 'reject'):
+        if mode not in ('reject', 'flag'):
+            raise ValueError(f"不支援的模式：{mode}")
+        self.max_distance = max_distance
+        self.mode = mode
+        self.indexes: Dict[str, NearWordIndex] = {}
+        self.flagged: List[Tuple[str, str, str]] = []  # (詞類, 新詞, 相近的既有詞)
+
+    def similar_to(self, word: str, word_class: str) -> Optional[str]:
+        """同詞類中與 word 太接近的詞（沒有則回傳 None）"""
+        index = self.indexes.get(word_class)
+        if index is None:
+            return None
+        return index.find_within(word, self.max_distance, exclude=word)
+
+    def add(self, word: str, word_class: str):
+        index = self.indexes.get(word_class)
+        if index is None:
+            index = self.indexes[word_class] = NearWordIndex(self.max_distance)
+        index.add(word)
+
+    def discard(self, word: str, word_class: str):
+        index = self.indexes.get(word_class)
+        if index is not None:
+            index.discard(word)
+
+    def admit(self, word: str, word_class: str) -> bool:
+        """檢查並加入新詞，回傳是否接受（同詞類中完全相同的詞一律不接受）"""
+        index = self.indexes.get(word_class)
+        if index is not None and word in index:
+            return False
+        similar = self.similar_to(word, word_class)
+        if similar is not None:
+            if self.mode == 'reject':
+                return False
+            self.flagged.append((word_class, word, similar))
+        self.add(word, word_class)
+        return True
+
+
+class PhonemeIndex:
+    """
+    音素/叢集 → 含有它的詞 的反向索引
+    以字元為單位建立 posting，所以增減音素（例如新增 ch、eau）時索引不必重建；
+    查詢多字元的音素或叢集時取各字元 posting 的交集，再確認確實含有該子字串
+    """
+
+    def __init__(self, words: Iterable[str] = ()):
+        self._postings: Dict[str, Set[str]] = {}
+        for word in words:
+            self.add(word)
+
+    def add(self, word: str):
+        postings = self._postings
+        for char in set(word):
+            words = postings.get(char)
+            if words is None:
+                words = postings[char] = set()
+            words.add(word)
+
+    def discard(self, word: str):
+        postings = self._postings
+        for char in set(word):
+            words = postings.get(char)
+            if words is not None:
+                words.discard(word)
+                if not words:
+                    del postings[char]
+
+    def words_containing(self, phoneme: str) -> Set[str]:
+        """含有某個音素或叢集的所有詞"""
+        buckets = sorted((self._postings.get(char, ()) for char in set(phoneme)), key=len)
+        if not buckets or not buckets[0]:
+            return set()
+        if len(buckets) == 1:
+            return set(buckets[0])
+        return {word for word in buckets[0].intersection(*buckets[1:]) if phoneme in word}
+
+    def affected(self, phonemes: Iterable[str]) -> Set[str]:
+        """含有其中任何一個音素或叢集的詞"""
+        result = set()
+        for phoneme in phonemes:
+            result |= self.words_containing(phoneme)
+        return result
+
+
+def _bump(counter: Dict, key, amount: int):
+    """計數器加減（減到 0 就刪掉，合併與輸出時不會留下空的項目）"""
+    value = counter.get(key, 0) + amount
+    if value:
+        counter[key] = value
+    else:
+        counter.pop(key, None)
+
+
+class LexiconStats:
+    """
+    詞彙的串流統計：詞語加入或移除時即時更新計數器，不需要再掃一次整個詞彙
+    - 音素與音素雙連（bigram）的頻率
+    - 音節結構的分佈、詞長（字元數）的直方圖
+    - 各詞類用到變音母音的詞數、各詞類的音節尾子音分佈
+    音素切分與音節結構用建立時的音素庫存（最長匹配）；每種詞形骨架（例如 CVCV）的可能音節切法只算一次，
+    每個詞再從中挑第一個音節頭叢集與音節尾都合法的切法；
+    平行產生的分片可以各自統計再用 merge / combine 合併，結果可用 snapshot() / dump() 輸出
+    """
+
+    def __init__(self, phonology: PhonologySystem):
+        phonemes = sorted(set(phonology.consonants) | set(phonology.vowels), key=lambda p: (-len(p), p))
+        self._split = re.compile('|'.join(map(re.escape, phonemes)) + '|.' if phonemes else '.').findall
+        self._kinds = {p: 'V' if p in phonology.vowels else 'C' for p in phonemes}  # 庫存外的字元算子音
+        self._codas = frozenset(phonology.coda_restrictions or phonology.consonants)
+        self._onsets = frozenset(phonology.onset_clusters)
+        patterns = set(phonology.syllable_patterns)
+        # 母音連續時插入的子音會讓 V 開頭的音節多一個 C
+        patterns |= {'C' + p for p in phonology.syllable_patterns if p.startswith('V')}
+        self._patterns = tuple(sorted(patterns, key=lambda p: (-len(p), p)))
+        self.inventory = (tuple(phonemes), tuple(phonology.syllable_patterns),
+                          tuple(sorted(self._codas)), tuple(sorted(self._onsets)))
+        self._syllables: Dict[str, tuple] = {}
+        self.words = 0
+        self.classes: Dict[str, int] = {}
+        self.phonemes: Dict[str, int] = {}
+        self.bigrams: Dict[str, int] = {}  # "前 後"
+        self.syllable_patterns: Dict[str, int] = {}
+        self.lengths: Dict[int, int] = {}
+        self.accented: Dict[str, int] = {}  # {詞類: 含變音母音的詞數}
+        self.codas: Dict[str, Dict[str, int]] = {}  # {詞類: {音節尾子音: 次數}}
+
+    @classmethod
+    def from_lexicon(cls, lexicon, phonology: PhonologySystem) -> 'LexiconStats':
+        """掃一次既有的詞彙建立統計（之後用 add / discard 更新）"""
+        stats = cls(phonology)
+        for word_class, words in lexicon.items():
+            stats.tally(words, word_class)
+        return stats
+
+    # 每種骨架最多保留幾種音節切法
+    MAX_SPLITS = 8
+
+    def _splits(self, skeleton: str) -> tuple:
+        """詞形骨架可能的音節切法（每種骨架只算一次，長的音節結構優先）；拆不出來時整個詞當成一個音節"""
+        splits = self._syllables.get(skeleton)
+        if splits is None:
+            n = len(skeleton)
+            suffixes: List[tuple] = [()] * n + [((),)]
+            for i in range(n - 1, -1, -1):
+                options = []
+                for pattern in self._patterns:
+                    end = i + len(pattern)
+                    if end <= n and skeleton.startswith(pattern, i):
+                        options.extend((pattern,) + rest for rest in suffixes[end])
+                suffixes[i] = tuple(options[:self.MAX_SPLITS])
+            splits = self._syllables[skeleton] = suffixes[0] or ((skeleton,),)
+        return splits
+
+    def _syllabify(self, phonemes: List[str]) -> tuple:
+        """挑第一個音節頭叢集與音節尾都合法的切法"""
+        splits = self._splits(''.join(map(self._kinds.get, phonemes, itertools.repeat('C'))))
+        codas, onsets = self._codas, self._onsets
+        for syllables in splits:
+            position = 0
+            for pattern in syllables:
+                if onsets and pattern.startswith('CC') and phonemes[position] + phonemes[position + 1] not in onsets:
+                    break
+                position += len(pattern)
+                if len(pattern) > 1 and pattern[-1] == 'C' and phonemes[position - 1] not in codas:
+                    break
+            else:
+                return syllables
+        return splits[0]
+
+    def _update(self, word: str, word_class: str, sign: int):
+        phonemes = self._split(word)
+        self.words += sign
+        _bump(self.classes, word_class, sign)
+        _bump(self.lengths, len(word), sign)
+        for phoneme in phonemes:
+            _bump(self.phonemes, phoneme, sign)
+        for left, right in zip(phonemes, phonemes[1:]):
+            _bump(self.bigrams, f"{left} {right}", sign)
+        if any(char in ACCENTED_VOWELS for char in word):
+            _bump(self.accented, word_class, sign)
+
+        codas = self.codas.get(word_class)
+        if codas is None:
+            codas = self.codas[word_class] = {}
+        position = 0
+        for pattern in self._syllabify(phonemes):
+            _bump(self.syllable_patterns, pattern, sign)
+            position += len(pattern)
+            if len(pattern) > 1 and pattern[-1] == 'C':
+                _bump(codas, phonemes[position - 1], sign)
+        if not codas:
+            del self.codas[word_class]
+
+    def add(self, word: str, word_class: str):
+        self._update(word, word_class, 1)
+
+    def discard(self, word: str, word_class: str):
+        self._update(word, word_class, -1)
+
+    def tally(self, words: Iterable[str], word_class: str) -> 'LexiconStats':
+        """
+        統計一批詞（平行分片、造完整批詞之後用）
+        先累加在區域的 Counter，最後每個鍵只併進統計一次，比逐詞 add 少掉大部分的 _bump
+        """
+        split, syllabify = self._split, self._syllabify
+        all_phonemes, all_bigrams, lengths = [], [], []
+        patterns, codas = Counter(), Counter()
+        accented = 0
+        for word in words:
+            parts = split(word)
+            lengths.append(len(word))
+            all_phonemes.extend(parts)
+            all_bigrams.extend(map('{} {}'.format, parts, parts[1:]))
+            if any(char in ACCENTED_VOWELS for char in word):
+                accented += 1
+            position = 0
+            for pattern in syllabify(parts):
+                patterns[pattern] += 1
+                position += len(pattern)
+                if len(pattern) > 1 and pattern[-1] == 'C':
+                    codas[parts[position - 1]] += 1
+        count = len(lengths)
+        if not count:
+            return self
+        phonemes, bigrams, lengths = Counter(all_phonemes), Counter(all_bigrams), Counter(lengths)
+
+        self.words += count
+        _bump(self.classes, word_class, count)
+        if accented:
+            _bump(self.accented, word_class, accented)
+        for counter, totals in ((self.phonemes, phonemes), (self.bigrams, bigrams),
+                                (self.syllable_patterns, patterns), (self.lengths, lengths)):
+            for key, value in totals.items():
+                _bump(counter, key, value)
+        if codas:
+            mine = self.codas.setdefault(word_class, {})
+            for key, value in codas.items():
+                _bump(mine, key, value)
+        return self
+
+    def merge(self, other: 'LexiconStats') -> 'LexiconStats':
+        """把另一個分片的統計加進來（兩邊必須用同一組音素庫存切分）"""
+        if other.inventory != self.inventory:
+            raise ValueError("兩份統計的音素庫存或音節結構不同，無法合併")
+        self.words += other.words
+        for name in ('classes', 'phonemes', 'bigrams', 'syllable_patterns', 'lengths', 'accented'):
+            counter = getattr(self, name)
+            for key, value in getattr(other, name).items():
+                _bump(counter, key, value)
+        for word_class, codas in other.codas.items():
+            mine = self.codas.setdefault(word_class, {})
+            for key, value in codas.items():
+                _bump(mine, key, value)
+        return self
+
+    @classmethod
+    def combine(cls, parts: Iterable['LexiconStats']) -> 'LexiconStats':
+        """合併多個分片的統計（不修改分片本身）"""
+        parts = list(parts)
+        if not parts:
+            raise ValueError("沒有任何統計可以合併")
+        combined = copy.deepcopy(parts[0])
+        for part in parts[1:]:
+            combined.merge(part)
+        return combined
+
+    def top(self, name: str, n: int = 10) -> List[Tuple[object, int]]:
+        """某個計數器中最常見的 n 項"""
+        return sorted(getattr(self, name).items(), key=lambda item: (-item[1], str(item[0])))[:n]
+
+    def snapshot(self) -> Dict[str, object]:
+        """目前的統計（可以存成 JSON 的 dict）"""
+        return {
+            'words': self.words,
+            'classes': dict(sorted(self.classes.items())),
+            'phonemes': dict(self.top('phonemes', len(self.phonemes))),
+            'bigrams': dict(self.top('bigrams', len(self.bigrams))),
+            'syllable_patterns': dict(self.top('syllable_patterns', len(self.syllable_patterns))),
+            'lengths': {str(length): count for length, count in sorted(self.lengths.items())},
+            'accented': dict(sorted(self.accented.items())),
+            'codas': {word_class: dict(sorted(codas.items(), key=lambda item: (-item[1], item[0])))
+                      for word_class, codas in sorted(self.codas.items())},
+        }
+
+    def dump(self, path: str = None):
+        """把統計存成 JSON（沒有給路徑時印到標準錯誤）"""
+        _dump_json(self.snapshot(), path)
+
+
+class WordList:
+    """
+    某個詞類的詞語（Lexicon 的一部分）
+    用陣列存詞語、用字典記位置：新增、刪除、查詢都是 O(1)，也可以直接給 random.choice 抽樣
+    """
+    __slots__ = ('word_class', '_lexicon', '_words', '_positions')
+
+    def __init__(self, lexicon: 'Lexicon', word_class: str):
+        self.word_class = word_class
+        self._lexicon = lexicon
+        self._words: List[str] = []
+        self._positions: Dict[str, int] = {}
+
+    def __len__(self):
+        return len(self._words)
+
+    def __iter__(self):
+        return iter(self._words)
+
+    def __contains__(self, word):
+        return word in self._positions
+
+    def __getitem__(self, index):
+        return self._words[index]
+
+    def __repr__(self):
+        return f"WordList({self.word_class!r}, {self._words!r})"
+
+    def append(self, word: str) -> bool:
+        """加入詞語（已在詞彙中的重複詞語會被忽略），回傳是否有加入"""
+        return self._lexicon.add(word, self.word_class)
+
+    def extend(self, words: Iterable[str]) -> int:
+        return self._lexicon.extend(words, self.word_class)
+
+    def remove(self, word: str):
+        if word not in self._positions:
+            raise ValueError(f"{word} 不在 {self.word_class} 中")
+        self._lexicon.remove(word)
+
+    def _insert(self, word: str):
+        self._positions[word] = len(self._words)
+        self._words.append(word)
+
+    def _discard(self, word: str):
+        # 把最後一個詞搬到被刪除的位置，刪除就不用移動整個陣列
+        position = self._positions.pop(word)
+        last = self._words.pop()
+        if position < len(self._words):
+            self._words[position] = last
+            self._positions[last] = position
+
+
+class Lexicon:
+    """
+    詞彙表 {詞性: WordList}
+    每個詞只會屬於一個詞類，並保留 詞語 → 詞類 的反查索引
+    用法與原本的 defaultdict(list) 相容：vocabulary['noun'].append(word)、random.choice(vocabulary['verb'])
+    """
+    __slots__ = ('_classes', '_class_of', 'similarity', 'phonemes', 'stats')
+
+    def __init__(self, similarity: SimilarityIndex = None, phonemes: PhonemeIndex = None,
+                 stats: LexiconStats = None):
+        self._classes: Dict[str, WordList] = {}
+        self._class_of: Dict[str, str] = {}
+        self.similarity = None
+        self.phonemes = None
+        self.stats = None
+        if similarity is not None:
+            self.set_similarity(similarity)
+        if phonemes is not None:
+            self.set_phoneme_index(phonemes)
+        if stats is not None:
+            self.set_stats(stats)
+
+    def __getitem__(self, word_class: str) -> WordList:
+        words = self._classes.get(word_class)
+        if words is None:
+            words = self._classes[word_class] = WordList(self, word_class)
+        return words
+
+    def __contains__(self, word):
+        return word in self._class_of
+
+    def __len__(self):
+        return len(self._class_of)
+
+    def __iter__(self):
+        return iter(self._classes)
+
+    def __repr__(self):
+        return f"Lexicon({ {c: list(w) for c, w in self._classes.items()} !r})"
+
+    def get(self, word_class: str, default=None):
+        return self._classes.get(word_class, default)
+
+    def keys(self):
+        return self._classes.keys()
+
+    def items(self):
+        return self._classes.items()
+
+    def values(self):
+        return self._classes.values()
+
+    def set_similarity(self, similarity: Optional[SimilarityIndex]):
+        """
+        啟用近似詞索引（None 則停用）；既有的詞會全部放進索引，
+        之後 add 的新詞與同詞類的詞太接近時會被拒絕或標記（見 SimilarityIndex）
+        """
+        self.similarity = similarity
+        if similarity is not None:
+            for word_class, words in self._classes.items():
+                for word in words:
+                    similarity.add(word, word_class)
+
+    def set_phoneme_index(self, phonemes: Optional[PhonemeIndex]):
+        """啟用音素反向索引（None 則停用），讓 revalidate 只需要檢查受影響的詞"""
+        self.phonemes = phonemes
+        if phonemes is not None:
+            for word in self._class_of:
+                phonemes.add(word)
+
+    def set_stats(self, stats: Optional[LexiconStats]):
+        """啟用串流統計（None 則停用）；既有的詞會先統計一次，之後隨 add / remove 更新"""
+        self.stats = stats
+        if stats is not None:
+            for word_class, words in self._classes.items():
+                stats.tally(words, word_class)
+
+    def add(self, word: str, word_class: str, check_similar: bool = True) -> bool:
+        """
+        新增詞語，回傳是否有加入（重複的詞語不會加入）
+        有啟用近似詞索引時，check_similar=True 會拒絕（或標記）同詞類中太接近的詞
+        """
+        if word in self._class_of:
+            return False
+        if self.similarity is not None:
+            if check_similar:
+                if not self.similarity.admit(word, word_class):
+                    return False
+            else:
+                self.similarity.add(word, word_class)
+        word = sys.intern(word)
+        self._class_of[word] = word_class
+        self[word_class]._insert(word)
+        if self.phonemes is not None:
+            self.phonemes.add(word)
+        if self.stats is not None:
+            self.stats.add(word, word_class)
+        return True
+
+    def extend(self, words: Iterable[str], word_class: str) -> int:
+        """加入一批詞語，回傳加入的數量；串流統計在整批加完後才一次 tally，不必逐詞更新計數器"""
+        stats, self.stats = self.stats, None
+        try:
+            added = [word for word in words if self.add(word, word_class)]
+        finally:
+            self.stats = stats
+        if stats is not None:
+            stats.tally(added, word_class)
+        return len(added)
+
+    def remove(self, word: str):
+        word_class = self._class_of.pop(word)
+        self._classes[word_class]._discard(word)
+        if self.similarity is not None:
+            self.similarity.discard(word, word_class)
+        if self.phonemes is not None:
+            self.phonemes.discard(word)
+        if self.stats is not None:
+            self.stats.discard(word, word_class)
+
+    def discard(self, word: str):
+        if word in self._class_of:
+            self.remove(word)
+
+    def move(self, word: str, word_class: str):
+        """把詞語改分到另一個詞類（玩家指定的分類不做近似詞檢查，只會被索引標記）"""
+        self.remove(word)
+        self.add(word, word_class, check_similar=False)
+
+    def class_of(self, word: str) -> Optional[str]:
+        """查詢詞語的詞類（不在詞彙中則回傳 None）"""
+        return self._class_of.get(word)
+
+    def sample(self, word_class: str, rng=None) -> str:
+        """從某詞類中均勻抽一個詞"""
+        return (rng or random).choice(self._classes[word_class])
+
+    def revalidate(self, phonemes: Optional[Iterable[str]], is_valid: Callable[[str], bool]) -> Dict[str, List[str]]:
+        """
+        移除含有這些音素/叢集、而且已經不合法的詞，回傳 {詞類: [被移除的詞]}
+        有音素索引時只檢查受影響的詞；phonemes 為 None 表示每個詞都要檢查
+        """
+        if phonemes is None:
+            candidates = list(self._class_of)
+        elif self.phonemes is not None:
+            candidates = sorted(self.phonemes.affected(phonemes))
+        else:
+            phonemes = tuple(phonemes)
+            candidates = [word for word in self._class_of if any(p in word for p in phonemes)]
+        removed: Dict[str, List[str]] = {}
+        for word in candidates:
+            if not is_valid(word):
+                removed.setdefault(self._class_of[word], []).append(word)
+        for words in removed.values():
+            for word in words:
+                self.remove(word)
+        return removed
+
+    def fill(self, word_class: str, phonology: 'PhonologySystem', n: int, rng=None,
+             syllable_count: int = None, max_attempts: int = None) -> int:
+        """
+        用 generate_word 替某詞類補進 n 個新詞（重複或太接近的詞會被略過，持續生成直到補滿）
+        超過 max_attempts 次（預設 100n + 1000）還補不滿時丟出 ValueError，通常表示詞語空間快用完了
+        """
+        if max_attempts is None:
+            max_attempts = 100 * n + 1000
+        words = self[word_class]
+        added = attempts = 0
+        while added < n:
+            if attempts >= max_attempts:
+                raise ValueError(f"嘗試 {attempts} 次只補進 {added} 個 {word_class}，"
+                                 "詞語空間可能快用完了（或近似詞距離設太大）")
+            batch = phonology.generate_words(min(n - added, 1_000), syllable_count, rng)
+            attempts += len(batch)
+            added += words.extend(batch)
+        return added
+
+
+class MappedWordList:
+    """
+    快照中某個詞類的詞語（唯讀）
+    詞語存在記憶體映射的字串表裡，用到哪個才解碼哪個；同一詞類內依位元組排序，可以二分搜尋
+    """
+    __slots__ = ('word_class', '_blob', '_offsets', '_start', '_end')
+
+    def __init__(self, word_class: str, blob, offsets, start: int, end: int):
+        self.word_class = word_class
+        self._blob = blob
+        self._offsets = offsets
+        self._start = start
+        self._end = end
+
+    def __len__(self):
+        return self._end - self._start
+
+    def _decode(self, index: int) -> str:
+        return str(self._blob[self._offsets[index]:self._offsets[index + 1]], 'utf-8')
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._decode(self._start + i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("詞語編號超出範圍")
+        return self._decode(self._start + index)
+
+    def __iter__(self):
+        for index in range(self._start, self._end):
+            yield self._decode(index)
+
+    def __contains__(self, word):
+        target = word.encode('utf-8')
+        blob, offsets = self._blob, self._offsets
+        lo, hi = self._start, self._end
+        while lo < hi:
+            mid = (lo + hi) // 2
+            current = bytes(blob[offsets[mid]:offsets[mid + 1]])
+            if current == target:
+                return True
+            if current < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        return False
+
+    def __repr__(self):
+        return f"MappedWordList({self.word_class!r}, {len(self)} 個詞)"
+
+
+class MappedLexicon:
+    """
+    從快照映射進來的唯讀詞彙表，讀取介面與 Lexicon 相同（vocabulary['noun']、random.choice、in、class_of）
+    需要修改時用 materialize() 轉成一般的 Lexicon
+    """
+
+    def __init__(self, blob, offsets, classes: List[Tuple[str, int, int]]):
+        self._classes = {name: MappedWordList(name, blob, offsets, start, end) for name, start, end in classes}
+        self._stats = None
+        self._tallied = False
+
+    def __getitem__(self, word_class: str):
+        words = self._classes.get(word_class)
+        if words is None:
+            return ()
+        return words
+
+    def __contains__(self, word):
+        return self.class_of(word) is not None
+
+    def __len__(self):
+        return sum(len(words) for words in self._classes.values())
+
+    def __iter__(self):
+        return iter(self._classes)
+
+    def __repr__(self):
+        return f"MappedLexicon({ {c: len(w) for c, w in self._classes.items()} !r})"
+
+    def get(self, word_class: str, default=None):
+        return self._classes.get(word_class, default)
+
+    def keys(self):
+        return self._classes.keys()
+
+    def items(self):
+        return self._classes.items()
+
+    def values(self):
+        return self._classes.values()
+
+    def class_of(self, word: str) -> Optional[str]:
+        """查詢詞語的詞類（每個詞類各做一次二分搜尋）"""
+        for word_class, words in self._classes.items():
+            if word in words:
+                return word_class
+        return None
+
+    def sample(self, word_class: str, rng=None) -> str:
+        return (rng or random).choice(self._classes[word_class])
+
+    def set_stats(self, stats: Optional[LexiconStats]):
+        """設定詞彙統計；唯讀詞彙不會再變動，第一次讀取 stats 時才整批統計（載入快照不必先解碼所有詞）"""
+        self._stats = stats
+        self._tallied = False
+
+    @property
+    def stats(self) -> Optional[LexiconStats]:
+        if self._stats is not None and not self._tallied:
+            for word_class, words in self._classes.items():
+                self._stats.tally(words, word_class)
+            self._tallied = True
+        return self._stats
+
+    def materialize(self) -> Lexicon:
+        """把所有詞語解碼成可修改的 Lexicon"""
+        lexicon = Lexicon()
+        for word_class, words in self._classes.items():
+            lexicon[word_class].extend(words)
+        return lexicon
+
+
+class SentenceEngine:
+    """
+    大量生成句子的引擎
+    事先把語序、定冠詞、否定前後綴與疑問標記編成句型與查表：
+    - 每個名詞 x 每個定冠詞的形式預先算好，抽一次就得到帶冠詞的名詞
+    - 每個動詞的否定形式預先算好
+    之後每一句只剩一次字串格式化；跨詞音變（含 l' 省略）最後對整批句子只跑一次，
+    適合一次產生上百萬組（陳述句, 否定句, 疑問句）
+    """
+
+    def __init__(self, syntax: SyntaxSystem, morphology: MorphologySystem, vowels: Set[str],
+                 nouns: Iterable[str], verbs: Iterable[str], sandhi: SandhiEngine = None):
+        nouns = list(nouns)
+        verbs = list(verbs)
+        if not nouns or not verbs:
+            raise ValueError("需要至少一個名詞和一個動詞")
+
+        self.question_suffix = " " + syntax.question_marker
+
+        self.sandhi = sandhi if sandhi is not None else SandhiEngine(DEFAULT_SANDHI_RULES, vowels)
+        articles = morphology.compiled.rules_named("definite_article")
+        if articles:
+            self.noun_forms = tuple(f"{SandhiEngine.mark(rule.marker.strip())} {noun}"
+                                    for noun in nouns for rule in articles)
+        else:
+            self.noun_forms = tuple(nouns)
+        # 只有一個名詞時不放賓語（與 sentence_variants 相同），句型也拿掉賓語的位置
+        self.has_object = len(nouns) > 1
+        template = syntax.sentence_format
+        if not self.has_object:
+            template = " ".join(template.replace("{2}", "").split())
+        self.format = template.format
+
+        neg_rule = next(iter(morphology.compiled.rules_named("negative")), None)
+        neg_prefix, neg_suffix = neg_rule.marker if neg_rule else ("", "")
+        self.verb_forms = tuple((verb, f"{neg_prefix}{verb}{neg_suffix}".strip()) for verb in verbs)
+
+    @classmethod
+    def from_game(cls, game: 'LanguageCreatorGame') -> 'SentenceEngine':
+        return cls(game.syntax, game.morphology, game.phonology.vowels,
+                   game.vocabulary['noun'], game.vocabulary['verb'], game.phonology.sandhi)
+
+    def generate(self, n: int, rng=None, columnar: bool = False):
+        """
+        產生 n 組（陳述句, 否定句, 疑問句）
+        columnar=True 時回傳三個平行的列表 (陳述句們, 否定句們, 疑問句們)
+        """
+        rng = rng or random
+        fmt = self.format
+        subjects = rng.choices(self.noun_forms, k=n)
+        verbs = rng.choices(self.verb_forms, k=n)
+        objects = rng.choices(self.noun_forms, k=n) if self.has_object else [""] * n
+
+        declaratives = self.sandhi.apply_many([fmt(s, v[0], o) for s, v, o in zip(subjects, verbs, objects)])
+        negatives = self.sandhi.apply_many([fmt(s, v[1], o) for s, v, o in zip(subjects, verbs, objects)])
+        questions = [d + self.question_suffix for d in declaratives]
+        if columnar:
+            return declaratives, negatives, questions
+        return list(zip(declaratives, negatives, questions))
+
+    def iter_batches(self, n: int, rng=None, batch_size: int = 100_000, columnar: bool = False):
+        """分批產生，每批最多 batch_size 組"""
+        for size in _batch_sizes(n, batch_size):
+            yield self.generate(size, rng, columnar)
+
+
+class GrammarEngine:
+    """
+    編譯好的句子文法（見 SyntaxSystem.build_grammar）
+    - 每個符號的推導數（子樹數）只算一次：詞類是該詞類的詞數、引號字是 1、非終端符號是各選項內乘積的總和
+    - mode='uniform' 依推導數抽選項，每一種句子機率相同；mode='weighted' 依規則的權重抽
+    - 每個非終端符號的選項編成累積權重表，逐層展開時每層只需一次二分搜尋，時間與句子長度成正比
+    - 展開後的句型不多時（≤ MAX_TEMPLATES）再攤平成「句型 + 詞類槽位」表，
+      抽一句只要選一次句型再填詞，和 SentenceEngine 一樣快
+    跨詞音變（含 l' 省略）最後對整批句子只跑一次；文法或詞彙變動後請重新建立
+    """
+    MAX_TEMPLATES = 10_000
+
+    def __init__(self, grammar: Grammar, vocabulary, morphology: MorphologySystem, sandhi: SandhiEngine,
+                 mode: str = 'weighted'):
+        if mode not in ('uniform', 'weighted'):
+            raise ValueError(f"不支援的抽樣方式：{mode}")
+        self.grammar = grammar
+        self.mode = mode
+        self.sandhi = sandhi
+        self._lexical: Dict[tuple, Tuple[object, str, str]] = {}
+        for alternatives in grammar.productions.values():
+            for symbols, _ in alternatives:
+                for symbol in symbols:
+                    if symbol[0] == 'lex' and symbol not in self._lexical:
+                        _, word_class, inflect = symbol
+                        words = vocabulary.get(word_class) or ()
+                        prefix, suffix = morphology.compiled.class_affixes(word_class) if inflect else ("", "")
+                        self._lexical[symbol] = (words, prefix, suffix)
+
+        self.counts: Dict[str, int] = {}
+        self._visiting: Set[str] = set()
+        if not self.count():
+            raise ValueError("文法無法產生任何句子（需要的詞類沒有詞，或缺少規則）")
+
+        # {非終端符號: (選項們, 累積權重, 總權重)}，推導數為 0 的選項不會被抽到
+        self._tables: Dict[str, tuple] = {}
+        for head, alternatives in grammar.productions.items():
+            if head not in self.counts:
+                continue  # 從起始符號走不到
+            options, weights = [], []
+            for symbols, weight in alternatives:
+                count = self._symbols_count(symbols)
+                if count and (mode == 'uniform' or weight > 0):
+                    options.append(symbols)
+                    weights.append(count if mode == 'uniform' else weight)
+            cumulative = list(itertools.accumulate(weights))
+            self._tables[head] = (tuple(options), cumulative, cumulative[-1] if cumulative else 0)
+
+        self._templates = self._compile_templates()
+
+    @classmethod
+    def from_game(cls, game: 'LanguageCreatorGame', mode: str = 'weighted') -> 'GrammarEngine':
+        return cls(game.syntax.build_grammar(game.morphology), game.vocabulary, game.morphology,
+                   game.phonology.sandhi, mode)
+
+    # ---- 推導數 ----
+
+    def _symbol_count(self, symbol: tuple) -> int:
+        kind = symbol[0]
+        if kind == 'lit':
+            return 1
+        if kind == 'lex':
+            return len(self._lexical[symbol][0])
+        return self.count(symbol[1])
+
+    def _symbols_count(self, symbols: tuple) -> int:
+        count = 1
+        for symbol in symbols:
+            count *= self._symbol_count(symbol)
+            if not count:
+                break
+        return count
+
+    def count(self, symbol: str = None) -> int:
+        """某個非終端符號（預設為起始符號）能推導出幾種不同的句子"""
+        symbol = symbol or self.grammar.start
+        count = self.counts.get(symbol)
+        if count is None:
+            alternatives = self.grammar.productions.get(symbol)
+            if not alternatives:
+                raise ValueError(f"文法缺少 {symbol} 的規則")
+            if symbol in self._visiting:
+                raise ValueError(f"文法不能遞迴：{symbol}")
+            self._visiting.add(symbol)
+            count = sum(self._symbols_count(symbols) for symbols, _ in alternatives)
+            self._visiting.discard(symbol)
+            self.counts[symbol] = count
+        return count
+
+    # ---- 句型表 ----
+
+    def _compile_templates(self) -> Optional[tuple]:
+        """把文法攤平成 (句型們, 累積權重, 總權重)；句型太多時回傳 None（改為逐層展開）"""
+        flat: Dict[str, list] = {}
+
+        def expand(head: str) -> list:
+            # [(符號串, 推導數, 機率)]，符號串只剩 lit 與 lex
+            if head in flat:
+                return flat[head]
+            options, cumulative, total = self._tables[head]
+            result = []
+            previous = 0
+            for symbols, bound in zip(options, cumulative):
+                share = (bound - previous) / total
+                previous = bound
+                partial = [((), 1, share)]
+                for symbol in symbols:
+                    if symbol[0] == 'nt':
+                        below = expand(symbol[1])
+                    else:
+                        below = [((symbol,), self._symbol_count(symbol), 1.0)]
+                    partial = [(a + b, ca * cb, pa * pb) for a, ca, pa in partial for b, cb, pb in below]
+                    if len(partial) > self.MAX_TEMPLATES:
+                        raise OverflowError
+                result.extend(partial)
+                if len(result) > self.MAX_TEMPLATES:
+                    raise OverflowError
+            flat[head] = result
+            return result
+
+        try:
+            expanded = expand(self.grammar.start)
+        except OverflowError:
+            return None
+
+        templates, weights = [], []
+        for symbols, count, probability in expanded:
+            parts, slots = [], []
+            for symbol in symbols:
+                if symbol[0] == 'lit':
+                    if symbol[1]:
+                        parts.append(SandhiEngine.mark(symbol[1].replace('{', '{{').replace('}', '}}')))
+                else:
+                    parts.append('{}')
+                    slots.append(self._lexical[symbol])
+            templates.append((' '.join(parts), tuple(slots)))
+            weights.append(count if self.mode == 'uniform' else probability)
+        cumulative = list(itertools.accumulate(weights))
+        return tuple(templates), cumulative, cumulative[-1]
+
+    @property
+    def template_count(self) -> int:
+        """攤平後的句型數（沒有攤平時為 0）"""
+        return len(self._templates[0]) if self._templates else 0
+
+    # ---- 生成 ----
+
+    def _pick(self, cumulative: list, total, rng) -> int:
+        if self.mode == 'uniform':
+            return bisect_right(cumulative, rng.randrange(total))
+        return min(bisect_right(cumulative, rng.random() * total), len(cumulative) - 1)
+
+    def expand(self, rng=None) -> str:
+        """從起始符號逐層展開一句（還沒套用跨詞音變）"""
+        rng = rng or random
+        tables = self._tables
+        lexical = self._lexical
+        out = []
+        stack = [('nt', self.grammar.start)]
+        while stack:
+            symbol = stack.pop()
+            kind = symbol[0]
+            if kind == 'lit':
+                if symbol[1]:
+                    out.append(SandhiEngine.mark(symbol[1]))
+            elif kind == 'lex':
+                words, prefix, suffix = lexical[symbol]
+                out.append(prefix + rng.choice(words) + suffix)
+            else:
+                options, cumulative, total = tables[symbol[1]]
+                stack.extend(reversed(options[self._pick(cumulative, total, rng)]))
+        return ' '.join(out)
+
+    def generate(self, n: int, rng=None) -> List[str]:
+        """產生 n 個句子"""
+        rng = rng or random
+        if self._templates is None:
+            raw = [self.expand(rng) for _ in range(n)]
+        else:
+            templates, cumulative, total = self._templates
+            if self.mode == 'uniform':
+                picks = [templates[bisect_right(cumulative, rng.randrange(total))] for _ in range(n)]
+            else:
+                picks = rng.choices(templates, cum_weights=cumulative, k=n)
+            choice = rng.choice
+            raw = [fmt.format(*[prefix + choice(words) + suffix for words, prefix, suffix in slots])
+                   for fmt, slots in picks]
+        return self.sandhi.apply_many(raw)
+
+    def iter_batches(self, n: int, rng=None, batch_size: int = 100_000):
+        """分批產生，每批最多 batch_size 句"""
+        for size in _batch_sizes(n, batch_size):
+            yield self.generate(size, rng)
+
+
+def iter_words(phonology: PhonologySystem, n: int = None, syllable_count: int = None,
+               rng=None, batch_size: int = 1_000) -> Iterator[str]:
+    """逐一產生詞語（n 為 None 時無限產生），每次只在記憶體中保留一小批"""
+    produced = 0
+    while n is None or produced < n:
+        size = batch_size if n is None else min(batch_size, n - produced)
+        yield from phonology.generate_words(size, syllable_count, rng)
+        produced += size
+
+
+def iter_sentences(game: 'LanguageCreatorGame', n: int = None, rng=None,
+                   batch_size: int = 1_000) -> Iterator[Dict[str, str]]:
+    """
+    逐一產生句子紀錄 {sentence, negative, question}（n 為 None 時無限產生），欄位與 sentence_variants 相同
+    用 SentenceEngine 分批生成，定冠詞與跨詞音變（含 l' 省略）都已套用，每次只在記憶體中保留一小批
+    """
+    engine = SentenceEngine.from_game(game)
+    sizes = _batch_sizes(n, batch_size) if n is not None else itertools.repeat(batch_size)
+    for size in sizes:
+        for sentence, negative, question in engine.generate(size, rng):
+            yield {'sentence': sentence, 'negative': negative, 'question': question}
+
+
+def export_stream(records: Iterable, path: str, fmt: str = None, buffer_size: int = 10_000,
+                  compress: bool = None) -> int:
+    """
+    把詞語或句子紀錄分批寫入 jsonl / csv / txt 檔案，回傳寫入筆數
+    每累積 buffer_size 筆就寫出一次，記憶體用量不隨輸出大小增加
+    fmt 與 compress 沒指定時依副檔名判斷（例如 words.jsonl.gz）
+    """
+    name = path[:-3] if path.endswith('.gz') else path
+    if compress is None:
+        compress = path.endswith('.gz')
+    if fmt is None:
+        fmt = os.path.splitext(name)[1].lstrip('.') or 'txt'
+    if fmt not in ('jsonl', 'csv', 'txt'):
+        raise ValueError(f"不支援的輸出格式：{fmt}")
+
+    records = iter(records)
+    opener = gzip.open if compress else open
+    count = 0
+    with opener(path, 'wt', encoding='utf-8', newline='') as f:
+        header = None
+        for chunk in iter(lambda: list(itertools.islice(records, buffer_size)), []):
+            if fmt == 'jsonl':
+                f.write(''.join(json.dumps(r, ensure_ascii=False) + '\n' for r in chunk))
+            elif fmt == 'txt':
+                f.write(''.join((r['sentence'] if isinstance(r, dict) else r) + '\n' for r in chunk))
+            else:
+                buf = io.StringIO()
+                writer = csv.writer(buf)
+                if header is None:
+                    header = list(chunk[0]) if isinstance(chunk[0], dict) else ['word']
+                    writer.writerow(header)
+                for r in chunk:
+                    writer.writerow([r.get(k, '') for k in header] if isinstance(r, dict) else [r])
+                f.write(buf.getvalue())
+            count += len(chunk)
+    return count
+
+
+# 來源語言（法文、英文）的功能詞
+_DEFINITE_ARTICLES = {'le': False, 'la': False, 'les': True, 'the': False}  # 冠詞: 是否複數
+_INDEFINITE_ARTICLES = {'un': False, 'une': False, 'des': True, 'a': False, 'an': False}
+_NEGATION_WORDS = frozenset({'ne', 'pas', 'not'})
+# 省略的法文接語還原成完整的詞：j'aime 與 je aime 譯成一樣的句子
+_FRENCH_CLITICS = {"l'": 'le', "n'": 'ne', "d'": 'de', "j'": 'je', "c'": 'ce', "s'": 'se', "m'": 'me', "t'": 'te',
+                   "qu'": 'que'}
+# 不能直接去掉 n't 的英文否定縮寫
+_IRREGULAR_NEGATIONS = {"can't": 'can', "cannot": 'can', "won't": 'will', "shan't": 'shall'}
+_DO_AUXILIARIES = frozenset({'do', 'does', 'did'})
+_SOURCE_TOKEN_RE = re.compile(r"[^\W\d_]+(?:'[^\W\d_]+)*'?|[.!?]")
+
+
+@dataclass
+class _SourceWord:
+    """句子中的一個實詞（已拿掉冠詞、複數與否定）"""
+    lemma: str
+    article: Optional[str] = None  # 來源語言的定冠詞
+    plural: bool = False
+
+
+class HashTranslator:
+    """
+    把法文或英文文字「翻譯」成造出來的語言
+    - 每個來源詞的譯詞由 derive_seed(seed, 詞) 當種子用 generate_word 造出，不需要中央字典，
+      同一個種子與音韻系統在任何機器上都會得到相同的譯詞（不同來源詞偶爾可能撞到同一個譯詞）
+    - 譯詞快取在字典裡（查詢 O(1)），有給 dictionary_path 時新詞會附加寫入 TSV 檔，下次直接載入
+    - 定冠詞與跨詞音變（含 l' 省略）用 phonology.sandhi、複數與否定用 MorphologySystem 的規則，
+      再依 SyntaxSystem 的語序把 主語/動詞/賓語 重新排列；疑問句加上疑問標記
+    來源句子假設為 SVO：第一個實詞（連同冠詞）是主語、之後第一個不帶冠詞的實詞是動詞、其餘是賓語
+    """
+
+    def __init__(self, game: 'LanguageCreatorGame', seed: int = 0, dictionary_path: str = None):
+        self.phonology = game.phonology
+        self.morphology = game.morphology
+        self.syntax = game.syntax
+        self.seed = seed
+        self.dictionary_path = dictionary_path
+        self.dictionary: Dict[str, str] = {}
+        self._pending: List[Tuple[str, str]] = []
+        self._articles = tuple(rule.marker.strip() for rule in self.morphology.compiled.rules_named("definite_article"))
+        self._has_plural = bool(self.morphology.compiled.rules_named("plural"))
+        if dictionary_path and os.path.exists(dictionary_path):
+            with open(dictionary_path, encoding='utf-8') as f:
+                for line in f:
+                    source, _, word = line.rstrip('\n').partition('\t')
+                    if word:
+                        self.dictionary[source] = word
+
+    def lookup(self, token: str) -> str:
+        """來源詞 → 譯詞（第一次遇到時才造詞）"""
+        word = self.dictionary.get(token)
+        if word is None:
+            word = self.phonology.generate_word(rng=random.Random(derive_seed(self.seed, token)))
+            self.dictionary[token] = word
+            self._pending.append((token, word))
+        return word
+
+    def flush(self):
+        """把新增的譯詞附加寫入字典檔"""
+        if self.dictionary_path and self._pending:
+            with open(self.dictionary_path, 'a', encoding='utf-8') as f:
+                f.write(''.join(f"{source}\t{word}\n" for source, word in self._pending))
+        self._pending.clear()
+
+    def _article_marker(self, source_article: str, plural: bool, lemma: str) -> str:
+        """選一個造出語言的定冠詞：同名的優先，否則由詞語雜湊固定選一個"""
+        articles = self._articles
+        if source_article in articles:
+            return source_article
+        if plural and 'les' in articles:
+            return 'les'
+        if not plural:
+            articles = tuple(a for a in articles if a != 'les') or articles
+        return articles[derive_seed(self.seed, lemma) % len(articles)]
+
+    def _parse(self, tokens: List[str]) -> Tuple[List[_SourceWord], bool]:
+        """拿掉功能詞，回傳 (實詞列表, 是否為否定句)"""
+        words: List[_SourceWord] = []
+        negative = False
+        article = None
+        plural = False
+        for index, token in enumerate(tokens):
+            if token in _DO_AUXILIARIES and tokens[index + 1:index + 2] == ['not']:
+                continue  # do not → not；do/does/did 只是助動詞，直接拿掉
+            if "'" in token and not token.endswith("'"):
+                clitic, _, rest = token.partition("'")
+                if clitic + "'" in _FRENCH_CLITICS:  # l'amour → le + amour、j'aime → je + aime
+                    for part in (_FRENCH_CLITICS[clitic + "'"], rest):
+                        article, plural, negative = self._absorb(words, self._parse_one(part), article, plural, negative)
+                    continue
+            if token in _IRREGULAR_NEGATIONS:  # can't → can、won't → will
+                token = _IRREGULAR_NEGATIONS[token]
+                negative = True
+            elif token.endswith("n't"):  # don't → not，與 do not 一樣拿掉助動詞
+                token = token[:-3]
+                negative = True
+                if token in _DO_AUXILIARIES:
+                    continue
+            token = _FRENCH_CLITICS.get(token, token)  # 沒連著後一個詞的 l'、j'
+            article, plural, negative = self._absorb(words, self._parse_one(token), article, plural, negative)
+        return words, negative
+
+    @staticmethod
+    def _parse_one(token: str) -> Tuple[str, str]:
+        """功能詞的種類：('neg'|'def'|'indef'|'word', 詞)"""
+        if token in _NEGATION_WORDS:
+            return 'neg', token
+        if token in _DEFINITE_ARTICLES:
+            return 'def', token
+        if token in _INDEFINITE_ARTICLES:
+            return 'indef', token
+        return 'word', token
+
+    @staticmethod
+    def _absorb(words: List[_SourceWord], item: Tuple[str, str], article, plural, negative):
+        kind, token = item
+        if kind == 'neg':
+            return article, plural, True
+        if kind == 'def':
+            return token, _DEFINITE_ARTICLES[token], negative
+        if kind == 'indef':
+            return None, _INDEFINITE_ARTICLES[token], negative
+        lemma = token
+        if plural or (article == 'the' and len(token) > 3 and token.endswith('s') and not token.endswith('ss')):
+            plural = True
+            if len(token) > 3 and token[-1] in 'sx':
+                lemma = token[:-1]
+        words.append(_SourceWord(lemma, article, plural))
+        return None, False, negative
+
+    def _noun_phrase(self, word: _SourceWord) -> str:
+        form = self.lookup(word.lemma)
+        if word.plural and self._has_plural:
+            form = self.morphology.apply_morphology(form, "plural")
+        if word.article and self._articles:
+            marker = self._article_marker(word.article, word.plural, word.lemma)
+            form = f"{SandhiEngine.mark(marker)} {form}"
+        return form
+
+    def translate_clause(self, tokens: List[str], question: bool = False) -> str:
+        """翻譯一個句子（已斷詞、小寫、不含標點）"""
+        words, negative = self._parse(tokens)
+        if not words:
+            return ""
+        subject = words[0]
+        rest = words[1:]
+        verb_index = next((i for i, w in enumerate(rest) if w.article is None), 0 if rest else None)
+
+        if verb_index is None:
+            verb = ""
+            objects = []
+        else:
+            verb = self.lookup(rest[verb_index].lemma)
+            if negative:
+                verb = self.morphology.apply_rules(verb, "verb").strip()
+            objects = rest[:verb_index] + rest[verb_index + 1:]
+        obj = " ".join(self._noun_phrase(w) for w in objects)
+        sentence = self.syntax.generate_sentence(self._noun_phrase(subject), verb, obj)
+        sentence = self.phonology.sandhi.apply(" ".join(sentence.split()))
+        if question:
+            sentence += " " + self.syntax.question_marker
+        return sentence
+
+    def translate_line(self, line: str) -> str:
+        """翻譯一行文字（以 . ! ? 切句）"""
+        sentences = []
+        clause: List[str] = []
+        for token in _SOURCE_TOKEN_RE.findall(line.lower().replace('\u2019', "'")):
+            if token in '.!?':
+                if clause:
+                    sentences.append(self.translate_clause(clause, token == '?'))
+                clause = []
+            else:
+                clause.append(token)
+        if clause:
+            sentences.append(self.translate_clause(clause))
+        return " ".join(s for s in sentences if s)
+
+    def translate_stream(self, lines: Iterable[str], flush_every: int = 10_000) -> Iterator[str]:
+        """逐行翻譯，每 flush_every 行把新的譯詞寫入字典檔"""
+        for count, line in enumerate(lines, 1):
+            yield self.translate_line(line)
+            if count % flush_every == 0:
+                self.flush()
+        self.flush()
+
+    def translate_file(self, source_path: str, target_path: str, buffer_size: int = 10_000) -> int:
+        """逐行翻譯一個文字檔（可以是 .gz），回傳行數；記憶體用量只和字典大小有關"""
+        opener = gzip.open if source_path.endswith('.gz') else open
+        with opener(source_path, 'rt', encoding='utf-8') as f:
+            return export_stream(self.translate_stream(f), target_path, 'txt', buffer_size)
+
+
 @dataclass
-class PhonologySystem:
-    """音韻系統"""
-    consonants: Set[str] = field(default_factory=lambda: {'b','c','d','f','g','h','l','m','n','p','q','r','s','t','v','x','z'})
-    vowels: Set[str] = field(default_factory=lambda: {'a', 'e', 'i', 'o', 'u', 'à','é','ê'})
-    syllable_patterns: List[str] = field(default_factory=lambda: ['CV','CV','VC','CVC','CVC','CCV','CVV','V'])
-    phonotactic_rules: List[str] = field(default_factory=list)
-    coda_restrictions: Set[str] = field(default_factory=set)  # 存放不允許在音節尾的子音
-    onset_cluster_restrictions:  List[str] = field(default_factory=list)
-    vowel_clusters: Set[str] = field(default_factory=set)
+class NounPhrase:
+    """分析出來的名詞片語"""
+    noun: str
+    article: str = ""  # 表層形式，例如 le、les、l'
+    plural: bool = False
+    adjectives: Tuple[str, ...] = ()
 
+    def to_dict(self) -> Dict[str, object]:
+        return {'noun': self.noun, 'article': self.article, 'plural': self.plural,
+                'adjectives': list(self.adjectives)}
 
-    
-    def generate_word(self, syllable_count: int = None) -> str:
-        if syllable_count is None:
-            syllable_count = random.randint(1, 3)
 
-        accented_vowels = {'à','è','ù','é','ê'}
-        used_accented = False  # 整個詞中是否已出現變音母音
+@dataclass
+class SentenceAnalysis:
+    """一個句子的分析結果（error 為空字串表示分析成功）"""
+    sentence: str
+    subject: Optional[NounPhrase] = None
+    verb: str = ""
+    object: Optional[NounPhrase] = None
+    negative: bool = False
+    question: bool = False
+    unknown: Tuple[str, ...] = ()  # 詞彙中查不到的詞
+    error: str = ""
 
-        word = ""
-        for _ in range(syllable_count):
-            pattern = random.choice(self.syllable_patterns)
-            syllable = ""
-            last_vowel = None
-            i = 0
+    @property
+    def ok(self) -> bool:
+        return not self.error
 
-            while i < len(pattern):
-                char = pattern[i]
-                is_last_char = (i == len(pattern) - 1)
+    def to_dict(self) -> Dict[str, object]:
+        """可以存成 JSON 的 dict（標註檔的一筆紀錄）"""
+        return {
+            'sentence': self.sentence,
+            'subject': self.subject.to_dict() if self.subject else None,
+            'verb': self.verb,
+            'object': self.object.to_dict() if self.object else None,
+            'negative': self.negative,
+            'question': self.question,
+            'unknown': list(self.unknown),
+            'error': self.error,
+        }
 
-                if char == 'C':
-                    if i == 0 and len(pattern) > 1 and pattern[i+1] == 'C' and hasattr(self, 'onset_clusters') and self.onset_clusters:
-                        cluster = random.choice(list(self.onset_clusters))
-                        syllable += cluster
-                        i += len(cluster)
-                        continue
 
-                    if is_last_char and self.coda_restrictions:
-                        consonant = random.choice(list(self.coda_restrictions))
-                    else:
-                        consonant = random.choice(list(self.consonants))
-                    syllable += consonant
-                    i += 1
+class SentenceAnalyzer:
+    """
+    SyntaxSystem.generate_sentence 與 MorphologySystem.apply_rules 的反方向：把造出語言的句子拆回主語/動詞/賓語
+    - 拿掉疑問標記、定冠詞（含 l' 之類的省略形式）、否定前後綴與複數詞綴，連音或插入的子音也會還原
+    - 用詞彙的 詞語 → 詞類 索引認出實詞，再依 word_order 決定哪個名詞片語是主語、哪個是賓語
+    每個詞形的拆法只算一次（快取），批次分析時每句只剩一次切分與幾次查表；規則或詞彙變動後請重新建立
+    """
 
-                elif char == 'V':
-                    # 如果是連續 VV 結構，而且有 vowel_clusters
-                    if i < len(pattern) - 1 and pattern[i + 1] == 'V' and self.vowel_clusters:
-                        cluster = random.choice(list(self.vowel_clusters))
-
-                        # 避免含有多個變音母音
-                        if any(c in accented_vowels for c in cluster):
-                            if used_accented:
-                                # 避免使用含變音母音的 cluster
-                                possible_clusters = [vc for vc in self.vowel_clusters if not any(c in accented_vowels for c in vc)]
-                                if possible_clusters:
-                                    cluster = random.choice(possible_clusters)
-                                else:
-                                    # fallback: 選兩個不重複的普通母音
-                                    cluster = ''.join(random.sample(list(self.vowels - accented_vowels), 2))
-                            else:
-                                used_accented = True
-
-                        syllable += cluster
-                        i += 2  # 跳過 VV
-                    else:
-                        vowel = random.choice(list(self.vowels))
-                        while vowel == last_vowel or (vowel in accented_vowels and used_accented):
-                            vowel = random.choice(list(self.vowels))
+    def __init__(self, game: 'LanguageCreatorGame'):
+        self.syntax = game.syntax
+        self.morphology = game.morphology
+        self.phonology = game.phonology
+        self.class_of = game.vocabulary.class_of
+        self.question_marker = game.syntax.question_marker
+        compiled = game.morphology.compiled
 
-                        if vowel in accented_vowels:
-                            used_accented = True
+        self.articles = frozenset(rule.marker.strip() for rule in compiled.rules_named("definite_article"))
+        neg_rule = next(iter(compiled.rules_named("negative")), None)
+        self.neg_prefix, self.neg_suffix = neg_rule.marker if neg_rule else ("", "")
+        # 否定前後綴有空白時是獨立的詞，沒有空白時直接黏在動詞上
+        self._neg_words = {}
+        self._neg_affixes = ("", "")
+        if neg_rule:
+            prefix, suffix = self.neg_prefix, self.neg_suffix
+            if prefix.strip():
+                if prefix.endswith(' '):
+                    self._neg_words[prefix.strip()] = 'neg_prefix'
+                else:
+                    self._neg_affixes = (prefix, self._neg_affixes[1])
+            if suffix.strip():
+                if suffix.startswith(' '):
+                    self._neg_words[suffix.strip()] = 'neg_suffix'
+                else:
+                    self._neg_affixes = (self._neg_affixes[0], suffix)
 
-                        syllable += vowel
-                        last_vowel = vowel
-                        i += 1
+        plural_affixes = set()
+        op = compiled.rule_op("plural")
+        if op and op[0] == 'affix':
+            plural_affixes.add(op[1:])
+        plural_affixes.add(compiled.class_affixes("noun"))
+        plural_affixes.discard(("", ""))
+        self._plural_affixes = tuple(sorted(plural_affixes, key=lambda a: -len(a[0] + a[1])))
 
-            # 處理母音連續時插入子音
-            if word and word[-1] in self.vowels and syllable[0] in self.vowels:
-                possible_consonants = list(self.coda_restrictions) if self.coda_restrictions else list(self.consonants)
-                syllable = random.choice(possible_consonants) + syllable
+        # 跨詞音變：省略形式 → 原本的冠詞；連音、插音 → (觸發的左詞或 None, 加在右詞前面的子音)
+        self._elided: Dict[str, str] = {}
+        self._generic_elision = False
+        self._prefixing: List[Tuple[Optional[frozenset], str]] = []
+        for rule in game.phonology.sandhi_rules:
+            if rule.kind == 'elision':
+                if rule.left:
+                    self._elided.setdefault(rule.replacement, rule.left[0])
+                else:
+                    self._generic_elision = True
+            elif rule.replacement:
+                self._prefixing.append((frozenset(rule.left) or None, rule.replacement))
+        self._cache: Dict[str, Optional[tuple]] = {}
 
-            word += syllable
+    # ---- 詞形 ----
 
-        return word
+    def _word(self, token: str) -> Optional[tuple]:
+        """('word', 詞幹, 詞類, 省略的冠詞, 是否複數, 是否帶否定詞綴)，查不到則回傳 None"""
+        class_of = self.class_of
+        word_class = class_of(token)
+        if word_class is not None:
+            return ('word', token, word_class, "", False, False)
+        for prefix, suffix in self._plural_affixes:
+            if len(token) > len(prefix) + len(suffix) and token.startswith(prefix) and token.endswith(suffix):
+                stem = token[len(prefix):len(token) - len(suffix)]
+                word_class = class_of(stem)
+                if word_class is not None:
+                    return ('word', stem, word_class, "", True, False)
+        prefix, suffix = self._neg_affixes
+        if (prefix or suffix) and len(token) > len(prefix) + len(suffix) \
+                and token.startswith(prefix) and token.endswith(suffix):
+            stem = token[len(prefix):len(token) - len(suffix)]
+            word_class = class_of(stem)
+            if word_class is not None:
+                return ('word', stem, word_class, "", False, True)
+        return None
 
-        
+    def _plural_noun(self, token: str) -> Optional[tuple]:
+        """把詞形當成複數名詞的拆法（複數形剛好跟別的詞類同形時用）"""
+        for prefix, suffix in self._plural_affixes:
+            if len(token) > len(prefix) + len(suffix) and token.startswith(prefix) and token.endswith(suffix):
+                stem = token[len(prefix):len(token) - len(suffix)]
+                if self.class_of(stem) == 'noun':
+                    return ('word', stem, 'noun', "", True, False)
+        return None
 
+    def _lookup(self, token: str) -> Optional[tuple]:
+        # 功能詞也記下它當成詞彙中的詞時的拆法（造出來的詞可能剛好是 le、ne 之類）
+        if token in self.articles:
+            return ('article', token, self._word(token))
+        kind = self._neg_words.get(token)
+        if kind is not None:
+            return (kind, token, self._word(token))
+        word = self._word(token)
+        if word is not None:
+            return word
+        # 省略：l'ami → 冠詞 l' + ami
+        apostrophe = token.find("'")
+        if 0 < apostrophe < len(token) - 1:
+            head = token[:apostrophe + 1]
+            if head in self._elided or self._generic_elision:
+                word = self._word(token[apostrophe + 1:])
+                if word is not None:
+                    return word[:3] + (head,) + word[4:]
+        return None
 
-    def set_onset_clusters(self):
-        """
-        設定常見音節開頭叢集
-        使用者可以輸入多個子音叢集，例如 "tr", "pl", "st"
-        直接按 Enter 結束輸入
-        """
-        self.onset_clusters = set()  # 初始化
-        print("請輸入出現在音節頭的子音們（直接按 Enter 結束）")
-        
-        while True:
-            cluster = input("子音叢集: ").strip()
-            if cluster == '':
-                break
-            # 驗證輸入是否都在子音系統中
-            if all(c in self.consonants for c in cluster) and len(cluster) >= 2:
-                self.onset_clusters.add(cluster)
-                print(f"已添加叢集：{cluster}")
-            else:
-                print(f"{cluster} 不合法（需至少兩個合法子音）")
+    def classify(self, token: str, previous: str = None) -> Optional[tuple]:
+        """一個詞形的拆法（快取）；查不到時試著還原前一個詞觸發的連音或插音"""
+        cache = self._cache
+        if token in cache:
+            entry = cache[token]
+        else:
+            entry = cache[token] = self._lookup(token)
+        if entry is None and previous is not None:
+            for left, replacement in self._prefixing:
+                if token.startswith(replacement) and (left is None or previous in left):
+                    entry = self._word(token[len(replacement):])
+                    if entry is not None:
+                        break
+        return entry
 
-    
-    def set_coda_restrictions(self):
-        """設定允許出現在音節尾的子音（直接按 Enter 結束）"""
-        self.coda_restrictions.clear()  # 先清空原本的限制
-        print("請輸入出現在音節尾的子音（直接按 Enter 結束）")
-        while True:
-            c = input("子音: ").strip()
-            if c == '':  # 空白鍵結束
-                break
-            if c in self.consonants:
-                self.coda_restrictions.add(c)
-                print(f"已添加可出現在音節尾的子音：{c}")
-            else:
-                print(f"{c} 不在子音系統中")
+    # ---- 句子 ----
 
-        if not self.coda_restrictions:
-            # 如果沒有輸入任何音節尾子音，預設全部子音都可
-            self.coda_restrictions = self.consonants.copy()
-            print("未設定任何音節尾子音，預設所有子音都可出現在音節尾。")
+    def analyze(self, sentence: str) -> SentenceAnalysis:
+        """分析一個句子"""
+        tokens = sentence.split()
+        marker = self.question_marker
+        question = False
+        if tokens and marker:
+            if tokens[-1] == marker:
+                tokens.pop()
+                question = True
+            elif tokens[-1].endswith(marker):
+                tokens[-1] = tokens[-1][:-len(marker)]
+                question = True
 
-    def set_vowel_clusters(self):
+        entries = []
+        previous = None
+        for token in tokens:
+            entries.append(self.classify(token, previous))
+            previous = token
+
+        analysis, clean = self._parse(sentence, question, tokens, entries)
+        if analysis.ok and clean:
+            return analysis
+        # 同形的功能詞猜錯時，把每種讀法都試一次，取第一個分析成功而且乾淨的讀法
+        ambiguous = [i for i, e in enumerate(entries) if e is not None and e[0] != 'word' and e[2] is not None]
+        if 0 < len(ambiguous) <= self.MAX_AMBIGUOUS:
+            fallback = None
+            for readings in itertools.product((False, True), repeat=len(ambiguous)):
+                candidate, clean = self._parse(sentence, question, tokens, entries, dict(zip(ambiguous, readings)))
+                if candidate.ok:
+                    if clean:
+                        return candidate
+                    fallback = fallback or candidate
+            if fallback is not None and not analysis.ok:
+                return fallback
+        return analysis
+
+    # 同形功能詞最多幾個時才逐一嘗試所有讀法
+    MAX_AMBIGUOUS = 6
+
+    def _parse(self, sentence: str, question: bool, tokens: List[str], entries: List[Optional[tuple]],
+               readings: Dict[int, bool] = None) -> Tuple[SentenceAnalysis, bool]:
         """
-        設定常見母音叢集（例如 ai, ou, eau）
-        使用者可以輸入多個母音叢集，例如 "ai", "ou", "ie"
-        直接按 Enter 結束輸入
+        依各詞的拆法組出名詞片語與動詞，再分配語法角色
+        readings 指定同形功能詞是否當成詞彙中的詞（沒指定的用 _word_reading 猜）；
+        另外回傳這個讀法是否乾淨（否定前後綴成對、沒有冠詞或形容詞接在動詞前面）
         """
-        self.vowel_clusters = set()  # 初始化
-        print("請輸入出現在詞中常見的母音叢集（直接按 Enter 結束）")
-        
-        while True:
-            cluster = input("母音叢集: ").strip()
-            if cluster == '':
-                break
-            # 驗證輸入是否都是合法母音，且長度 >= 2
-            if all(c in self.vowels for c in cluster) and len(cluster) >= 2:
-                self.vowel_clusters.add(cluster)
-                print(f"✅ 已添加母音叢集：{cluster}")
-            else:
-                print(f"❌ {cluster} 不合法（需至少兩個合法母音）")
+        result = SentenceAnalysis(sentence, question=question)
+        units = []  # (種類, 值)：('NP', NounPhrase)、('V', 動詞)、('?', NounPhrase)（詞類不明）
+        unknown = []
+        article = ""
+        adjectives = []
+        in_negation = False
+        negation_start = prefixes = suffixes = dropped = 0
+        for i, entry in enumerate(entries):
+            if entry is not None and entry[0] != 'word' and entry[2] is not None:
+                if readings is not None and i in readings:
+                    use_word = readings[i]
+                else:
+                    use_word = self._word_reading(entries, i, article, in_negation, negation_start == len(units))
+                if use_word:
+                    entry = entry[2]
+            if entry is None:
+                unknown.append(tokens[i])
+                entry = ('word', tokens[i], None, "", False, False)
+            kind = entry[0]
+            if kind == 'article':
+                article = entry[1]
+                continue
+            if kind == 'neg_prefix':
+                result.negative = in_negation = True
+                negation_start = len(units)
+                prefixes += 1
+                continue
+            if kind == 'neg_suffix':
+                result.negative = True
+                in_negation = False
+                suffixes += 1
+                continue
 
+            if article and entry[2] not in ('noun', None) and not entry[3] and not entry[5]:
+                entry = self._plural_noun(tokens[i]) or entry  # 冠詞後面優先當成名詞
+            _, lemma, word_class, elided, plural, negated = entry
+            if elided:
+                article = elided
+            if word_class == 'adjective' and not negated:
+                if not article and not adjectives and units and units[-1][0] == 'NP':
+                    units[-1][1].adjectives += (lemma,)
+                else:
+                    adjectives.append(lemma)
+                continue
+            if word_class == 'verb' or negated or in_negation:
+                result.negative = result.negative or negated
+                dropped += bool(article or adjectives)
+                units.append(('V', lemma))
+            elif word_class == 'noun' or article or adjectives:
+                units.append(('NP', NounPhrase(lemma, article, plural, tuple(adjectives))))
+            else:
+                units.append(('?', NounPhrase(lemma, article, plural)))
+            article = ""
+            adjectives = []
+        if adjectives:
+            if units and units[-1][0] == 'NP':
+                units[-1][1].adjectives += tuple(adjectives)
+            else:
+                unknown.extend(adjectives)
+        result.unknown = tuple(unknown)
+        self._assign_roles(result, units)
+        has_prefix = 'neg_prefix' in self._neg_words.values()
+        has_suffix = 'neg_suffix' in self._neg_words.values()
+        clean = (not (has_prefix and has_suffix) or prefixes == suffixes) and not dropped
+        return result, clean
 
+    def _word_reading(self, entries: List[Optional[tuple]], i: int, article: str, in_negation: bool,
+                      negation_empty: bool) -> bool:
+        """同形的功能詞（冠詞、否定詞）在這個位置是否該當成詞彙中的詞"""
+        if article:
+            return True  # 冠詞後面接的一定是詞
+        kind = entries[i][0]
+        if i + 1 >= len(entries):
+            return kind != 'neg_suffix' or not in_negation or negation_empty
+        following = entries[i + 1]
+        if kind == 'article':
+            # 後面要接一個還沒有冠詞的實詞（或查不到的詞），冠詞才成立
+            if following is None:
+                return False
+            if following[0] == 'word':
+                return bool(following[3])
+            return following[2] is None
+        if kind == 'neg_prefix':
+            # 有否定後綴的語言，後面要真的出現後綴，前綴才成立
+            if 'neg_suffix' in self._neg_words.values():
+                return not any(e is not None and e[0] == 'neg_suffix' for e in entries[i + 1:])
+            return False
+        # neg_suffix：前面沒有否定前綴，或前綴後面還沒有動詞時，它本身就是被否定的動詞
+        return not in_negation or negation_empty
 
-@dataclass
-class MorphologyRule:
-    """構詞規則"""
-    name: str
-    rule_type: str  # prefix, suffix, infix, reduplication
-    marker: str
-    meaning: str
-    position: str = ""
+    def _assign_roles(self, result: SentenceAnalysis, units: List[list]):
+        """依語序把名詞片語分成主語與賓語，並檢查動詞的位置"""
+        order = self.syntax.word_order
+        if order not in WORD_ORDER_FORMATS:
+            order = "SVO"
+        if not any(kind == 'V' for kind, _ in units):
+            # 沒有認出動詞：語序上動詞該在的位置（或第一個）詞類不明的詞當動詞
+            expected = order if len(units) >= 3 else order.replace('O', '')
+            position = expected.index('V') if len(units) == len(expected) else -1
+            guesses = [i for i, (kind, _) in enumerate(units) if kind == '?']
+            if guesses:
+                i = position if position in guesses else guesses[0]
+                units[i] = ('V', units[i][1].noun)
+        units = [('NP', value) if kind == '?' else (kind, value) for kind, value in units]
 
-@dataclass
-class MorphologySystem:
-    """構詞系統"""
-    rules: List[MorphologyRule] = field(default_factory=list)
-    word_classes: Dict[str, List[str]] = field(default_factory=lambda: {
-        'noun': [], 'verb': [], 'adjective': []#, 'adverb': []
-    })
+        verbs = [value for kind, value in units if kind == 'V']
+        phrases = [value for kind, value in units if kind == 'NP']
+        if len(verbs) != 1:
+            result.error = "找不到動詞" if not verbs else f"有 {len(verbs)} 個動詞"
+        if verbs:
+            result.verb = verbs[0]
+        if not phrases:
+            result.error = result.error or "找不到主語"
+            return
 
-    def add_rule(self, name: str, rule_type: str, marker: str, meaning: str):
-        """添加構詞規則"""
-        rule = MorphologyRule(name, rule_type, marker, meaning)
-        self.rules.append(rule)
-    
-    def apply_rules(self, word: str, word_class: str) -> str:
-        """依據詞類套用規則"""
-        for rule in self.rules:
-    
-            # 複數（只套用在名詞）
-            if rule.name == "plural" and word_class == "noun":
-                word = word + rule.marker
+        expected = order if len(phrases) >= 2 else order.replace('O', '')
+        roles = [role for role in expected if role != 'V']
+        for role, phrase in zip(roles, phrases):
+            if role == 'S':
+                result.subject = phrase
+            else:
+                result.object = phrase
+        if result.error:
+            return
+        if len(phrases) > 2:
+            result.error = f"有 {len(phrases)} 個名詞片語"
+        elif [kind for kind, _ in units] != ['V' if role == 'V' else 'NP' for role in expected]:
+            result.error = f"語序與 {order} 不符"
 
-            # 否定（只套用在動詞）
-            elif rule.name == "negative" and word_class == "verb":
-                prefix, suffix = rule.marker  # 例如 ("ne ", " pas")
-                word = prefix + word + suffix
+    def analyze_many(self, sentences: Iterable[str]) -> List[SentenceAnalysis]:
+        """一次分析一批句子"""
+        analyze = self.analyze
+        return [analyze(sentence) for sentence in sentences]
 
-        return word
+    def realize(self, analysis: SentenceAnalysis) -> str:
+        """用分析結果重新生成句子（與 sentence_variants 的規則相同），用來檢查來回轉換"""
+        def phrase(np: Optional[NounPhrase]) -> str:
+            if np is None:
+                return ""
+            form = self.morphology.apply_morphology(np.noun, "plural") if np.plural else np.noun
+            form = " ".join((form,) + np.adjectives)
+            if not np.article:
+                return form
+            article = self._elided.get(np.article, np.article)
+            return article + form if article.endswith("'") else f"{SandhiEngine.mark(article)} {form}"
 
-    def apply_morphology(self, base_word: str, rule_name: str) -> str:
-        """應用構詞規則"""
-        for rule in self.rules:
-            if rule.name == rule_name:
-                if rule.rule_type == 'prefix':
-                    return rule.marker + base_word
-                elif rule.rule_type == 'suffix':
-                    return base_word + rule.marker
-                elif rule.rule_type == 'reduplication':
-                    return base_word + base_word
-        return base_word
+        verb = analysis.verb
+        if analysis.negative:
+            verb = f"{self.neg_prefix}{verb}{self.neg_suffix}".strip()
+        sentence = self.syntax.generate_sentence(phrase(analysis.subject), verb, phrase(analysis.object))
+        sentence = self.phonology.sandhi.apply(" ".join(sentence.split()))
+        if analysis.question:
+            sentence += " " + self.question_marker
+        return sentence
 
-@dataclass
-class SyntaxRule:
-    """句法規則"""
-    name: str
-    pattern: str  # SVO, SOV, VSO etc.
-    description: str
+    def round_trip(self, sentence: str) -> bool:
+        """分析後重新生成，檢查是否得到同一個句子"""
+        analysis = self.analyze(sentence)
+        return analysis.ok and self.realize(analysis) == " ".join(sentence.split())
 
-@dataclass
-class SyntaxSystem:
-    """句法系統"""
-    word_order: str = "SVO"
-    rules: List[SyntaxRule] = field(default_factory=list)
+    def analyze_stream(self, lines: Iterable[str]) -> Iterator[Dict[str, object]]:
+        """
+        逐行分析，產生標註紀錄
+        每行可以是一個句子，或 run_batch 輸出的 jsonl 紀錄（每個欄位各分析一次，並記下欄位名稱 form）
+        """
+        analyze = self.analyze
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('{'):
+                for form, sentence in json.loads(line).items():
+                    if isinstance(sentence, str):
+                        record = analyze(sentence).to_dict()
+                        record['form'] = form
+                        yield record
+            else:
+                yield analyze(line).to_dict()
 
-    def add_rule(self, name: str, pattern: str, description: str):
-        """添加句法規則"""
-        rule = SyntaxRule(name, pattern, description)
-        self.rules.append(rule)
+    def analyze_file(self, source_path: str, target_path: str, buffer_size: int = 10_000) -> int:
+        """分析整個檔案，把標註寫成 jsonl（或依副檔名 csv），回傳紀錄筆數"""
+        with open(source_path, encoding='utf-8') as f:
+            return export_stream(self.analyze_stream(f), target_path, buffer_size=buffer_size)
 
-    def generate_sentence(self, subject: str, verb: str, obj: str = "") -> str:
-        """根據語序生成句子"""
-        if self.word_order == "SVO":
-            return f"{subject} {verb} {obj}".strip()
-        elif self.word_order == "SOV":
-            return f"{subject} {obj} {verb}".strip()
-        elif self.word_order == "VSO":
-            return f"{verb} {subject} {obj}".strip()
-        else:
-            return f"{subject} {verb} {obj}".strip()
 
 class LanguageCreatorGame:
     """語言創造者遊戲主類"""
@@ -247,42 +3514,66 @@ class LanguageCreatorGame:
         self.phonology = PhonologySystem()
         self.morphology = MorphologySystem()
         self.syntax = SyntaxSystem()
-        self.vocabulary = defaultdict(list)  # {詞性: [詞語列表]}
+        self.vocabulary = Lexicon(stats=LexiconStats(self.phonology))  # {詞性: [詞語列表]}
         self.current_level = 1
+        self.output = print  # say() 的輸出目的地
 
 
+    def say(self, text: str = ""):
+        """輸出一段訊息給玩家（預設 print，伺服器模式會換成寫入該連線的緩衝區）"""
+        self.output(text)
+
+    def level_1_phonology(self):
+        """第一關：設定音韻系統（互動模式）"""
+        run_dialog(self.level_1_phonology_dialog())
+
+    def level_2_morphology(self):
+        """第二關：設定構詞系統（互動模式）"""
+        run_dialog(self.level_2_morphology_dialog())
+
+    def level_3_syntax(self):
+        """第三關：設定句法系統（互動模式）"""
+        run_dialog(self.level_3_syntax_dialog())
+
     def display_welcome(self):
         """顯示歡迎訊息"""
-        print("=" * 60)
-        print("🌍 歡迎來到語言創造者遊戲！ 🌍")
-        print("=" * 60)
-        print("你將通過三個層次來創造一個全新的語言：")
-        print("第一層：音韻系統 (Phonology)")
-        print("第二層：構詞系統 (Morphology)")
-        print("第三層：句法系統 (Syntax)")
-        print("=" * 60)
+        self.say("=" * 60)
+        self.say("🌍 歡迎來到語言創造者遊戲！ 🌍")
+        self.say("=" * 60)
+        self.say("你將通過三個層次來創造一個全新的語言：")
+        self.say("第一層：音韻系統 (Phonology)")
+        self.say("第二層：構詞系統 (Morphology)")
+        self.say("第三層：句法系統 (Syntax)")
+        self.say("=" * 60)
 
-    def level_1_phonology(self):
+    def level_1_phonology_dialog(self):
         """第一關：設定音韻系統"""
-        print("\n🔤 第一關：音韻系統設定")
-        print("-" * 40)
-        print("讓我們為你的語言設定基本的聲音系統！")
+        self.say("\n🔤 第一關：音韻系統設定")
+        self.say("-" * 40)
+        self.say("讓我們為你的語言設定基本的聲音系統！")
 
         # 設定子音
         #print(f"\n目前的子音：{', '.join(sorted(self.phonology.consonants))}")
         while True:
-            print(f"\n目前的子音：{', '.join(sorted(self.phonology.consonants))}")
-            choice = input("\n你想要 (a)添加子音 (b)移除子音 (c)繼續下一步？ ").lower()
+            self.say(f"\n目前的子音：{', '.join(sorted(self.phonology.consonants))}")
+            choice = (yield "\n你想要 (a)添加子音 (b)移除子音 (c)繼續下一步？ ").lower()
             if choice == 'a':
-                new_consonant = input("請輸入要添加的子音：")
+                new_consonant = (yield "請輸入要添加的子音：")
                 if new_consonant and len(new_consonant) <= 2:
                     self.phonology.consonants.add(new_consonant)
-                    print(f"已添加子音：{new_consonant}")
+                    self.say(f"已添加子音：{new_consonant}")
             elif choice == 'b':
-                remove_consonant = input("請輸入要移除的子音：")
+                remove_consonant = (yield "請輸入要移除的子音：")
                 if remove_consonant in self.phonology.consonants:
+                    before = self.phonology.inventory_snapshot()
                     self.phonology.consonants.remove(remove_consonant)
-                    print(f"已移除子音：{remove_consonant}")
+                    error = self.generation_error()
+                    if error:
+                        self.phonology.restore_inventory(before)
+                        self.say(f"⚠️ 無法移除子音 {remove_consonant}：{error}")
+                        continue
+                    self.say(f"已移除子音：{remove_consonant}")
+                    self.report_revalidation(before)
             elif choice == 'c':
                 break
 
@@ -290,109 +3581,171 @@ class LanguageCreatorGame:
         # 設定母音
         #print(f"\n目前的母音：{', '.join(sorted(self.phonology.vowels))}")
         while True:
-            print(f"\n目前的母音：{', '.join(sorted(self.phonology.vowels))}")
-            choice = input("\n你想要 (a)添加母音 (b)移除母音 (c)繼續下一步？ ").lower()
+            self.say(f"\n目前的母音：{', '.join(sorted(self.phonology.vowels))}")
+            choice = (yield "\n你想要 (a)添加母音 (b)移除母音 (c)繼續下一步？ ").lower()
 
             if choice == 'a':
-                new_vowel = input("請輸入要添加的母音：")
+                new_vowel = (yield "請輸入要添加的母音：")
                 if new_vowel and len(new_vowel) <= 3:
                     self.phonology.vowels.add(new_vowel)
-                    print(f"已添加母音：{new_vowel}")
+                    self.say(f"已添加母音：{new_vowel}")
 
             elif choice == 'b':
-                remove_vowel = input("請輸入要移除的母音：")
+                remove_vowel = (yield "請輸入要移除的母音：")
                 if remove_vowel in self.phonology.vowels:
+                    before = self.phonology.inventory_snapshot()
                     self.phonology.vowels.remove(remove_vowel)
-                    print(f"已移除母音：{remove_vowel}")
+                    error = self.generation_error()
+                    if error:
+                        self.phonology.restore_inventory(before)
+                        self.say(f"⚠️ 無法移除母音 {remove_vowel}：{error}")
+                        continue
+                    self.say(f"已移除母音：{remove_vowel}")
+                    self.report_revalidation(before)
             elif choice == 'c':
                 break
 
         # 設定音節結構
-        print(f"\n目前的詞彙音節結構：{', '.join(self.phonology.syllable_patterns)}")
-        print("(C=子音, V=母音)")
+        self.say(f"\n目前的詞彙音節結構：{', '.join(self.phonology.syllable_patterns)}")
+        self.say("(C=子音, V=母音)")
 
 
-        self.phonology.set_coda_restrictions()
-        self.phonology.set_onset_clusters()
-        self.phonology.set_vowel_clusters()
+        before = self.phonology.inventory_snapshot()
+        yield from self.phonology.coda_restrictions_dialog(self.say)
+        yield from self.phonology.onset_clusters_dialog(self.say)
+        yield from self.phonology.vowel_clusters_dialog(self.say)
+        self.report_revalidation(before)
+        self.refresh_stats()
 
         # 生成範例詞語
-        print("\n🎲 讓我們用你的音韻系統生成一些詞語：")
+        self.say("\n🎲 讓我們用你的音韻系統生成一些詞語：")
         for i in range(5):
             word = self.phonology.generate_word()
-            print(f"{i+1}. {word}")
+            self.say(f"{i+1}. {word}")
             self.vocabulary['unknown'].append(word)
             
                     
-        print(f"\n✅ 第一關完成！")
+        self.say(f"\n✅ 第一關完成！")
         self.current_level = 2
 
-    def apply_def_article(self, word: str) -> str:
+    def revalidate_vocabulary(self, before: Dict[str, frozenset], rng=None) -> Dict[str, List[str]]:
+        """
+        音素庫存變動後（before 為變動前的 phonology.inventory_snapshot()），只重新檢查受影響的詞：
+        不合法的詞移除後，用新的音韻規則替同一詞類補上一樣多的新詞，回傳 {詞類: [被移除的詞]}
+        新的設定無法生成詞語時丟出 ValueError（不合法的詞已經移除）
+        第一次重新檢查時才替詞彙建立音素索引（PhonemeIndex），只造詞不改庫存的遊戲不必為每個詞多付索引的成本；
+        從快照載入的唯讀詞彙（MappedLexicon）會先 materialize
+        """
+        phonemes = self.phonology.invalidated_by(before)
+        removed = {}
+        if phonemes is None or phonemes:
+            if isinstance(self.vocabulary, MappedLexicon):
+                # 快照映射進來的詞彙是唯讀的，先解碼成可修改的 Lexicon
+                self.vocabulary = self.vocabulary.materialize()
+            if phonemes is not None and self.vocabulary.phonemes is None:
+                self.vocabulary.set_phoneme_index(PhonemeIndex())
+            removed = self.vocabulary.revalidate(phonemes, self.phonology.build_validator().is_valid)
+            for word_class, words in removed.items():
+                self.vocabulary.fill(word_class, self.phonology, len(words), rng)
+        self.refresh_stats()
+        return removed
+
+    def refresh_stats(self):
+        """音素切分跟著庫存改變：庫存和詞彙統計建立時不同時，用新的庫存重算一次統計"""
+        fresh = LexiconStats(self.phonology)
+        stats = self.vocabulary.stats
+        if stats is None or fresh.inventory != stats.inventory:
+            self.vocabulary.set_stats(fresh)
+
+    def generation_error(self) -> Optional[str]:
+        """目前的音韻設定能生成詞語時回傳 None，否則回傳原因（互動模式用來拒絕會讓造詞失敗的修改）"""
+        try:
+            self.phonology.sampler.random_counts(self.phonology.syllable_patterns)
+        except ValueError as e:
+            return str(e)
+        return None
+
+    def report_revalidation(self, before: Dict[str, frozenset]):
+        """互動模式用：重新檢查詞彙並告訴玩家換掉了哪些詞"""
+        if not len(self.vocabulary):
+            return
+        try:
+            removed = self.revalidate_vocabulary(before)
+        except ValueError as e:
+            self.say(f"⚠️ 無法補上新詞：{e}")
+            return
+        for word_class, words in removed.items():
+            self.say(f"已替換 {len(words)} 個不再合法的{word_class}：{', '.join(words[:10])}"
+                     + (" ..." if len(words) > 10 else ""))
+
+    def apply_def_article(self, word: str, rng=None) -> str:
             """加入定冠詞，若遇到母音開頭詞則改成 l' 形式"""
-            def_article_rules = [r for r in self.morphology.rules if r.name == "definite_article"]
+            def_article_rules = self.morphology.compiled.rules_named("definite_article")
 
             if not def_article_rules:
                 return word  # 沒有定冠詞設定
 
-            chosen_rule = random.choice(def_article_rules)
-            marker = chosen_rule.marker.strip()  # 例如 "le", "la"
-            first_letter = word[0]
+            chosen_rule = (rng or random).choice(def_article_rules)
 
-            # 如果冠詞是 le/la 且詞以母音開頭 → 用 l'
-            if marker in {"le", "la"} and first_letter in self.phonology.vowels:
-                return f"l'{word}"
-            else:
-                return f"{marker} {word}"
+            # 如果冠詞是 le/la 且詞以母音開頭 → 用 l'（由 phonology.sandhi_rules 決定）
+            return self.phonology.sandhi.apply(f"{SandhiEngine.mark(chosen_rule.marker.strip())} {word}")
 
+    def apply_def_article_many(self, words: Iterable[str], rng=None) -> List[str]:
+        """替一整批名詞加上定冠詞，跨詞音變整批只跑一次"""
+        def_article_rules = self.morphology.compiled.rules_named("definite_article")
+        words = list(words)
+        if not def_article_rules:
+            return words
+        markers = (rng or random).choices([rule.marker.strip() for rule in def_article_rules], k=len(words))
+        return self.phonology.sandhi.apply_many([f"{SandhiEngine.mark(m)} {w}" for m, w in zip(markers, words)])
 
-    def level_2_morphology(self):
+
+    def level_2_morphology_dialog(self):
        
 
         """第二關：設定構詞系統"""
-        print("\n🔧 第二關：構詞系統設定")
-        print("-" * 40)
-        print("現在我們來為語言添加構詞規則！")
+        self.say("\n🔧 第二關：構詞系統設定")
+        self.say("-" * 40)
+        self.say("現在我們來為語言添加構詞規則！")
 
         # 將之前生成的詞語分類
-        print("\n首先，讓我們為之前生成的詞語分類：")
+        self.say("\n首先，讓我們為之前生成的詞語分類：")
         for word in self.vocabulary['unknown'][:]:
-            print(f"\n詞語：{word}")
-            word_class = input("這個詞是 (n)名詞 (v)動詞 (a)形容詞").lower()
+            self.say(f"\n詞語：{word}")
+            word_class = (yield "這個詞是 (n)名詞 (v)動詞 (a)形容詞").lower()
 
             if word_class == 'n':
-                self.vocabulary['noun'].append(word)
+                self.vocabulary.move(word, 'noun')
             elif word_class == 'v':
-                self.vocabulary['verb'].append(word)
+                self.vocabulary.move(word, 'verb')
             elif word_class == 'a':
-                self.vocabulary['adjective'].append(word)
+                self.vocabulary.move(word, 'adjective')
             else:
-                self.vocabulary['noun'].append(word)  # 預設為名詞
-
-            self.vocabulary['unknown'].remove(word)
+                self.vocabulary.move(word, 'noun')  # 預設為名詞
 
         # 添加構詞規則
-        print("\n現在我們來創建構詞規則：")
+        self.say("\n現在我們來創建構詞規則：")
 
         # 複數規則
-        plural_marker = input("請設定複數標記（例如：-s, -en, -i）：") or "-i"
+        plural_marker = (yield "請設定複數標記（例如：-s, -en, -i）：") or "-i"
         self.morphology.add_rule("plural", "suffix", plural_marker, "複數")
-        print(f"已添加複數規則：詞根 + {plural_marker}")
+        self.say(f"已添加複數規則：詞根 + {plural_marker}")
 
         # 設定多個定冠詞規則
         while True:
-            article_marker = input("請設定定冠詞標記（例如：the, der, la，輸入空白鍵結束）：").strip()
+            article_marker = (yield "請設定定冠詞標記（例如：the, der, la，輸入空白鍵結束）：").strip()
             if article_marker == '':  # 空白鍵結束
                 break
             if article_marker:  # 只有在真的輸入內容才新增
                 article_marker = article_marker + " "  # 在冠詞後加空格
                 self.morphology.add_rule("definite_article", "prefix", article_marker, "定冠詞")
-                print(f"已添加定冠詞規則：{article_marker}+ 詞根")
+                self.say(f"已添加定冠詞規則：{article_marker}+ 詞根")
 
 
         # 生成名詞並套用定冠詞
         new_nouns = []
 
-        def_article_rules = [r for r in self.morphology.rules if r.name == "definite_article"]
+        def_article_rules = self.morphology.compiled.rules_named("definite_article")
         for _ in range(3):  # 假設生成 3 個名詞
             noun_root = self.phonology.generate_word(syllable_count=random.randint(2,3))
             new_nouns.append(noun_root)
@@ -400,177 +3753,817 @@ class LanguageCreatorGame:
             # ✅ 展示時才加定冠詞
             if def_article_rules:
                 noun_with_article = self.apply_def_article(noun_root)
-                print(f"範例名詞（已套定冠詞）：{noun_with_article}")
+                self.say(f"範例名詞（已套定冠詞）：{noun_with_article}")
             else:
-                print(f"範例名詞：{noun_root}")
+                self.say(f"範例名詞：{noun_root}")
 
         self.vocabulary['noun'].extend(new_nouns)
 
 
         # 否定規則
-        neg_prefix = input("請設定否定前綴（例如：ne，預設 ne）：").strip() or "ne"
-        neg_suffix = input("請設定否定後綴（例如：pas, point, jamais，預設 pas）：").strip() or "pas"
+        neg_prefix = (yield "請設定否定前綴（例如：ne，預設 ne）：").strip() or "ne"
+        neg_suffix = (yield "請設定否定後綴（例如：pas, point, jamais，預設 pas）：").strip() or "pas"
         self.morphology.add_rule("negative", "circumfix", (neg_prefix + " ", " " + neg_suffix), "否定")
-        print(f"已添加否定規則：{neg_prefix} + 動詞 + {neg_suffix}")
+        self.say(f"已添加否定規則：{neg_prefix} + 動詞 + {neg_suffix}")
 
         # 演示構詞規則
-        print("\n🎯 構詞規則演示：")
+        self.say("\n🎯 構詞規則演示：")
         if self.vocabulary['noun']:
             noun = random.choice(self.vocabulary['noun'])
             plural_form = self.morphology.apply_morphology(noun, "plural")
-            print(f"名詞複數：{noun} → {plural_form}")
+            self.say(f"名詞複數：{noun} → {plural_form}")
 
         if self.vocabulary['adjective']:
             adj = random.choice(self.vocabulary['adjective'])
             neg_form = self.morphology.apply_morphology(adj, "negative")
-            print(f"形容詞否定：{adj} → {neg_form}")
+            self.say(f"形容詞否定：{adj} → {neg_form}")
 
-        print(f"\n✅ 第二關完成！")
+        self.say(f"\n✅ 第二關完成！")
         self.current_level = 3
 
 
-    def level_3_syntax(self):
+    def level_3_syntax_dialog(self):
         """第三關：設定句法系統"""
-        print("\n📝 第三關：句法系統設定")
-        print("-" * 40)
-        print("最後，我們來設定語言的句子結構！")
+        self.say("\n📝 第三關：句法系統設定")
+        self.say("-" * 40)
+        self.say("最後，我們來設定語言的句子結構！")
 
         # 設定基本語序
-        print("\n請選擇基本語序：")
-        print("1. SVO (主語-動詞-賓語) - 如英文、中文")
-        print("2. SOV (主語-賓語-動詞) - 如日文、韓文")
-        print("3. VSO (動詞-主語-賓語) - 如愛爾蘭語、南島語")
+        self.say("\n請選擇基本語序：")
+        self.say("1. SVO (主語-動詞-賓語) - 如英文、中文")
+        self.say("2. SOV (主語-賓語-動詞) - 如日文、韓文")
+        self.say("3. VSO (動詞-主語-賓語) - 如愛爾蘭語、南島語")
+        self.say("4. OVS (賓語-動詞-主語) - 如希卡利亞納語")
+        self.say("5. OSV (賓語-主語-動詞) - 如瓦勞語")
+        self.say("6. VOS (動詞-賓語-主語) - 如馬達加斯加語")
 
-        order_choice = input("請選擇 (1-3)：") or "1"
+        order_choice = (yield "請選擇 (1-6)：") or "1"
 
-        if order_choice == "1":
-            self.syntax.word_order = "SVO"
-        elif order_choice == "2":
-            self.syntax.word_order = "SOV"
-        elif order_choice == "3":
-            self.syntax.word_order = "VSO"
+        orders = {"1": "SVO", "2": "SOV", "3": "VSO", "4": "OVS", "5": "OSV", "6": "VOS"}
+        if order_choice in orders:
+            self.syntax.word_order = orders[order_choice]
 
-        print(f"已設定語序：{self.syntax.word_order}")
+        self.say(f"已設定語序：{self.syntax.word_order}")
 
         # 添加句法規則
         self.syntax.add_rule("basic_sentence", self.syntax.word_order, "基本句型")
 
         # 疑問句規則
-        question_marker = input("請設定疑問標記（例如：？, -ka, ma）：") or "ka"
+        question_marker = (yield "請設定疑問標記（例如：？, -ka, ma）：") or "ka"
         self.syntax.add_rule("question", f"{self.syntax.word_order}+{question_marker}", "疑問句")
 
         # 生成範例句子
-        print(f"\n🎨 讓我們用 {self.syntax.word_order} 語序生成一些句子：")
+        self.say(f"\n🎨 讓我們用 {self.syntax.word_order} 語序生成一些句子：")
 
         # 確保各詞類都有詞語
-        if not self.vocabulary['noun']:
-            self.vocabulary['noun'].append(self.phonology.generate_word())
-        if not self.vocabulary['verb']:
-            self.vocabulary['verb'].append(self.phonology.generate_word())
+        if self.ensure_sentence_words():
+            for i in range(3):
+                subject = random.choice(self.vocabulary['noun'])
+                verb = random.choice(self.vocabulary['verb'])
+                obj = random.choice(self.vocabulary['noun']) if len(self.vocabulary['noun']) > 1 else ""
 
-        for i in range(3):
-            subject = random.choice(self.vocabulary['noun'])
-            verb = random.choice(self.vocabulary['verb'])
-            obj = random.choice(self.vocabulary['noun']) if len(self.vocabulary['noun']) > 1 else ""
+                sentence = self.syntax.generate_sentence(subject, verb, obj)
+                self.say(f"{i+1}. {sentence}")
 
-            sentence = self.syntax.generate_sentence(subject, verb, obj)
-            print(f"{i+1}. {sentence}")
+                # 疑問句版本
+                question_sentence = sentence + " " + question_marker
+                self.say(f"   疑問句：{question_sentence}")
 
-            # 疑問句版本
-            question_sentence = sentence + " " + question_marker
-            print(f"   疑問句：{question_sentence}")
+        self.say(f"\n✅ 第三關完成！")
 
-        print(f"\n✅ 第三關完成！")
+    def ensure_sentence_words(self) -> bool:
+        """
+        名詞或動詞還是空的就補一個詞，回傳是否兩者都有詞可以造句
+        詞語空間已經用完時 fill 試過有限次數就放棄（不會一直重抽同一個詞），並告訴玩家原因
+        """
+        try:
+            for word_class in ('noun', 'verb'):
+                if not self.vocabulary[word_class]:
+                    self.vocabulary.fill(word_class, self.phonology, 1)
+        except ValueError as e:
+            self.say(f"⚠️ 無法補上造句需要的詞：{e}")
+            return False
+        return True
 
     def final_showcase(self):
         """最終展示創造的語言"""
-        print("\n" + "=" * 60)
-        print("🎉 恭喜！你已經成功創造了一個新語言！ 🎉")
-        print("=" * 60)
+        self.say("\n" + "=" * 60)
+        self.say("🎉 恭喜！你已經成功創造了一個新語言！ 🎉")
+        self.say("=" * 60)
 
-        print(f"\n🔤 音韻系統:")
-        print(f"   子音：{', '.join(sorted(self.phonology.consonants))}")
-        print(f"   母音：{', '.join(sorted(self.phonology.vowels))}")
-        print(f"   音節模式：{', '.join(self.phonology.syllable_patterns)}")
+        self.say(f"\n🔤 音韻系統:")
+        self.say(f"   子音：{', '.join(sorted(self.phonology.consonants))}")
+        self.say(f"   母音：{', '.join(sorted(self.phonology.vowels))}")
+        self.say(f"   音節模式：{', '.join(self.phonology.syllable_patterns)}")
 
-        print(f"\n🔧 構詞系統:")
+        self.say(f"\n🔧 構詞系統:")
         for rule in self.morphology.rules:
-            print(f"   {rule.name}: {rule.rule_type} '{rule.marker}' ({rule.meaning})")
+            self.say(f"   {rule.name}: {rule.rule_type} '{rule.marker}' ({rule.meaning})")
 
-        print(f"\n📝 句法系統:")
-        print(f"   基本語序：{self.syntax.word_order}")
+        self.say(f"\n📝 句法系統:")
+        self.say(f"   基本語序：{self.syntax.word_order}")
         for rule in self.syntax.rules:
-            print(f"   {rule.name}: {rule.pattern}")
+            self.say(f"   {rule.name}: {rule.pattern}")
 
-        print(f"\n📚 詞彙統計:")
-        for word_class, words in self.vocabulary.items():
-            if words and word_class != 'unknown':
-                print(f"   {word_class}: {len(words)} 個詞")
+        self.say(f"\n📚 詞彙統計:")
+        stats = self.vocabulary.stats
+        for word_class, count in stats.classes.items():
+            if word_class != 'unknown':
+                self.say(f"   {word_class}: {count} 個詞"
+                         f"（含變音母音 {stats.accented.get(word_class, 0)} 個）")
+        if stats.words:
+            self.say(f"   常用音素：{', '.join(f'{p}({n})' for p, n in stats.top('phonemes', 8))}")
+            self.say(f"   常用音節結構：{', '.join(f'{p}({n})' for p, n in stats.top('syllable_patterns', 5))}")
+            self.say(f"   詞長分佈：{', '.join(f'{length}字({n})' for length, n in sorted(stats.lengths.items()))}")
+            for word_class, codas in stats.codas.items():
+                top = sorted(codas.items(), key=lambda item: (-item[1], item[0]))[:5]
+                self.say(f"   {word_class} 的音節尾：{', '.join(f'{c}({n})' for c, n in top)}")
 
         # 🔽 加入定冠詞處理邏輯 🔽
         def_article_rules = [r for r in self.morphology.rules if r.name == "definite_article"]
 
-        subject = self.apply_def_article(random.choice(self.vocabulary['noun']))
+        if self.vocabulary['noun']:
+            subject = self.apply_def_article(random.choice(self.vocabulary['noun']))
 
         # 🌟 語言展示句子
-        print(f"\n🌟 你的語言作品展示:")
+        self.say(f"\n🌟 你的語言作品展示:")
+
+        for i in range(3):
+            if self.vocabulary['noun'] and self.vocabulary['verb']:
+                variants = self.sentence_variants()
+                self.say(f"   陳述句：{variants['sentence']}")
+                self.say(f"   否定句：{variants['negative']}")
+                self.say(f"   疑問句：{variants['question']}")
+
+        # 用文法產生更多句型（形容詞、不及物句、複數…）
+        try:
+            sentences = GrammarEngine.from_game(self).generate(5)
+        except ValueError:
+            sentences = []
+        if sentences:
+            self.say(f"\n📖 更多句型:")
+            for sentence in sentences:
+                self.say(f"   {sentence}")
+
+    def sentence_variants(self, rng=None) -> Dict[str, str]:
+        """從詞彙中抽詞，產生同一句的陳述句、否定句與疑問句"""
+        rng = rng or random
 
         # 取得否定規則（circumfix）
-        neg_rule = next((r for r in self.morphology.rules if r.name == "negative"), None)
+        neg_rule = next(iter(self.morphology.compiled.rules_named("negative")), None)
         neg_prefix, neg_suffix = neg_rule.marker if neg_rule else ("", "")
 
         # 取得疑問標記（從語法規則中抓）
-        question_rule = next((r for r in self.syntax.rules if r.name == "question"), None)
-        question_marker = question_rule.pattern.split("+")[-1] if question_rule else "?"
+        question_marker = self.syntax.question_marker
 
-        for i in range(3):
-            if self.vocabulary['noun'] and self.vocabulary['verb']:
-                subject = self.apply_def_article(random.choice(self.vocabulary['noun']))
-                verb = random.choice(self.vocabulary['verb'])
-                obj = self.apply_def_article(random.choice(self.vocabulary['noun'])) if len(self.vocabulary['noun']) > 1 else ""
+        subject = self.apply_def_article(rng.choice(self.vocabulary['noun']), rng)
+        verb = rng.choice(self.vocabulary['verb'])
+        obj = self.apply_def_article(rng.choice(self.vocabulary['noun']), rng) if len(self.vocabulary['noun']) > 1 else ""
 
-                # 陳述句
-                sentence = self.syntax.generate_sentence(subject, verb, obj)
-                print(f"   陳述句：{sentence}")
+        # 陳述句、否定句（只否定動詞），再一起套用跨詞音變
+        negated_verb = f"{neg_prefix}{verb}{neg_suffix}".strip()
+        sentence, neg_sentence = self.phonology.sandhi.apply_many([
+            self.syntax.generate_sentence(subject, verb, obj),
+            self.syntax.generate_sentence(subject, negated_verb, obj),
+        ])
 
-                # 否定句（只否定動詞）
-                negated_verb = f"{neg_prefix}{verb}{neg_suffix}".strip()
-                neg_sentence = self.syntax.generate_sentence(subject, negated_verb, obj)
-                print(f"   否定句：{neg_sentence}")
+        # 疑問句（加問句標記）
+        question_sentence = sentence + f" {question_marker}"
 
-                # 疑問句（加問句標記）
-                question_sentence = sentence + f" {question_marker}"
-                print(f"   疑問句：{question_sentence}")
+        return {'sentence': sentence, 'negative': neg_sentence, 'question': question_sentence}
 
+    def save(self, path: str):
+        """把整個語言存成二進位快照（見 save_language）"""
+        save_language(self, path)
 
+    @classmethod
+    def load(cls, path: str, materialize: bool = False) -> 'LanguageCreatorGame':
+        """讀取二進位快照，詞彙預設以記憶體映射的唯讀形式載入（見 LanguageSnapshot）"""
+        return load_language(path, materialize)
 
+    @classmethod
+    def from_spec(cls, spec: dict, rng=None) -> 'LanguageCreatorGame':
+        """
+        不經過 input()，直接用語言設定（見 load_language_spec）建立整個語言
+        規則與互動模式相同：叢集需由合法音素組成，未設定音節尾子音時全部子音都可
+        """
+        rng = rng or random
+        game = cls()
+        phonology = game.phonology
 
-    def run_game(self):
-        """運行遊戲主循環"""
+        phon = spec.get('phonology', {})
+        if 'consonants' in phon:
+            phonology.consonants = set(phon['consonants'])
+        if 'vowels' in phon:
+            phonology.vowels = set(phon['vowels'])
+        if 'syllable_patterns' in phon:
+            phonology.syllable_patterns = list(phon['syllable_patterns'])
+
+        if 'sandhi' in phon:
+            # [{"name": ..., "kind": "elision" | "liaison" | "hiatus", "left": [...], "replacement": ...}]
+            phonology.sandhi_rules = [SandhiRule(r['name'], r['kind'], tuple(r.get('left', ())), r.get('replacement', ""))
+                                      for r in phon['sandhi']]
+            for rule in phonology.sandhi_rules:
+                if rule.kind not in SANDHI_KINDS:
+                    raise ValueError(f"不支援的音變種類：{rule.kind}")
+
+        codas = set(phon.get('coda_restrictions', ()))
+        unknown = codas - phonology.consonants
+        if unknown:
+            raise ValueError(f"{', '.join(sorted(unknown))} 不在子音系統中")
+        phonology.coda_restrictions = codas or phonology.consonants.copy()
+
+        for key, inventory, kind in (('onset_clusters', phonology.consonants, "子音"),
+                                     ('vowel_clusters', phonology.vowels, "母音")):
+            clusters = set(phon.get(key, ()))
+            for cluster in clusters:
+                if len(cluster) < 2 or not all(c in inventory for c in cluster):
+                    raise ValueError(f"{cluster} 不合法（需至少兩個合法{kind}）")
+            setattr(phonology, key, clusters)
+
+        morph = spec.get('morphology', {})
+        if 'plural' in morph:
+            game.morphology.add_rule("plural", "suffix", morph['plural'], "複數")
+        for article in morph.get('definite_articles', ()):
+            game.morphology.add_rule("definite_article", "prefix", article.strip() + " ", "定冠詞")
+        if 'negative' in morph:
+            neg_prefix, neg_suffix = morph['negative']
+            game.morphology.add_rule("negative", "circumfix", (neg_prefix + " ", " " + neg_suffix), "否定")
+
+        syn = spec.get('syntax', {})
+        word_order = syn.get('word_order', "SVO")
+        if word_order not in WORD_ORDER_FORMATS:
+            raise ValueError(f"不支援的語序：{word_order}")
+        game.syntax.word_order = word_order
+        game.syntax.add_rule("basic_sentence", word_order, "基本句型")
+        if 'question_marker' in syn:
+            game.syntax.add_rule("question", f"{word_order}+{syn['question_marker']}", "疑問句")
+        # 額外的文法規則，例如 ["NP -> DET adjective noun [1]"]（見 parse_grammar_rule）
+        for text in syn.get('grammar', ()):
+            parse_grammar_rule(text)
+            game.syntax.add_rule("grammar", text, "文法規則")
+
+        # 近似詞檢查：{"max_distance": 1, "mode": "reject" 或 "flag"}
+        if 'similarity' in spec:
+            game.vocabulary.set_similarity(SimilarityIndex(**spec['similarity']))
+
+        # 詞彙：可直接給詞語列表，或給數量由音韻系統生成（預設名詞、動詞各 20 個）
+        # 統計改用設定好的音素庫存，之後隨新增/移除即時更新
+        game.refresh_stats()
+        vocabulary = spec.get('vocabulary', {'noun': 20, 'verb': 20})
+        for word_class, words in vocabulary.items():
+            if isinstance(words, int):
+                game.vocabulary.fill(word_class, phonology, words, rng)
+            else:
+                game.vocabulary[word_class].extend(words)
+
+        game.current_level = 4
+        return game
+
+    def play(self):
+        """
+        整個遊戲流程（產生器）：yield 出要問玩家的提示，用 send() 傳回玩家的回答，
+        其他訊息透過 self.say 輸出；互動模式用 run_game 驅動，伺服器模式見 GameSession
+        """
         self.display_welcome()
 
-        input("\n按 Enter 開始遊戲...")
+        yield "\n按 Enter 開始遊戲..."
 
         # 第一關：音韻
         if self.current_level == 1:
-            self.level_1_phonology()
+            yield from self.level_1_phonology_dialog()
 
         # 第二關：構詞
         if self.current_level == 2:
-            input("\n按 Enter 進入第二關...")
-            self.level_2_morphology()
+            yield "\n按 Enter 進入第二關..."
+            yield from self.level_2_morphology_dialog()
 
         # 第三關：句法
         if self.current_level == 3:
-            input("\n按 Enter 進入第三關...")
-            self.level_3_syntax()
+            yield "\n按 Enter 進入第三關..."
+            yield from self.level_3_syntax_dialog()
 
         # 最終展示
-        input("\n按 Enter 查看你創造的語言...")
+        yield "\n按 Enter 查看你創造的語言..."
         self.final_showcase()
 
-def main():
-    """主程式"""
+    def run_game(self):
+        """運行遊戲主循環（用 input()/print() 與玩家互動）"""
+        run_dialog(self.play())
+
+def load_language_spec(path: str) -> dict:
+    """
+    讀取 JSON 或 TOML 語言設定檔，例如：
+    {
+      "phonology": {"consonants": [...], "vowels": [...], "syllable_patterns": ["CV", "CVC"],
+                    "coda_restrictions": ["r", "s"], "onset_clusters": ["tr"], "vowel_clusters": ["ou"],
+                    "sandhi": [{"name": "elision", "kind": "elision", "left": ["le", "la"], "replacement": "l'"}]},
+      "morphology": {"plural": "s", "definite_articles": ["le", "la", "les"], "negative": ["ne", "pas"]},
+      "syntax": {"word_order": "SVO", "question_marker": "?"},
+      "vocabulary": {"noun": 100, "verb": ["aimer", "parler"]},
+      "similarity": {"max_distance": 1, "mode": "reject"}
+    }
+    """
+    if path.endswith('.toml'):
+        if tomllib is None:
+            raise RuntimeError("讀取 TOML 設定檔需要 Python 3.11 以上")
+        with open(path, 'rb') as f:
+            return tomllib.load(f)
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+SNAPSHOT_MAGIC = b'FRLANG\x00\x01'
+_SNAPSHOT_HEADER = struct.Struct('<8sQQQ')  # magic, 中繼資料長度, 詞數, 字串表長度
+
+
+def _pad8(n: int) -> int:
+    return (n + 7) & ~7
+
+
+def save_language(game: 'LanguageCreatorGame', path: str):
+    """
+    把整個語言存成二進位快照：
+    [標頭][中繼資料 JSON（音韻、構詞、句法、詞類範圍）][(詞數+1) 個 uint64 位移][UTF-8 字串表]
+    詞語依詞類分段、段內依位元組排序，載入時不用逐一解析就能二分搜尋
+    """
+    phonology, morphology, syntax = game.phonology, game.morphology, game.syntax
+    classes = []
+    encoded: List[bytes] = []
+    for word_class, words in game.vocabulary.items():
+        chunk = sorted(word.encode('utf-8') for word in words)
+        classes.append((word_class, len(encoded), len(encoded) + len(chunk)))
+        encoded.extend(chunk)
+
+    meta = {
+        'phonology': {
+            'consonants': sorted(phonology.consonants),
+            'vowels': sorted(phonology.vowels),
+            'syllable_patterns': list(phonology.syllable_patterns),
+            'phonotactic_rules': list(phonology.phonotactic_rules),
+            'coda_restrictions': sorted(phonology.coda_restrictions),
+            'onset_cluster_restrictions': list(phonology.onset_cluster_restrictions),
+            'vowel_clusters': sorted(phonology.vowel_clusters),
+            'onset_clusters': sorted(phonology.onset_clusters),
+            'sandhi_rules': [[r.name, r.kind, list(r.left), r.replacement] for r in phonology.sandhi_rules],
+        },
+        'morphology': {
+            'rules': [[r.name, r.rule_type, r.marker, r.meaning, r.position] for r in morphology.rules],
+            'word_classes': morphology.word_classes,
+        },
+        'syntax': {
+            'word_order': syntax.word_order,
+            'rules': [[r.name, r.pattern, r.description] for r in syntax.rules],
+        },
+        'current_level': game.current_level,
+        'classes': classes,
+    }
+    meta_bytes = json.dumps(meta, ensure_ascii=False).encode('utf-8')
+
+    offsets = array('Q', [0])
+    total = 0
+    for word in encoded:
+        total += len(word)
+        offsets.append(total)
+    if sys.byteorder == 'big':
+        offsets.byteswap()
+
+    with open(path, 'wb') as f:
+        f.write(_SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, len(meta_bytes), len(encoded), total))
+        f.write(meta_bytes.ljust(_pad8(len(meta_bytes)), b'\0'))
+        f.write(offsets.tobytes())
+        for word in encoded:
+            f.write(word)
+
+
+class LanguageSnapshot:
+    """
+    開啟 save_language 存下的快照
+    中繼資料直接解析；位移陣列與字串表用 mmap 映射，詞語用到才解碼，多個行程可共用同一份分頁
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+        magic, meta_len, word_count, blob_len = _SNAPSHOT_HEADER.unpack_from(view)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} 不是語言快照檔")
+        position = _SNAPSHOT_HEADER.size
+        self.meta = json.loads(str(view[position:position + meta_len], 'utf-8'))
+        position += _pad8(meta_len)
+
+        offsets_len = (word_count + 1) * 8
+        if sys.byteorder == 'little':
+            offsets = view[position:position + offsets_len].cast('Q')
+        else:  # 大端序的機器只能複製一份再轉換（檔案固定是小端序）
+            offsets = array('Q')
+            offsets.frombytes(view[position:position + offsets_len])
+            offsets.byteswap()
+        position += offsets_len
+        self.word_count = word_count
+        self.vocabulary = MappedLexicon(view[position:position + blob_len], offsets,
+                                        [tuple(c) for c in self.meta['classes']])
+
+    def game(self, materialize: bool = False) -> 'LanguageCreatorGame':
+        """
+        重建遊戲狀態；vocabulary 預設直接用映射的 MappedLexicon（唯讀），
+        materialize=True 時解碼成可修改的 Lexicon
+        """
+        meta = self.meta
+        game = LanguageCreatorGame()
+        for name, value in meta['phonology'].items():
+            if name == 'sandhi_rules':
+                value = [SandhiRule(rule_name, kind, tuple(left), replacement)
+                         for rule_name, kind, left, replacement in value]
+            elif name in ('syllable_patterns', 'phonotactic_rules', 'onset_cluster_restrictions'):
+                value = list(value)
+            else:
+                value = set(value)
+            setattr(game.phonology, name, value)
+        for name, rule_type, marker, meaning, position in meta['morphology']['rules']:
+            if isinstance(marker, list):  # 否定的 circumfix 存成 (前綴, 後綴)
+                marker = tuple(marker)
+            game.morphology.rules.append(MorphologyRule(name, rule_type, marker, meaning, position))
+        game.morphology.word_classes = meta['morphology']['word_classes']
+        game.syntax.word_order = meta['syntax']['word_order']
+        for name, pattern, description in meta['syntax']['rules']:
+            game.syntax.add_rule(name, pattern, description)
+        game.current_level = meta['current_level']
+        game.vocabulary = self.vocabulary.materialize() if materialize else self.vocabulary
+        game.vocabulary.set_stats(LexiconStats(game.phonology))
+        return game
+
+
+def load_language(path: str, materialize: bool = False) -> 'LanguageCreatorGame':
+    """讀取 save_language 存下的快照（見 LanguageSnapshot）"""
+    return LanguageSnapshot(path).game(materialize)
+
+
+class GameSession:
+    """
+    一位玩家的遊戲：把 LanguageCreatorGame.play() 的對話產生器包起來，
+    say() 的訊息先存進緩衝區，每回答一次就回傳 {輸出, 下一個提示, 是否結束}
+    """
+
+    def __init__(self, session_id: str, game: 'LanguageCreatorGame' = None):
+        self.id = session_id
+        self.game = game or LanguageCreatorGame()
+        self._output: List[str] = []
+        self.game.output = self._output.append
+        self._dialog = self.game.play()
+        self._started = False
+        self.prompt: Optional[str] = None
+        self.done = False
+        self.error: Optional[str] = None
+        self.last_active = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def step(self, answer: str = None) -> Dict[str, object]:
+        """
+        推進對話直到下一個提示（會執行造詞等工作，GameServer 把它丟到執行緒池裡跑）
+        玩家輸入不合理時對話本身會提示並重問；遊戲邏輯丟出例外時對話產生器已經結束，
+        遊戲標記為結束並在回傳值的 error 欄位說明原因
+        """
+        if not self.done:
+            try:
+                if self._started:
+                    self.prompt = self._dialog.send(answer or "")
+                else:
+                    self._started = True
+                    self.prompt = next(self._dialog)
+            except StopIteration:
+                self.prompt = None
+                self.done = True
+            except Exception as e:
+                self.prompt = None
+                self.done = True
+                self.error = f"遊戲發生錯誤：{e}"
+        output = "\n".join(self._output)
+        self._output.clear()
+        self.last_active = time.monotonic()
+        result = {'session': self.id, 'output': output, 'prompt': self.prompt, 'done': self.done}
+        if self.error:
+            result['error'] = self.error
+        return result
+
+    def state(self) -> Dict[str, object]:
+        result = {'session': self.id, 'output': "", 'prompt': self.prompt, 'done': self.done}
+        if self.error:
+            result['error'] = self.error
+        return result
+
+
+_WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+class GameServer:
+    """
+    單一行程、asyncio 的多人遊戲伺服器（只用標準函式庫）
+    HTTP JSON：
+        POST   /sessions        開新遊戲，回傳第一段輸出與提示
+        POST   /sessions/<id>   送出回答 {"answer": "..."}
+        GET    /sessions/<id>   目前的提示
+        DELETE /sessions/<id>   結束遊戲
+    WebSocket：連到 /ws 開新遊戲，之後每個文字訊息都是一個回答，伺服器回傳同樣格式的 JSON
+    每一步的遊戲邏輯（含造詞）在執行緒池中執行，不會卡住事件迴圈；閒置太久的遊戲會被清掉
+    """
+
+    def __init__(self, max_sessions: int = 10_000, idle_timeout: float = 3600.0, workers: int = None,
+                 max_body: int = 64 * 1024):
+        self.sessions: Dict[str, GameSession] = {}
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.max_body = max_body
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    # ---- 遊戲 ----
+
+    def create_session(self) -> GameSession:
+        if len(self.sessions) >= self.max_sessions:
+            self.expire_idle()
+            if len(self.sessions) >= self.max_sessions:
+                raise RuntimeError("遊戲數已達上限")
+        session = GameSession(secrets.token_hex(8))
+        self.sessions[session.id] = session
+        return session
+
+    async def advance(self, session: GameSession, answer: str = None) -> Dict[str, object]:
+        """在執行緒池中推進一步；同一個遊戲的回答依序處理"""
+        async with session.lock:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(self.executor, session.step, answer)
+        if session.done:
+            self.sessions.pop(session.id, None)
+        return result
+
+    def expire_idle(self):
+        deadline = time.monotonic() - self.idle_timeout
+        for session_id in [sid for sid, s in self.sessions.items() if s.last_active < deadline]:
+            del self.sessions[session_id]
+
+    async def _reaper(self):
+        while True:
+            await asyncio.sleep(min(60.0, self.idle_timeout))
+            self.expire_idle()
+
+    # ---- HTTP ----
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8765):
+        """啟動伺服器直到被取消"""
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        reaper = asyncio.create_task(self._reaper())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            reaper.cancel()
+            self.executor.shutdown(wait=False)
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = (await reader.readline()).decode('latin-1').strip()
+            if not request_line:
+                return
+            method, path, _ = request_line.split(' ', 2)
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode('latin-1').strip()
+                if not line:
+                    break
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            if path == '/ws' and headers.get('upgrade', '').lower() == 'websocket':
+                await self.handle_websocket(reader, writer, headers)
+                return
+
+            length = int(headers.get('content-length') or 0)
+            if length > self.max_body:
+                await self._respond(writer, 413, {'error': "請求太大"})
+                return
+            body = await reader.readexactly(length) if length else b''
+            status, payload = await self.route(method, path, body)
+            await self._respond(writer, status, payload)
+        except ValueError:
+            # 無法解析的請求列或 Content-Length（遊戲邏輯的錯誤由 GameSession.step 處理）
+            await self._respond(writer, 400, {'error': "無法解析的請求"})
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def route(self, method: str, path: str, body: bytes) -> Tuple[int, dict]:
+        parts = [p for p in path.split('?')[0].split('/') if p]
+        if not parts or parts[0] != 'sessions' or len(parts) > 2:
+            return 404, {'error': "找不到路徑"}
+        if len(parts) == 1:
+            if method != 'POST':
+                return 405, {'error': "只支援 POST"}
+            try:
+                session = self.create_session()
+            except RuntimeError as e:
+                return 503, {'error': str(e)}
+            result = await self.advance(session)
+            return (500 if 'error' in result else 201), result
+
+        session = self.sessions.get(parts[1])
+        if session is None:
+            return 404, {'error': "找不到這個遊戲"}
+        if method == 'GET':
+            return 200, session.state()
+        if method == 'DELETE':
+            self.sessions.pop(session.id, None)
+            return 200, {'session': session.id, 'done': True}
+        if method == 'POST':
+            try:
+                answer = json.loads(body or b'{}').get('answer', "")
+            except (ValueError, AttributeError):
+                return 400, {'error': "請傳送 JSON，例如 {\"answer\": \"a\"}"}
+            result = await self.advance(session, str(answer))
+            return (500 if 'error' in result else 200), result
+        return 405, {'error': "不支援的方法"}
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: int, payload: dict):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        reason = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+                  413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}.get(status, "")
+        writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json; charset=utf-8\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('latin-1') + body)
+        await writer.drain()
+
+    # ---- WebSocket ----
+
+    async def handle_websocket(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, headers: dict):
+        key = headers.get('sec-websocket-key', '')
+        accept = base64.b64encode(hashlib.sha1((key + _WEBSOCKET_GUID).encode()).digest()).decode()
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode('latin-1'))
+        try:
+            session = self.create_session()
+        except RuntimeError as e:
+            await self._ws_send(writer, json.dumps({'error': str(e)}, ensure_ascii=False))
+            await self._ws_send(writer, b'', opcode=0x8)
+            return
+
+        try:
+            await self._ws_send(writer, json.dumps(await self.advance(session), ensure_ascii=False))
+            while not session.done:
+                opcode, data = await self._ws_receive(reader)
+                if opcode == 0x8:  # close
+                    break
+                if opcode == 0x9:  # ping
+                    await self._ws_send(writer, data, opcode=0xA)
+                    continue
+                if opcode != 0x1:
+                    continue
+                result = await self.advance(session, data.decode('utf-8', 'replace'))
+                await self._ws_send(writer, json.dumps(result, ensure_ascii=False))
+            await self._ws_send(writer, b'', opcode=0x8)
+        finally:
+            self.sessions.pop(session.id, None)
+
+    async def _ws_receive(self, reader: asyncio.StreamReader) -> Tuple[int, bytes]:
+        """讀一則訊息（合併分段的 frame），回傳 (opcode, 內容)"""
+        message = b''
+        message_opcode = None
+        while True:
+            first, second = await reader.readexactly(2)
+            opcode = first & 0x0F
+            length = second & 0x7F
+            if length == 126:
+                length = struct.unpack('!H', await reader.readexactly(2))[0]
+            elif length == 127:
+                length = struct.unpack('!Q', await reader.readexactly(8))[0]
+            if len(message) + length > self.max_body:
+                raise ConnectionError("WebSocket 訊息太大")
+            mask = await reader.readexactly(4) if second & 0x80 else None
+            data = await reader.readexactly(length)
+            if mask:
+                data = bytes(b ^ mask[i % 4] for i, b in enumerate(data))
+            if opcode >= 0x8:  # 控制訊息不會分段
+                return opcode, data
+            if message_opcode is None:
+                message_opcode = opcode
+            message += data
+            if first & 0x80:
+                return message_opcode, message
+
+    @staticmethod
+    async def _ws_send(writer: asyncio.StreamWriter, data, opcode: int = 0x1):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        length = len(data)
+        if length < 126:
+            header = struct.pack('!BB', 0x80 | opcode, length)
+        elif length < 1 << 16:
+            header = struct.pack('!BBH', 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+        writer.write(header + data)
+        await writer.drain()
+
+
+def run_batch(spec_paths: List[str], words: int = 0, sentences: int = 0, seed: int = None,
+              output_dir: str = None, corpus: str = None, ngram_order: int = 3, stats_path: str = None,
+              save: bool = False, grammar: str = None):
+    """
+    非互動模式：依序載入每個設定檔並輸出詞語與句子
+    有給 corpus 時改用語料訓練的 n-gram 模型造詞；有給 stats_path 時記錄生成統計並存成 JSON；
+    有給 output_dir 時另外把詞彙統計（LexiconStats）存成 <設定檔名>.lexicon.json；
+    save=True 時把每個語言存成二進位快照 <設定檔名>.lang（放在 output_dir，未指定時為目前資料夾）；
+    grammar 為 'weighted' 或 'uniform' 時句子改用 GrammarEngine 產生（每筆只有 sentence 欄位）
+    """
+    if stats_path:
+        STATS.reset()
+        STATS.enable()
+    for path in spec_paths:
+        rng = random.Random(seed)
+        game = LanguageCreatorGame.from_spec(load_language_spec(path), rng)
+        stem = os.path.splitext(os.path.basename(path))[0]
+        if save:
+            if output_dir:
+                os.makedirs(output_dir, exist_ok=True)
+            game.save(os.path.join(output_dir or '.', f"{stem}.lang"))
+        if corpus:
+            model = game.phonology.build_ngram_model(corpus, ngram_order)
+            word_stream = (model.generate_word(rng) for _ in range(words))
+        else:
+            word_stream = iter_words(game.phonology, words, rng=rng)
+        if grammar:
+            engine = GrammarEngine.from_game(game, grammar)
+            sentence_stream = ({'sentence': sentence} for batch in engine.iter_batches(sentences, rng)
+                               for sentence in batch)
+        else:
+            sentence_stream = iter_sentences(game, sentences, rng)
+
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+            game.vocabulary.stats.dump(os.path.join(output_dir, f"{stem}.lexicon.json"))
+            if words:
+                export_stream(word_stream, os.path.join(output_dir, f"{stem}.words.txt"))
+            if sentences:
+                export_stream(sentence_stream, os.path.join(output_dir, f"{stem}.sentences.jsonl"))
+        else:
+            for word in word_stream:
+                print(word)
+            for variants in sentence_stream:
+                print(json.dumps(variants, ensure_ascii=False))
+
+    if stats_path:
+        STATS.disable()
+        STATS.dump(stats_path)
+
+
+def main(argv: List[str] = None):
+    """主程式（沒有參數時進入互動遊戲）"""
+    parser = argparse.ArgumentParser(description="語言創造者遊戲")
+    parser.add_argument('--spec', nargs='+', help="語言設定檔（JSON/TOML），指定後以非互動模式執行")
+    parser.add_argument('--words', type=int, default=0, help="每個語言生成的詞語數")
+    parser.add_argument('--sentences', type=int, default=0, help="每個語言生成的句子數")
+    parser.add_argument('--seed', type=int, default=None, help="亂數種子")
+    parser.add_argument('--output-dir', help="輸出資料夾（未指定時印到標準輸出）")
+    parser.add_argument('--corpus', help="語料文字檔，指定後用音素 n-gram 模型造詞")
+    parser.add_argument('--ngram-order', type=int, default=3, help="n-gram 的 n（預設 3）")
+    parser.add_argument('--stats', help="記錄生成統計並存成 JSON 檔")
+    parser.add_argument('--save', action='store_true', help="把每個語言存成二進位快照（<設定檔名>.lang）")
+    parser.add_argument('--serve', metavar='[HOST:]PORT', help="啟動多人遊戲伺服器（HTTP/WebSocket）")
+    parser.add_argument('--translate', nargs=2, metavar=('SOURCE', 'TARGET'),
+                        help="用 --spec 的語言把法文/英文文字檔逐行翻譯成造出來的語言")
+    parser.add_argument('--dictionary', help="翻譯用的譯詞字典檔（TSV，會自動附加新詞）")
+    parser.add_argument('--grammar', choices=('weighted', 'uniform'),
+                        help="句子改用文法引擎產生（weighted：依規則權重；uniform：每種句子機率相同）")
+    parser.add_argument('--analyze', nargs=2, metavar=('SOURCE', 'TARGET'),
+                        help="用 --spec 的語言把句子檔（每行一句或 jsonl）分析回主語/動詞/賓語，標註寫成 jsonl")
+    args = parser.parse_args(argv)
+
+    if args.translate:
+        if not args.spec:
+            parser.error("--translate 需要搭配 --spec")
+        game = LanguageCreatorGame.from_spec(load_language_spec(args.spec[0]), random.Random(args.seed))
+        translator = HashTranslator(game, args.seed or 0, args.dictionary)
+        translator.translate_file(*args.translate)
+        return
+
+    if args.analyze:
+        if not args.spec:
+            parser.error("--analyze 需要搭配 --spec")
+        game = LanguageCreatorGame.from_spec(load_language_spec(args.spec[0]), random.Random(args.seed))
+        SentenceAnalyzer(game).analyze_file(*args.analyze)
+        return
+
+    if args.serve:
+        host, _, port = args.serve.rpartition(':')
+        asyncio.run(GameServer().serve(host or "127.0.0.1", int(port)))
+        return
+
+    if args.spec:
+        run_batch(args.spec, args.words, args.sentences, args.seed, args.output_dir,
+                  args.corpus, args.ngram_order, args.stats, args.save, args.grammar)
+        return
+
     game = LanguageCreatorGame()
     game.run_game()
 
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# french.py 放在專案根目錄，不是套件
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
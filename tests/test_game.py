@@ -0,0 +1,18 @@
+"""互動遊戲流程（LanguageCreatorGame 的對話產生器）"""
+from french import LanguageCreatorGame, run_dialog
+
+
+def test_level_3_gives_up_when_word_space_is_exhausted():
+    game = LanguageCreatorGame()
+    game.phonology.consonants = set()
+    game.phonology.vowels = {'a'}
+    game.phonology.syllable_patterns = ['V']
+    game.vocabulary['unknown'].append('a')  # 唯一能造出的詞已經用掉了
+    messages = []
+    game.output = messages.append
+
+    run_dialog(game.level_3_syntax_dialog(), ask=lambda prompt: "")
+    assert not game.vocabulary['noun']
+    assert any("無法補上造句需要的詞" in message for message in messages)
+    assert messages[-1].endswith("第三關完成！")
+    game.final_showcase()
@@ -0,0 +1,63 @@
+"""詞彙表（Lexicon）與串流統計（LexiconStats）"""
+import random
+
+import pytest
+
+from french import LanguageCreatorGame, Lexicon, LexiconStats
+
+
+def make_game(seed=0):
+    spec = {
+        'phonology': {'coda_restrictions': ['r', 's', 'n'], 'onset_clusters': ['tr'], 'vowel_clusters': ['ou']},
+        'vocabulary': {'noun': 300, 'verb': 100, 'adjective': ['kabo', 'katra']},
+    }
+    return LanguageCreatorGame.from_spec(spec, random.Random(seed))
+
+
+def assert_stats_current(game):
+    expected = LexiconStats.from_lexicon(game.vocabulary, game.phonology).snapshot()
+    assert game.vocabulary.stats.snapshot() == expected
+
+
+def test_stats_attached_from_the_start():
+    assert LanguageCreatorGame().vocabulary.stats is not None
+    game = make_game()
+    assert game.vocabulary.stats.words == len(game.vocabulary) == 402
+    assert_stats_current(game)
+
+
+def test_stats_follow_add_move_remove():
+    game = make_game()
+    vocabulary = game.vocabulary
+    nouns = list(vocabulary['noun'])
+    for word in nouns[:20]:
+        vocabulary.move(word, 'verb')
+    for word in nouns[20:40]:
+        vocabulary.remove(word)
+    vocabulary['adjective'].append('katroubo')
+    vocabulary.fill('adverb', game.phonology, 50, random.Random(1))
+    assert_stats_current(game)
+
+
+def test_stats_follow_inventory_changes():
+    game = make_game()
+    before = game.phonology.inventory_snapshot()
+    game.phonology.consonants.remove('r')
+    game.revalidate_vocabulary(before, random.Random(2))
+    assert 'r' not in game.vocabulary.stats.phonemes
+    assert_stats_current(game)
+
+
+@pytest.mark.parametrize('materialize', [False, True])
+def test_revalidate_snapshot_game(tmp_path, materialize):
+    path = str(tmp_path / 'lang.lang')
+    make_game().save(path)
+    game = LanguageCreatorGame.load(path, materialize)
+    size = len(game.vocabulary)
+    before = game.phonology.inventory_snapshot()
+    game.phonology.consonants.remove('r')
+    removed = game.revalidate_vocabulary(before, random.Random(3))
+    assert removed and isinstance(game.vocabulary, Lexicon)
+    assert len(game.vocabulary) == size
+    assert not any('r' in word for words in game.vocabulary.values() for word in words)
+    assert_stats_current(game)
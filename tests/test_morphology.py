@@ -0,0 +1,37 @@
+"""構詞規則（MorphologySystem）與編譯快取"""
+import pickle
+
+import pytest
+
+from french import MorphologyRule, MorphologySystem
+
+
+def make_morphology():
+    morphology = MorphologySystem()
+    morphology.add_rule('plural', 'suffix', 's', '複數')
+    morphology.add_rule('definite', 'prefix', 'la', '定冠詞')
+    return morphology
+
+
+@pytest.mark.parametrize('mutate, expected', [
+    (lambda rules: rules.__setitem__(0, MorphologyRule('plural', 'suffix', 'x', '複數')), 'box'),
+    (lambda rules: rules.__delitem__(0), 'bo'),
+    (lambda rules: rules.insert(0, MorphologyRule('plural', 'suffix', 'n', '複數')), 'bons'),
+    (lambda rules: rules.append(MorphologyRule('plural', 'suffix', 'n', '複數')), 'bosn'),
+])
+def test_in_place_rule_changes_recompile(mutate, expected):
+    morphology = make_morphology()
+    morphology.apply_rules('bo', 'noun')
+    mutate(morphology.rules)
+    assert morphology.apply_rules('bo', 'noun') == expected
+
+
+def test_reassigned_and_unpickled_rules_recompile():
+    morphology = make_morphology()
+    morphology.apply_rules('bo', 'noun')
+    morphology.rules = [MorphologyRule('plural', 'suffix', 'q', '複數')]
+    assert morphology.apply_rules('bo', 'noun') == 'boq'
+    restored = pickle.loads(pickle.dumps(morphology))
+    restored.apply_rules('bo', 'noun')
+    restored.rules[0] = MorphologyRule('plural', 'suffix', 'z', '複數')
+    assert restored.apply_rules('bo', 'noun') == 'boz'
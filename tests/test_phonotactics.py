@@ -0,0 +1,120 @@
+"""音韻自動機（PhonotacticValidator）、詞語空間排名（WordSpaceIndex）與造詞的一致性"""
+import random
+
+import pytest
+
+from french import PhonologySystem, PhonotacticValidator, VectorizedWordGenerator, WordSpaceIndex
+
+
+def make_phonology(consonants=None, vowels=None, codas=(), onsets=(), vowel_clusters=(), patterns=None):
+    phonology = PhonologySystem()
+    if consonants is not None:
+        phonology.consonants = set(consonants)
+    if vowels is not None:
+        phonology.vowels = set(vowels)
+    if patterns is not None:
+        phonology.syllable_patterns = list(patterns)
+    phonology.coda_restrictions = set(codas)
+    phonology.onset_clusters = set(onsets)
+    phonology.vowel_clusters = set(vowel_clusters)
+    return phonology
+
+
+PHONOLOGIES = {
+    'default': lambda: make_phonology(),
+    'codas': lambda: make_phonology(codas={'r', 's', 'n'}),
+    'clusters': lambda: make_phonology(codas={'r', 's'}, onsets={'tr', 'pl'}, vowel_clusters={'ou', 'ai'}),
+    'small': lambda: make_phonology({'b', 't', 'm'}, {'a', 'i', 'é'}, patterns=['CV', 'V', 'CVC']),
+    'long_onsets': lambda: make_phonology(codas={'r', 's'}, onsets={'tr', 'str'}, patterns=['CV', 'CCV', 'CCCVC', 'V']),
+}
+
+
+@pytest.mark.parametrize('name', PHONOLOGIES)
+def test_validator_accepts_generated_words(name):
+    phonology = PHONOLOGIES[name]()
+    validator = PhonotacticValidator(phonology)
+    rng = random.Random(0)
+    for syllables in (1, 2, 3, None):
+        for word in phonology.generate_words(500, syllables, rng):
+            assert validator.is_valid(word), word
+
+
+@pytest.mark.parametrize('name', PHONOLOGIES)
+def test_vectorized_words_are_valid(name):
+    np = pytest.importorskip('numpy')
+    phonology = PHONOLOGIES[name]()
+    validator = PhonotacticValidator(phonology)
+    generator = VectorizedWordGenerator(phonology, np.random.default_rng(0))
+    for syllables in (1, 2, 3):
+        for word in generator.generate(500, syllables):
+            assert validator.is_valid(word), word
+
+
+def test_validator_rejects_broken_rules():
+    phonology = make_phonology({'b', 't'}, {'a', 'i', 'é', 'à'}, codas={'t'}, patterns=['CV', 'CVC'])
+    validator = PhonotacticValidator(phonology)
+    assert validator.is_valid('bat')
+    assert not validator.is_valid('bab')      # b 不能當音節尾
+    assert not validator.is_valid('bétà')     # 兩個變音母音
+    assert not validator.is_valid('x')        # 庫存外的字元
+    assert not validator.is_valid('')
+
+
+def test_validator_follows_inventory_changes():
+    phonology = make_phonology(codas={'r', 's'}, onsets={'tr'})
+    phonology.consonants.remove('r')
+    assert phonology.coda_restrictions == {'s'}
+    assert not phonology.onset_clusters
+    validator = PhonotacticValidator(phonology)
+    assert not any('r' in word for word in phonology.generate_words(500, rng=random.Random(1)))
+    assert not validator.is_valid('tar')
+
+
+def test_rank_unrank_round_trip():
+    phonology = make_phonology({'b', 't', 'm'}, {'a', 'i', 'é'}, codas={'m'}, patterns=['CV', 'V', 'CVC'])
+    space = WordSpaceIndex(phonology, max_syllables=2)
+    words = list(space)
+    assert len(words) == space.size == len(set(words))
+    assert words == sorted(words, key=lambda w: (len(w), [space.alphabet.index(c) for c in w]))
+    validator = space.validator
+    for index, word in enumerate(words):
+        assert validator.is_valid(word)
+        assert space.rank(word) == index
+        assert space.unrank(index) == word
+
+
+def test_rank_covers_generated_words():
+    phonology = PHONOLOGIES['clusters']()
+    space = WordSpaceIndex(phonology, max_syllables=3)
+    rng = random.Random(2)
+    for word in phonology.generate_words(300, rng=rng):
+        assert space.unrank(space.rank(word)) == word
+    for index in rng.sample(range(space.size), 300):
+        assert space.rank(space.unrank(index)) == index
+    with pytest.raises(ValueError):
+        space.rank('zzzzzz')
+
+
+def test_sample_unique_has_no_duplicates():
+    phonology = make_phonology({'b', 't'}, {'a', 'i'}, patterns=['CV', 'V'])
+    space = WordSpaceIndex(phonology, max_syllables=2)
+    words = space.sample_unique(space.size, random.Random(3))
+    assert sorted(words) == sorted(space)
+    with pytest.raises(ValueError):
+        space.sample_unique(space.size + 1)
+
+
+def test_random_syllable_counts_skip_infeasible_counts():
+    phonology = make_phonology(set(), {'a', 'i', 'u'})
+    assert phonology.sampler.random_counts(phonology.syllable_patterns) == (1,)
+    assert all(len(word) == 1 for word in phonology.generate_words(200, rng=random.Random(4)))
+    phonology.vowels.clear()
+    with pytest.raises(ValueError):
+        phonology.generate_word()
+
+
+def test_vectorized_syllable_counts_skip_infeasible_counts():
+    np = pytest.importorskip('numpy')
+    phonology = make_phonology(set(), {'a', 'i', 'u'})
+    words = VectorizedWordGenerator(phonology, np.random.default_rng(4)).generate(200)
+    assert len(words) == 200 and all(len(word) == 1 for word in words)
@@ -0,0 +1,78 @@
+"""加權取樣（AliasTable）、n-gram 造詞模型與近似詞索引（NearWordIndex）"""
+import random
+
+from french import AliasTable, NearWordIndex, NgramWordModel, PhonologySystem, edit_distance
+
+
+def naive_edit_distance(a, b):
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+def test_alias_table_matches_weights():
+    weights = {'a': 1, 'b': 2, 'c': 3, 'd': 14}
+    table = AliasTable(weights)
+    rng = random.Random(0)
+    n = 100_000
+    seen = dict.fromkeys(weights, 0)
+    for _ in range(n):
+        seen[table.sample(rng)] += 1
+    total = sum(weights.values())
+    for outcome, weight in weights.items():
+        assert abs(seen[outcome] / n - weight / total) < 0.01
+
+
+def test_alias_table_single_outcome():
+    table = AliasTable({'x': 5})
+    assert {table.sample(random.Random(i)) for i in range(20)} == {'x'}
+
+
+def test_unigram_model_never_returns_empty_words():
+    model = NgramWordModel(PhonologySystem(), 1).train(['ami', 'bol'])
+    words = model.generate_words(200, random.Random(1))
+    assert all(words)
+
+
+def test_ngram_model_respects_codas():
+    phonology = PhonologySystem()
+    phonology.coda_restrictions = {'r'}
+    model = phonology.build_ngram_model(['bonjour', 'amour', 'toujours', 'dormir', 'partir', 'mot'], 2)
+    for word in model.generate_words(200, random.Random(2)):
+        assert word[-1] in phonology.vowels or word[-1] == 'r'
+
+
+def test_edit_distance_limit():
+    rng = random.Random(3)
+    for _ in range(500):
+        a = ''.join(rng.choice('abc') for _ in range(rng.randint(0, 6)))
+        b = ''.join(rng.choice('abc') for _ in range(rng.randint(0, 6)))
+        exact = naive_edit_distance(a, b)
+        assert edit_distance(a, b) == exact
+        assert edit_distance(a, b, 1) == min(exact, 2)
+
+
+def test_near_index_matches_brute_force():
+    rng = random.Random(4)
+    words = {''.join(rng.choice('abcdé') for _ in range(rng.randint(1, 7))) for _ in range(600)}
+    index = NearWordIndex(2, words)
+    removed = set(rng.sample(sorted(words), 50))
+    for word in removed:
+        index.discard(word)
+    alive = words - removed
+    assert len(index) == len(alive)
+    queries = [''.join(rng.choice('abcdé') for _ in range(rng.randint(1, 7))) for _ in range(100)]
+    for query in queries + sorted(alive)[:50]:
+        distances = {w: naive_edit_distance(query, w) for w in alive}
+        for distance in (0, 1, 2):
+            expected = sorted((d, w) for w, d in distances.items() if d <= distance)
+            assert index.search(query, distance) == expected
+            found = index.find_within(query, distance, exclude=query)
+            if found is None:
+                assert all(w == query for _, w in expected)
+            else:
+                assert found != query and naive_edit_distance(query, found) <= distance
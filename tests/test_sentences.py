@@ -0,0 +1,115 @@
+"""跨詞音變、句子分析器（SentenceAnalyzer）與文法引擎（GrammarEngine）"""
+import itertools
+import random
+
+import pytest
+
+from french import (WORD_ORDER_FORMATS, GrammarEngine, LanguageCreatorGame, SentenceAnalyzer, SentenceEngine,
+                    iter_sentences, parse_grammar_rule)
+
+
+def make_game(word_order='SVO', vocabulary=None, grammar=(), seed=0):
+    spec = {
+        'phonology': {'coda_restrictions': ['r', 's', 'n'], 'onset_clusters': ['tr'], 'vowel_clusters': ['ou']},
+        'morphology': {'plural': 's', 'definite_articles': ['le', 'la', 'les'], 'negative': ['ne', 'pas']},
+        'syntax': {'word_order': word_order, 'question_marker': '?'},
+        'vocabulary': vocabulary or {'noun': 40, 'verb': 20, 'adjective': 10},
+    }
+    if grammar:
+        spec['syntax']['grammar'] = list(grammar)
+    return LanguageCreatorGame.from_spec(spec, random.Random(seed))
+
+
+def test_elision_only_at_article_boundary():
+    game = make_game(vocabulary={'noun': ['le', 'ami'], 'verb': ['êm']})
+    assert game.apply_def_article('ami', random.Random(0)) in ("l'ami", "les ami")
+    sentences = SentenceEngine.from_game(game).generate(200, random.Random(1), columnar=True)[0]
+    assert "l'êm" not in " ".join(sentences)
+    assert any(s.startswith("le le êm") for s in sentences)
+    assert any("l'ami" in s for s in sentences)
+
+
+def test_iter_sentences_applies_articles_and_sandhi():
+    game = make_game(vocabulary={'noun': ['ami', 'bo'], 'verb': ['ki']})
+    records = list(iter_sentences(game, 2500, random.Random(5), batch_size=1000))
+    assert len(records) == 2500
+    sentences = [r['sentence'] for r in records]
+    assert any("l'ami" in s for s in sentences)
+    assert not any("le ami" in s or "la ami" in s for s in sentences)
+    assert all(r['question'] == r['sentence'] + " ?" for r in records)
+    assert all(r['negative'].count(" ne ") == 1 for r in records)
+
+
+@pytest.mark.parametrize('word_order', WORD_ORDER_FORMATS)
+def test_no_double_spaces_without_object(word_order):
+    game = make_game(word_order, vocabulary={'noun': ['ami'], 'verb': ['bol']})
+    assert "  " not in game.syntax.generate_sentence("a", "b")
+    for triple in SentenceEngine.from_game(game).generate(20, random.Random(0)):
+        assert all("  " not in s for s in triple)
+
+
+@pytest.mark.parametrize('word_order', WORD_ORDER_FORMATS)
+def test_analyzer_round_trip(word_order):
+    game = make_game(word_order)
+    analyzer = SentenceAnalyzer(game)
+    rng = random.Random(2)
+    sentences = [s for triple in SentenceEngine.from_game(game).generate(300, rng) for s in triple]
+    sentences += [game.sentence_variants(rng)['negative'] for _ in range(100)]
+    failures = [s for s in sentences if not analyzer.round_trip(s)]
+    assert not failures
+
+
+def test_analyzer_roles_follow_word_order():
+    game = make_game('OVS', vocabulary={'noun': ['bo', 'tu'], 'verb': ['ki']})
+    analysis = SentenceAnalyzer(game).analyze("le bo ne ki pas la tu ?")
+    assert analysis.ok
+    assert (analysis.object.noun, analysis.verb, analysis.subject.noun) == ('bo', 'ki', 'tu')
+    assert analysis.negative and analysis.question
+
+
+def test_parse_grammar_rule():
+    head, alternatives = parse_grammar_rule("NP -> DET adjective noun+ [2] | 'voici' noun")
+    assert head == 'NP'
+    assert alternatives == [
+        ((('nt', 'DET'), ('lex', 'adjective', False), ('lex', 'noun', True)), 2.0),
+        ((('lit', 'voici'), ('lex', 'noun', False)), 1.0),
+    ]
+
+
+def enumerate_sentences(engine):
+    """把文法展開成所有可能的句子（還沒套用跨詞音變），只適合很小的詞彙"""
+    def expand(symbols):
+        options = []
+        for symbol in symbols:
+            if symbol[0] == 'lit':
+                options.append([symbol[1]] if symbol[1] else [""])
+            elif symbol[0] == 'lex':
+                words, prefix, suffix = engine._lexical[symbol]
+                options.append([prefix + w + suffix for w in words])
+            else:
+                options.append([s for alt in engine._tables[symbol[1]][0] for s in expand(alt)])
+        return [" ".join(p for p in parts if p) for parts in itertools.product(*options)]
+    return expand((('nt', engine.grammar.start),))
+
+
+def test_grammar_templates_match_expansion():
+    game = make_game(vocabulary={'noun': ['bo', 'tu'], 'verb': ['ki'], 'adjective': ['ra']},
+                     grammar=["S -> 'voici' NP [0.5]"])
+    engine = GrammarEngine.from_game(game, 'uniform')
+    assert engine.template_count
+    derivations = enumerate_sentences(engine)
+    assert engine.count() == len(derivations) == len(set(derivations)) == 1700
+    assert engine._templates[2] == engine.count()
+
+    # 均勻抽樣下每種句子機率相同，抽 40000 次足以抽到全部 1700 種
+    expected = set(engine.sandhi.apply_many(derivations))
+    flattened = set(engine.generate(40_000, random.Random(3)))
+    engine._templates = None  # 改用逐層展開
+    expanded = set(engine.generate(40_000, random.Random(3)))
+    assert flattened == expanded == expected
+
+
+def test_grammar_rejects_recursion():
+    game = make_game(grammar=["NP -> NP adjective"])
+    with pytest.raises(ValueError):
+        GrammarEngine.from_game(game)
@@ -0,0 +1,53 @@
+"""雜湊翻譯器（HashTranslator）的來源句子解析"""
+import random
+
+import pytest
+
+from french import HashTranslator, LanguageCreatorGame
+
+
+@pytest.fixture(scope='module')
+def translator():
+    spec = {
+        'morphology': {'plural': 's', 'definite_articles': ['le', 'la', 'les'], 'negative': ['ne', 'pas']},
+        'syntax': {'word_order': 'SOV', 'question_marker': '?'},
+    }
+    return HashTranslator(LanguageCreatorGame.from_spec(spec, random.Random(0)), seed=1)
+
+
+def parse(translator, text):
+    words, negative = translator._parse(text.split())
+    return [(w.lemma, w.article, w.plural) for w in words], negative
+
+
+@pytest.mark.parametrize('contracted, expanded', [
+    ("i don't eat", "i not eat"),
+    ("i do not eat", "i not eat"),
+    ("she does not sing", "she not sing"),
+    ("they did not see the cat", "they not see the cat"),
+    ("he can't swim", "he not can swim"),
+    ("we cannot swim", "we not can swim"),
+    ("it won't rain", "it not will rain"),
+    ("you shan't pass", "you not shall pass"),
+])
+def test_english_negations(translator, contracted, expanded):
+    assert parse(translator, contracted) == parse(translator, expanded)
+    assert parse(translator, contracted)[1]
+    assert translator.translate_line(contracted) == translator.translate_line(expanded)
+
+
+@pytest.mark.parametrize('elided, full', [
+    ("j'aime le chat", "je aime le chat"),
+    ("l'ami mange", "le ami mange"),
+    ("c'est le pain d'hier", "ce est le pain de hier"),
+    ("je sais qu'il dort", "je sais que il dort"),
+    ("il n'aime pas", "il ne aime pas"),
+])
+def test_french_elisions(translator, elided, full):
+    assert parse(translator, elided) == parse(translator, full)
+    assert translator.translate_line(elided) == translator.translate_line(full)
+    assert not any("'" in lemma for lemma, _, _ in parse(translator, elided)[0])
+
+
+def test_do_stays_a_verb_without_negation(translator):
+    assert parse(translator, "i do it")[0][1][0] == 'do'